@@ -29,6 +29,7 @@ from wstore.store_commons.resource import Resource
 from wstore.store_commons.utils.name import is_valid_id
 from wstore.models import Context
 from wstore.charging_engine.models import Unit
+from wstore.store_commons.database import get_connection_stats
 
 
 def is_hidden_credit_card(number, profile_card):
@@ -278,3 +279,15 @@ class CurrencyEntry(Resource):
         context.save()
 
         return build_response(request, 204, 'No content')
+
+
+class DatabaseStatsCollection(Resource):
+
+    @authentication_required
+    def read(self, request):
+
+        # Only admins can read the statistics of the database connections
+        if not request.user.is_staff:
+            return build_response(request, 403, 'Forbidden')
+
+        return HttpResponse(json.dumps(get_connection_stats()), status=200, mimetype='application/json')
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from pymongo import ASCENDING
+
+from wstore.store_commons.database import get_database_connection
+
+db = get_database_connection()
+
+# Create SDR indexes if not created
+db.charging_engine_servicerecord.ensure_index([
+    ('contract_id', ASCENDING),
+    ('state', ASCENDING),
+    ('correlation_number', ASCENDING)
+])
+# A correlation number can only be stored once per contract, so
+# concurrent requests cannot include the same SDR twice
+db.charging_engine_servicerecord.ensure_index([
+    ('contract_id', ASCENDING),
+    ('correlation_number', ASCENDING)
+], unique=True)
+db.charging_engine_servicerecord.ensure_index('time_stamp')
+# Pending SDRs older than a limit are looked up by the batch charging
+db.charging_engine_servicerecord.ensure_index([
+    ('state', ASCENDING),
+    ('time_stamp', ASCENDING)
+])
+
+# Create renovation index if not created
+db.charging_engine_contract.ensure_index([
+    ('next_renovation_date', ASCENDING),
+    ('_id', ASCENDING)
+])
+
+# Create released correlation numbers index if not created
+db.wstore_released_correlation.ensure_index([
+    ('counter', ASCENDING),
+    ('correlation_number', ASCENDING)
+])
+
+# Create invoice outbox indexes if not created
+db.wstore_invoice_outbox.ensure_index([
+    ('state', ASCENDING),
+    ('next_attempt', ASCENDING)
+])
+db.wstore_invoice_outbox.ensure_index([
+    ('purchase', ASCENDING),
+    ('bill', ASCENDING)
+])
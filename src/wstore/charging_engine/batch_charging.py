@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import time
+from functools import partial
+from bson import ObjectId
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+from wstore.charging_engine.charging_engine import ChargingEngine
+from wstore.charging_engine.invoice_pipeline import get_invoice_pipeline
+from wstore.contracting.models import Purchase
+from wstore.store_commons.database import get_database_connection
+
+
+def get_payment_info(purchase):
+    """
+    Returns the payment info of the owner of a purchase
+    """
+    if purchase.organization_owned:
+        return purchase.owner_organization.payment_info
+    else:
+        return purchase.customer.userprofile.payment_info
+
+
+def _init_worker():
+    # Forked workers cannot share the parent database connection
+    from django.db import connection
+    connection.close()
+
+
+def _resolve_in_process(task, purchase_id):
+    """
+    Runs a charging task in a pool process, waiting for the invoices
+    generated, since the invoice workers end with the process
+    """
+    try:
+        return task(purchase_id)
+    finally:
+        get_invoice_pipeline().join()
+
+
+def _resolve_purchase(purchase_id, sdr=True, renovation_limit=None):
+    """
+    Resolves the charging of a purchase. The purchase is locked during
+    the process in order to avoid concurrent charges
+    """
+    db = get_database_connection()
+
+    # Uses an atomic operation to get and set the _lock value in the purchase
+    # document
+    pre_value = db.wstore_purchase.find_and_modify(
+        query={'_id': ObjectId(purchase_id)},
+        update={'$set': {'_lock': True}}
+    )
+
+    if pre_value is None:
+        return (purchase_id, 'failed', 'The purchase does not exist')
+
+    # If the value of _lock before setting it to true was true, means
+    # that the purchase is being processed by other process
+    if '_lock' in pre_value and pre_value['_lock']:
+        return (purchase_id, 'locked', None)
+
+    try:
+        purchase = Purchase.objects.get(pk=purchase_id)
+
+        charging = ChargingEngine(purchase, payment_method='credit_card', credit_card=get_payment_info(purchase))
+        charging.resolve_charging(sdr=sdr, renovation_limit=renovation_limit)
+        result = (purchase_id, 'charged', None)
+    except Exception, e:
+        result = (purchase_id, 'failed', unicode(e))
+    finally:
+        db.wstore_purchase.find_and_modify(
+            query={'_id': ObjectId(purchase_id)},
+            update={'$set': {'_lock': False}}
+        )
+
+    return result
+
+
+def charge_purchase(purchase_id):
+    """
+    Resolves the pending use charging of a purchase
+    """
+    return _resolve_purchase(purchase_id)
+
+
+def renovate_purchase(purchase_id, renovation_limit=None):
+    """
+    Renovates the subscriptions of a purchase expiring before the
+    given limit
+    """
+    return _resolve_purchase(purchase_id, sdr=False, renovation_limit=renovation_limit)
+
+
+class BatchChargingEngine():
+    """
+    Resolves the use charging of the contracts with pending SDRs
+    distributing them across a pool of workers
+    """
+
+    def __init__(self, workers=None, mode=None, chunk_size=None):
+        self._workers = workers or getattr(settings, 'BATCH_CHARGING_WORKERS', 4)
+        self._mode = mode or getattr(settings, 'BATCH_CHARGING_MODE', 'thread')
+        self._chunk_size = chunk_size or getattr(settings, 'BATCH_CHARGING_CHUNK_SIZE', 10)
+
+        if self._mode not in ('thread', 'process'):
+            raise ValueError('Invalid batch charging mode: ' + unicode(self._mode))
+
+    def get_pending_purchases(self, limit=None):
+        """
+        Returns the ids of the purchases whose contracts have pending
+        SDRs older than the given limit, by default one month. Contracts
+        with subscriptions are skipped since renovations are used as
+        triggers
+        """
+        db = get_database_connection()
+
+        if limit is None:
+            limit = datetime.now() - timedelta(seconds=2592000)
+
+        # Uses the SDR (state, time_stamp) index instead of scanning
+        # all the contracts
+        contract_ids = db.charging_engine_servicerecord.find({
+            'state': 'pending',
+            'time_stamp': {'$lte': limit}
+        }).distinct('contract_id')
+
+        if not len(contract_ids):
+            return []
+
+        contracts = db.charging_engine_contract.find({
+            '_id': {'$in': contract_ids},
+            'pricing_model.subscription': {'$exists': False}
+        }, fields=['purchase_id'])
+
+        return [unicode(contract['purchase_id']) for contract in contracts]
+
+    def _get_pool(self):
+        if self._mode == 'process':
+            return Pool(self._workers, initializer=_init_worker)
+
+        return ThreadPool(self._workers)
+
+    def resolve(self, purchases=None, task=charge_purchase):
+        """
+        Charges the given purchases, or the pending ones if not provided,
+        returning a report with the results. The task used to charge
+        each purchase can be provided
+        """
+        start = time.time()
+
+        if purchases is None:
+            purchases = self.get_pending_purchases()
+
+        if self._mode == 'process':
+            task = partial(_resolve_in_process, task)
+
+        results = []
+        if len(purchases):
+            pool = self._get_pool()
+            try:
+                results = pool.map(task, purchases, self._chunk_size)
+            finally:
+                pool.close()
+                pool.join()
+
+        elapsed = time.time() - start
+
+        report = {
+            'total': len(results),
+            'charged': [],
+            'locked': [],
+            'failed': {},
+            'elapsed': elapsed,
+            'throughput': 0
+        }
+
+        for purchase_id, state, error in results:
+            if state == 'failed':
+                report['failed'][purchase_id] = error
+            else:
+                report[state].append(purchase_id)
+
+        if elapsed > 0:
+            report['throughput'] = len(results) / elapsed
+
+        return report
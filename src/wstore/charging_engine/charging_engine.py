@@ -23,31 +23,35 @@ from __future__ import absolute_import
 import os
 import json
 import time
-import codecs
-import subprocess
 import threading
 from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
 from urllib2 import HTTPError
 
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 from paypalpy import paypal
 
 from django.conf import settings
-from django.template import loader, Context
+from django.db import IntegrityError
+from django.template import Context
 from django.contrib.auth.models import User
 
 from wstore.models import Resource, Organization
 from wstore.models import UserProfile, Context as WStore_context
 from wstore.models import Purchase
 from wstore.models import Offering
-from wstore.models import RSS
-from wstore.charging_engine.models import Contract
-from wstore.charging_engine.models import Unit
-from wstore.charging_engine.price_resolver import PriceResolver
+from wstore.charging_engine.models import Contract, ServiceRecord
+from wstore.charging_engine.invoice_pipeline import get_invoice_pipeline
+from wstore.charging_engine.invoice_renderer import get_bill_template
+from wstore.charging_engine.payment_client.registry import payment_clients
+from wstore.charging_engine.price_resolver import get_price_resolver, CURRENCY_EXPONENTS
 from wstore.contracting.purchase_rollback import rollback
-from wstore.rss_adaptor.rss_adaptor import RSSAdaptorThread
+from wstore.rss_adaptor.cdr_outbox import queue_cdrs
 from wstore.rss_adaptor.utils.rss_codes import get_country_code, get_curency_code
 from wstore.rss_adaptor.rss_manager_factory import RSSManagerFactory
+from wstore.store_commons.config_cache import config_cache
 from wstore.store_commons.database import get_database_connection
 
 
@@ -104,19 +108,10 @@ class ChargingEngine:
                 update={'$set': {'_lock': False}}
             )
 
-    def _fix_price(self, price):
-
-        price = str(price)
-
-        if price.find('.') != -1:
-            splited_price = price.split('.')
-
-            if len(splited_price[1]) > 2:
-                price = splited_price[0] + '.' + splited_price[1][:2]
-            elif len(splited_price[1]) < 2:
-                price = price + '0'
-
-        return price
+    def _fix_price(self, price, currency):
+        # Prices are rounded to the minor unit of the currency
+        exponent = CURRENCY_EXPONENTS.get((currency or '').upper(), 2)
+        return str(Decimal(unicode(price)).quantize(Decimal(10) ** -exponent, ROUND_HALF_UP))
 
     def _get_country_code(self, country):
 
@@ -131,23 +126,16 @@ class ChargingEngine:
 
     def _charge_client(self, price, concept, currency):
 
-        # Load payment client
-        cln_str = settings.PAYMENT_CLIENT
-        client_class = cln_str.split('.')[-1]
-        client_package = cln_str.partition('.' + client_class)[0]
-
-        payment_client = getattr(__import__(client_package, globals(), locals(), [client_class], -1), client_class)
-
         # build the payment client
-        client = payment_client(self._purchase)
-        price = self._fix_price(price)
+        client = payment_clients.get_client(self._purchase)
+        price = self._fix_price(price, currency)
 
         if self._payment_method == 'credit_card':
-            client.direct_payment(currency, price, self._credit_card_info)
+            payment_clients.call(client, 'direct_payment', currency, price, self._credit_card_info)
             self._purchase.state = 'paid'
 
         elif self._payment_method == 'paypal':
-            client.start_redirection_payment(price, currency)
+            payment_clients.call(client, 'start_redirection_payment', price, currency)
 
             checkout_url = client.get_checkout_url()
 
@@ -162,31 +150,76 @@ class ChargingEngine:
         else:
             raise Exception('Invalid payment method')
 
-    def _generate_cdr_part(self, part, model, cdr_info):
+    def _get_correlation_counter(self, rss):
         # Create connection for raw database access
         db = get_database_connection()
 
-        # Take and increment the correlation number using
-        # the mongoDB atomic access in order to avoid race
-        # problems
+        if rss.api_version == 1:
+            # Version 1 uses a global correlation number
+            return db.wstore_rss, ObjectId(rss.pk)
+        else:
+            # Version 2 uses a correlation number per provider
+            return db.wstore_organization, ObjectId(self._purchase.owner_organization.pk)
+
+    def _reserve_correlation_numbers(self, rss, number):
+        """
+        Reserves the correlation numbers of a charge, returning them in
+        a list. The numbers released by failed charges are only reused
+        when the whole charge fits in them, otherwise the numbers are
+        reserved as a block of consecutive numbers with a single atomic
+        increment, so the CDRs of a charge are never numbered partly
+        below and partly above the numbers already sent
+        """
+        collection, counter_id = self._get_correlation_counter(rss)
+        db = get_database_connection()
+
+        numbers = []
+        while len(numbers) < number:
+            released = db.wstore_released_correlation.find_and_modify(
+                query={'counter': counter_id},
+                sort=[('correlation_number', ASCENDING)],
+                remove=True
+            )
+
+            if released is None:
+                break
+
+            numbers.append(released['correlation_number'])
+
+        if len(numbers) == number:
+            return numbers
+
+        # The charge does not fit in the released numbers, so they
+        # are kept for a smaller charge
+        if len(numbers):
+            self._release_correlation_numbers(rss, numbers)
+
+        first = collection.find_and_modify(
+            query={'_id': counter_id},
+            update={'$inc': {'correlation_number': number}}
+        )['correlation_number']
+
+        return range(first, first + number)
+
+    def _release_correlation_numbers(self, rss, numbers):
+        """
+        Records the correlation numbers whose CDRs could not be generated,
+        so they are used by the next charge instead of leaving gaps
+        """
+        collection, counter_id = self._get_correlation_counter(rss)
+        db = get_database_connection()
+
+        db.wstore_released_correlation.insert([{
+            'counter': counter_id,
+            'correlation_number': correlation_number
+        } for correlation_number in numbers])
+
+    def _generate_cdr_part(self, part, model, cdr_info, corr_number):
         currency = self._price_model['general_currency']
 
         if cdr_info['rss'].api_version == 1:
-            # Version 1 uses a global correlation number
-            corr_number = db.wstore_rss.find_and_modify(
-                query={'_id': ObjectId(cdr_info['rss'].pk)},
-                update={'$inc': {'correlation_number': 1}}
-            )['correlation_number']
-
             currency = get_curency_code(self._price_model['general_currency'])
 
-        else:
-            # Version 2 uses a correlation number per provider
-            corr_number = db.wstore_organization.find_and_modify(
-                query={'_id': ObjectId(self._purchase.owner_organization.pk)},
-                update={'$inc': {'correlation_number': 1}}
-            )['correlation_number']
-
         return {
             'provider': cdr_info['provider'],
             'service': cdr_info['service_name'],
@@ -210,14 +243,13 @@ class ChargingEngine:
 
     def _generate_cdr(self, applied_parts, time_stamp, price=None):
 
-        cdrs = []
+        # Parts to be included in CDRs with their model and description
+        cdr_parts = []
 
         # Take the first RSS registered
-        rss_collection = RSS.objects.all()
-
-        if len(rss_collection) > 0:
-            rss = RSS.objects.all()[0]
+        rss = config_cache.get_rss()
 
+        if rss is not None:
             # Get the provider (Organization)
             if rss.api_version == 1:
                 provider = settings.STORE_NAME.lower() + '-provider'
@@ -266,8 +298,8 @@ class ChargingEngine:
                     'value': price,
                     'currency': self._price_model['general_currency']
                 }
-                cdr_info['description'] = 'Complete Charging event: ' + str(price) + ' ' + self._price_model['general_currency']
-                cdrs.append(self._generate_cdr_part(aggregated_part, 'Charging event', cdr_info))
+                description = 'Complete Charging event: ' + str(price) + ' ' + self._price_model['general_currency']
+                cdr_parts.append((aggregated_part, 'Charging event', description))
 
             else:
                 # Check the type of the applied parts
@@ -275,15 +307,15 @@ class ChargingEngine:
 
                     # A cdr is generated for every price part
                     for part in applied_parts['single_payment']:
-                        cdr_info['description'] = 'Single payment: ' + part['value'] + ' ' + self._price_model['general_currency']
-                        cdrs.append(self._generate_cdr_part(part, 'Single payment event', cdr_info))
+                        description = 'Single payment: ' + part['value'] + ' ' + self._price_model['general_currency']
+                        cdr_parts.append((part, 'Single payment event', description))
 
                 if 'subscription' in applied_parts:
 
                     # A cdr is generated by price part
                     for part in applied_parts['subscription']:
-                        cdr_info['description'] = 'Subscription: ' + part['value'] + ' ' + self._price_model['general_currency'] + ' ' + part['unit']
-                        cdrs.append(self._generate_cdr_part(part, 'Subscription event', cdr_info))
+                        description = 'Subscription: ' + part['value'] + ' ' + self._price_model['general_currency'] + ' ' + part['unit']
+                        cdr_parts.append((part, 'Subscription event', description))
 
                 if 'charges' in applied_parts:
 
@@ -293,7 +325,7 @@ class ChargingEngine:
                             'value': part['price'],
                         }
                         if 'price_function' in part['model']:
-                            cdr_info['description'] = part['model']['text_function']
+                            description = part['model']['text_function']
                             use_part['currency'] = self._price_model['general_currency']
                         else:
                             use_part['currency'] = self._price_model['general_currency']
@@ -302,13 +334,29 @@ class ChargingEngine:
                             use = 0
                             for sdr in part['accounting']:
                                 use += int(sdr['value'])
-                            cdr_info['description'] = 'Fee per ' + part['model']['unit'] + ', Consumption: ' + str(use)
+                            description = 'Fee per ' + part['model']['unit'] + ', Consumption: ' + str(use)
+
+                        cdr_parts.append((use_part, 'Pay per use event', description))
 
-                        cdrs.append(self._generate_cdr_part(use_part, 'Pay per use event', cdr_info))
+            if not len(cdr_parts):
+                return
 
-            # Send the created CDRs to the Revenue Sharing System
-            r = RSSAdaptorThread(rss, cdrs)
-            r.start()
+            # The correlation numbers of the charge are reserved at once
+            # and assigned to the CDRs locally
+            numbers = self._reserve_correlation_numbers(rss, len(cdr_parts))
+
+            try:
+                cdrs = []
+                for i, (part, model, description) in enumerate(cdr_parts):
+                    cdr_info['description'] = description
+                    cdrs.append(self._generate_cdr_part(part, model, cdr_info, numbers[i]))
+
+                # Include the created CDRs in the outbox to be sent
+                # to the Revenue Sharing System
+                queue_cdrs(rss, cdrs)
+            except:
+                self._release_correlation_numbers(rss, numbers)
+                raise
 
     def _generate_invoice(self, price, applied_parts, type_):
 
@@ -329,7 +377,7 @@ class ChargingEngine:
                     parts['subs_parts'].append((part['label'], part['value'], currency, part['unit'], str(part['renovation_date'])))
 
             # Get the bill template
-            bill_template = loader.get_template('contracting/bill_template_initial.html')
+            bill_template = get_bill_template('contracting/bill_template_initial.html')
 
         elif type_ == 'renovation':
             parts = {
@@ -390,7 +438,7 @@ class ChargingEngine:
                     parts['deduct_subtotal'] += part['price']
 
             # Get the bill template
-            bill_template = loader.get_template('contracting/bill_template_renovation.html')
+            bill_template = get_bill_template('contracting/bill_template_renovation.html')
 
         elif type_ == 'use':
             # If use, can only contain pay per use parts or deductions
@@ -441,7 +489,7 @@ class ChargingEngine:
                     parts['deduct_subtotal'] += part['price']
 
             # Get the bill template
-            bill_template = loader.get_template('contracting/bill_template_use.html')
+            bill_template = get_bill_template('contracting/bill_template_use.html')
 
         tax = self._purchase.tax_address
 
@@ -536,36 +584,25 @@ class ChargingEngine:
 
         bill_code = bill_template.render(Context(context))
 
-        # Create the bill code file
         invoice_name = self._purchase.ref + '_' + date
-        bill_path = os.path.join(settings.BILL_ROOT, invoice_name + '.html')
-        f = codecs.open(bill_path, 'wb', 'utf-8')
-        f.write(bill_code)
-        f.close()
+        bill = os.path.join(settings.MEDIA_URL, 'bills/' + invoice_name + '.pdf')
 
-        in_name = bill_path[:-4] + 'pdf'
-
-        if os.path.exists(in_name):
-            in_name = bill_path[:-5] + '_1.pdf'
+        if bill in self._purchase.bill or os.path.exists(os.path.join(settings.BILL_ROOT, invoice_name + '.pdf')):
             invoice_name += '_1'
+            bill = os.path.join(settings.MEDIA_URL, 'bills/' + invoice_name + '.pdf')
 
-        # Compile the bill file
-        try:
-            subprocess.call([settings.BASEDIR + '/create_invoice.sh', bill_path, in_name])
-        except:
-            raise Exception('Invoice generation problem')
-
-        # Remove temporal files
-        for file_ in os.listdir(settings.BILL_ROOT):
-
-            if not file_.endswith('.pdf'):
-                os.remove(os.path.join(settings.BILL_ROOT, file_))
-
-        # Load bill path into the purchase
-        self._purchase.bill.append(os.path.join(settings.MEDIA_URL, 'bills/' + invoice_name + '.pdf'))
-
+        # Load bill path into the purchase, the bill remains pending
+        # while its invoice is in the outbox of the invoice pipeline
+        self._purchase.bill.append(bill)
         self._purchase.save()
 
+        get_invoice_pipeline().submit({
+            'purchase': self._purchase.pk,
+            'bill': bill,
+            'bill_code': bill_code,
+            'invoice_name': invoice_name
+        })
+
     def _create_purchase_contract(self):
         # Generate the pricing model structure
         offering = self._purchase.offering
@@ -614,7 +651,7 @@ class ChargingEngine:
 
                 # Check price component unit
                 try:
-                    unit = Unit.objects.get(name=comp['unit'])
+                    unit = config_cache.get_unit(comp['unit'])
                 except:
                     raise(Exception, 'Unsupported unit in price plan model')
 
@@ -647,7 +684,7 @@ class ChargingEngine:
                     price_model['deductions'] = []
 
                 if 'price_function' not in deduct:
-                    unit = Unit.objects.get(name=deduct['unit'])
+                    unit = config_cache.get_unit(deduct['unit'])
 
                     # Deductions only can define use based discounts
                     if unit.defined_model != 'pay per use':
@@ -674,35 +711,52 @@ class ChargingEngine:
         Contract.objects.create(
             pricing_model=price_model,
             charges=[],
-            applied_sdrs=[],
             purchase=self._purchase,
             revenue_class=revenue_class
         )
         self._price_model = price_model
 
-    def _calculate_renovation_date(self, unit):
+    def _calculate_renovation_date(self, unit, start=None):
 
-        unit_model = Unit.objects.get(name=unit)
+        unit_model = config_cache.get_unit(unit)
 
+        # Renovated subscriptions are extended from their previous
+        # renovation date, so renovating them in advance does not
+        # shorten the subscription period. Overdue subscriptions are
+        # extended from now, so the new date is not already due
         now = datetime.now()
-        # Transform now date into seconds
-        now = time.mktime(now.timetuple())
+        if start is None or start < now:
+            start = now
+
+        # Transform start date into seconds
+        start = time.mktime(start.timetuple())
 
-        renovation_date = now + (unit_model.renovation_period * 86400)  # Seconds in a day
+        renovation_date = start + (unit_model.renovation_period * 86400)  # Seconds in a day
 
         renovation_date = datetime.fromtimestamp(renovation_date)
         return renovation_date
 
-    def include_sdr(self, sdr):
-        # Check the offering and customer
-        off_data = sdr['offering']
+    def _get_next_renovation_date(self, pricing_model):
+        """
+        Returns the nearest renovation date of the subscriptions
+        of a pricing model
+        """
+        renovation_dates = [s['renovation_date'] for s in pricing_model.get('subscription', []) if s.get('renovation_date')]
+
+        if not len(renovation_dates):
+            return None
+
+        return min(renovation_dates)
+
+    def _check_sdr_offering(self, off_data):
         org = Organization.objects.get(name=off_data['organization'])
         offering = Offering.objects.get(name=off_data['name'], owner_organization=org, version=off_data['version'])
 
         if offering != self._purchase.offering:
             raise Exception('The offering defined in the SDR is not the purchase offering')
 
-        customer = User.objects.get(username=sdr['customer'])
+    def _check_sdr_customer(self, username):
+        customer = User.objects.get(username=username)
 
         if self._purchase.organization_owned:
             # Check if the user belongs to the organization
@@ -721,43 +775,74 @@ class ChargingEngine:
             if customer != self._purchase.customer:
                 raise Exception('The user has not purchased the offering')
 
-        # Extract the pricing model from the purchase
-        self._price_model = self._purchase.contract.pricing_model
-
-        if 'pay_per_use' not in self._price_model:
-            raise Exception('No pay per use parts in the pricing model of the offering')
-
-        # Check the correlation number and timestamp
-        applied_sdrs = self._purchase.contract.applied_sdrs
-        pending_sdrs = self._purchase.contract.pending_sdrs
+    def _get_last_sdr_info(self):
+        """
+        Returns the correlation number and the time stamp (in seconds)
+        of the last SDR received for the contract
+        """
         last_corr = 0
         last_time = 0
 
-        if len(pending_sdrs) > 0:
-            last_corr = int(pending_sdrs[-1]['correlation_number'])
-            last_time = pending_sdrs[-1]['time_stamp']
-            last_time = time.mktime(last_time.timetuple())
-        else:
-            if len(applied_sdrs) > 0:
-                last_corr = int(applied_sdrs[-1]['correlation_number'])
-                last_time = applied_sdrs[-1]['time_stamp']
-                last_time = time.mktime(last_time.timetuple())
+        # Pending SDRs are the most recent ones, so applied SDRs
+        # are only checked if there is not any pending SDR
+        for state in ('pending', 'applied'):
+            last_sdr = ServiceRecord.objects.filter(
+                contract=self._purchase.contract, state=state).order_by('-correlation_number')[:1]
+
+            if len(last_sdr) > 0:
+                last_corr = last_sdr[0].correlation_number
+                last_time = time.mktime(last_sdr[0].time_stamp.timetuple())
+                break
+
+        return last_corr, last_time
+
+    def _get_pending_sdrs(self):
+        """
+        Returns the pending SDRs of the contract sorted by correlation number
+        """
+        pending_sdrs = ServiceRecord.objects.filter(
+            contract=self._purchase.contract, state='pending').order_by('correlation_number')
 
+        return [sdr.get_info() for sdr in pending_sdrs]
+
+    def _get_sdr_fields(self, sdr, time_stamp):
+        return {
+            'state': 'pending',
+            'correlation_number': int(sdr['correlation_number']),
+            'time_stamp': time_stamp,
+            'offering': sdr['offering'],
+            'customer': sdr['customer'],
+            'record_type': sdr['record_type'],
+            'unit': sdr['unit'],
+            'value': unicode(sdr['value']),
+            'component_label': sdr.get('component_label', '')
+        }
+
+    def _apply_pending_sdrs(self, accounting):
+        """
+        Moves the SDRs included in a charge from pending to applied
+        """
+        pending_sdrs = ServiceRecord.objects.filter(contract=self._purchase.contract, state='pending')
+
+        # SDRs received while the charge was being processed remain pending
+        if 'last_correlation_number' in accounting:
+            pending_sdrs = pending_sdrs.filter(correlation_number__lte=accounting['last_correlation_number'])
+
+        pending_sdrs.update(state='applied')
+
+    def _parse_sdr_time_stamp(self, sdr):
         try:
             time_stamp = datetime.strptime(sdr['time_stamp'], '%Y-%m-%dT%H:%M:%S.%f')
         except:
             time_stamp = datetime.strptime(sdr['time_stamp'], '%Y-%m-%d %H:%M:%S.%f')
 
-        time_stamp_sec = time.mktime(time_stamp.timetuple())
+        return time_stamp
 
-        if (int(sdr['correlation_number']) != last_corr + 1):
-            raise Exception('Invalid correlation number, expected: ' + str(last_corr + 1))
-
-        if last_time > time_stamp_sec:
-            raise Exception('Invalid time stamp')
-
-        # Check unit or component_label depending if the model defines components or
-        # price functions
+    def _check_sdr_model(self, sdr):
+        """
+        Checks the unit or component_label of the SDR depending if the model
+        defines components or price functions
+        """
         found_model = False
         for comp in self._price_model['pay_per_use']:
             if 'price_function' not in comp:
@@ -784,14 +869,142 @@ class ChargingEngine:
                             found_deduction = True
                             break
 
-        if found_model or found_deduction:
-            # Store the SDR
-            sdr['time_stamp'] = time_stamp
-            self._purchase.contract.pending_sdrs.append(sdr)
-        else:
+        if not found_model and not found_deduction:
             raise Exception('The specified unit or component label is not included in the pricing model')
 
-        self._purchase.contract.save()
+    def include_sdr(self, sdr):
+        # Check the offering and customer
+        self._check_sdr_offering(sdr['offering'])
+        self._check_sdr_customer(sdr['customer'])
+
+        # Extract the pricing model from the purchase
+        self._price_model = self._purchase.contract.pricing_model
+
+        if 'pay_per_use' not in self._price_model:
+            raise Exception('No pay per use parts in the pricing model of the offering')
+
+        # Check the correlation number and timestamp
+        last_corr, last_time = self._get_last_sdr_info()
+        time_stamp = self._parse_sdr_time_stamp(sdr)
+        time_stamp_sec = time.mktime(time_stamp.timetuple())
+
+        if (int(sdr['correlation_number']) != last_corr + 1):
+            raise Exception('Invalid correlation number, expected: ' + str(last_corr + 1))
+
+        if last_time > time_stamp_sec:
+            raise Exception('Invalid time stamp')
+
+        self._check_sdr_model(sdr)
+
+        # Store the SDR, the correlation number may have been stored by
+        # a concurrent request after reading the last one
+        try:
+            ServiceRecord.objects.create(contract=self._purchase.contract, **self._get_sdr_fields(sdr, time_stamp))
+        except IntegrityError:
+            raise Exception('Invalid correlation number, ' + str(sdr['correlation_number']) + ' has already been received')
+
+    def _cached_check(self, cache, key, check, arg):
+        """
+        Runs a validation only once per key, caching its error message
+        """
+        if key not in cache:
+            try:
+                check(arg)
+                cache[key] = None
+            except Exception, e:
+                cache[key] = unicode(e.message)
+
+        if cache[key] is not None:
+            raise Exception(cache[key])
+
+    def include_sdrs(self, sdrs):
+        """
+        Includes a batch of SDRs validating the whole batch in memory and
+        storing the accepted ones with a single bulk insert. A result
+        is returned per record so rejected SDRs can be resent individually
+        """
+        # Extract the pricing model from the purchase
+        self._price_model = self._purchase.contract.pricing_model
+
+        if 'pay_per_use' not in self._price_model:
+            raise Exception('No pay per use parts in the pricing model of the offering')
+
+        last_corr, last_time = self._get_last_sdr_info()
+
+        checked_offerings = {}
+        checked_customers = {}
+        accepted = []
+        results = []
+
+        for sdr in sdrs:
+            try:
+                off_data = sdr['offering']
+                off_key = (off_data['organization'], off_data['name'], off_data['version'])
+
+                self._cached_check(checked_offerings, off_key, self._check_sdr_offering, off_data)
+                self._cached_check(checked_customers, sdr['customer'], self._check_sdr_customer, sdr['customer'])
+
+                time_stamp = self._parse_sdr_time_stamp(sdr)
+                time_stamp_sec = time.mktime(time_stamp.timetuple())
+
+                if (int(sdr['correlation_number']) != last_corr + 1):
+                    raise Exception('Invalid correlation number, expected: ' + str(last_corr + 1))
+
+                if last_time > time_stamp_sec:
+                    raise Exception('Invalid time stamp')
+
+                self._check_sdr_model(sdr)
+            except Exception, e:
+                results.append({
+                    'correlation_number': sdr.get('correlation_number'),
+                    'result': 'rejected',
+                    'reason': unicode(e.message)
+                })
+                continue
+
+            # The continuity of the next SDRs is checked against the accepted ones
+            last_corr += 1
+            last_time = time_stamp_sec
+
+            accepted.append(self._get_sdr_fields(sdr, time_stamp))
+            results.append({
+                'correlation_number': sdr['correlation_number'],
+                'result': 'accepted'
+            })
+
+        if len(accepted) > 0:
+            self._insert_sdrs(accepted, results)
+
+        return results
+
+    def _insert_sdrs(self, accepted, results):
+        """
+        Inserts the accepted SDRs in a single request. The SDRs whose
+        correlation number has been stored by a concurrent request are
+        rejected by the unique index of the collection
+        """
+        db = get_database_connection()
+        contract_id = ObjectId(self._purchase.contract.pk)
+
+        for sdr in accepted:
+            sdr['_id'] = ObjectId()
+            sdr['contract_id'] = contract_id
+
+        try:
+            db.charging_engine_servicerecord.insert(accepted, continue_on_error=True)
+        except DuplicateKeyError:
+            # Only the last error is reported, so the stored SDRs are read
+            stored = db.charging_engine_servicerecord.find({
+                '_id': {'$in': [sdr['_id'] for sdr in accepted]}
+            }, fields=['_id'])
+            stored = set([sdr['_id'] for sdr in stored])
+
+            duplicated = set([sdr['correlation_number'] for sdr in accepted if sdr['_id'] not in stored])
+
+            for result in results:
+                if result['result'] == 'accepted' and int(result['correlation_number']) in duplicated:
+                    result['result'] = 'rejected'
+                    result['reason'] = 'Invalid correlation number, ' + unicode(result['correlation_number']) + ' has already been received'
 
     def _check_expenditure_limits(self, price):
         """
@@ -799,10 +1012,9 @@ class ChargingEngine:
         expenditure limits and ir accumulated balance thought the RSS
         """
         # Check is an RSS instance is registered
-        if not RSS.objects.all():
+        rss = config_cache.get_rss()
+        if rss is None:
             return
-        else:
-            rss = RSS.objects.all()[0]
 
         actor = None
         # Check who is the charging actor (user or organization)
@@ -852,7 +1064,7 @@ class ChargingEngine:
         self._expenditure_used = True
 
     def _update_actor_balance(self, price):
-        rss = RSS.objects.all()[0]
+        rss = config_cache.get_rss()
 
         actor = None
         # Check who is the charging actor (user or organization)
@@ -931,7 +1143,7 @@ class ChargingEngine:
         elif concept == 'Renovation':
 
             for subs in related_model['subscription']:
-                subs['renovation_date'] = self._calculate_renovation_date(subs['unit'])
+                subs['renovation_date'] = self._calculate_renovation_date(subs['unit'], subs.get('renovation_date'))
 
             updated_subscriptions = related_model['subscription']
             if 'unmodified' in related_model:
@@ -944,20 +1156,21 @@ class ChargingEngine:
             if accounting:
                 related_model['charges'] = accounting['charges']
                 related_model['deductions'] = accounting['deductions']
-                contract.applied_sdrs.extend(contract.pending_sdrs)
-                contract.pending_sdrs = []
+                self._apply_pending_sdrs(accounting)
 
             self._generate_invoice(price, related_model, 'renovation')
 
         elif concept == 'pay per use':
             # Move SDR from pending to applied
-            contract.applied_sdrs.extend(contract.pending_sdrs)
-            contract.pending_sdrs = []
+            self._apply_pending_sdrs(accounting)
             # Generate the invoice
             self._generate_invoice(price, accounting, 'use')
             related_model['charges'] = accounting['charges']
             related_model['deductions'] = accounting['deductions']
 
+        # Keep the renovation date used by the scheduler up to date
+        contract.next_renovation_date = self._get_next_renovation_date(contract.pricing_model)
+
         # The contract is saved before the CDR creation to prevent
         # that a transmission error in RSS request causes the
         # customer being charged twice
@@ -969,7 +1182,7 @@ class ChargingEngine:
             if self._expenditure_used:
                 self._update_actor_balance(price)
 
-    def resolve_charging(self, new_purchase=False, sdr=False):
+    def resolve_charging(self, new_purchase=False, sdr=False, renovation_limit=None):
 
         # Check if there is a new purchase
         if new_purchase:
@@ -990,7 +1203,7 @@ class ChargingEngine:
             price = 0
             if charge:
                 # Call the price resolver
-                resolver = PriceResolver()
+                resolver = get_price_resolver(self._price_model['general_currency'])
                 price = resolver.resolve_price(related_model)
 
                 # Check user expenditure limits and accumulated balance
@@ -1005,7 +1218,7 @@ class ChargingEngine:
             if self._purchase.state == 'paid':
                 self.end_charging(price, 'initial charge', related_model)
             else:
-                price = self._fix_price(price)
+                price = self._fix_price(price, self._price_model['general_currency'])
                 self._purchase.contract.pending_payment = {
                     'price': price,
                     'concept': 'initial charge',
@@ -1029,7 +1242,9 @@ class ChargingEngine:
                     'subscription': []
                 }
 
-                now = datetime.now()
+                # Subscriptions are renovated if they expire before the
+                # provided limit, by default now
+                now = renovation_limit or datetime.now()
                 unmodified = []
 
                 for s in self._price_model['subscription']:
@@ -1042,16 +1257,16 @@ class ChargingEngine:
 
                 accounting_info = None
                 # If pending SDR documents resolve the use charging
-                if len(self._purchase.contract.pending_sdrs) > 0:
+                pending_sdrs = self._get_pending_sdrs()
+                if len(pending_sdrs) > 0:
                     related_model['pay_per_use'] = self._price_model['pay_per_use']
-                    accounting_info = []
-                    accounting_info.extend(self._purchase.contract.pending_sdrs)
+                    accounting_info = pending_sdrs
 
                 # If deductions have been included resolve the discount
                 if 'deductions' in self._price_model and len(self._price_model['deductions']) > 0:
                     related_model['deductions'] = self._price_model['deductions']
 
-                resolver = PriceResolver()
+                resolver = get_price_resolver(self._price_model['general_currency'])
                 price = resolver.resolve_price(related_model, accounting_info)
 
                 # Deductions can make the price 0
@@ -1069,11 +1284,12 @@ class ChargingEngine:
                 applied_accounting = None
                 if accounting_info:
                     applied_accounting = resolver.get_applied_sdr()
+                    applied_accounting['last_correlation_number'] = accounting_info[-1]['correlation_number']
 
                 if self._purchase.state == 'paid':
                     self.end_charging(price, 'Renovation', related_model, applied_accounting)
                 else:
-                    price = self._fix_price(price)
+                    price = self._fix_price(price, self._price_model['general_currency'])
                     pending_payment = {
                         'price': price,
                         'concept': 'Renovation',
@@ -1092,8 +1308,7 @@ class ChargingEngine:
             # made of a service.
             else:
                 # Aggregate the calculated charges
-                pending_sdrs = []
-                pending_sdrs.extend(self._purchase.contract.pending_sdrs)
+                pending_sdrs = self._get_pending_sdrs()
 
                 if len(pending_sdrs) == 0:
                     raise Exception('No SDRs to charge')
@@ -1105,7 +1320,7 @@ class ChargingEngine:
                 if 'deductions' in self._price_model and len(self._price_model['deductions']) > 0:
                     related_model['deductions'] = self._price_model['deductions']
 
-                resolver = PriceResolver()
+                resolver = get_price_resolver(self._price_model['general_currency'])
                 price = resolver.resolve_price(related_model, pending_sdrs)
                 # Charge the client
 
@@ -1114,11 +1329,12 @@ class ChargingEngine:
                     redirect_url = self._charge_client(price, 'Pay per use', self._price_model['general_currency'])
 
                 applied_accounting = resolver.get_applied_sdr()
+                applied_accounting['last_correlation_number'] = pending_sdrs[-1]['correlation_number']
 
                 if self._purchase.state == 'paid':
                     self.end_charging(price, 'pay per use', related_model, applied_accounting)
                 else:
-                    price = self._fix_price(price)
+                    price = self._fix_price(price, self._price_model['general_currency'])
                     self._purchase.contract.pending_payment = {
                         'price': price,
                         'concept': 'pay per use',
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import os
+import codecs
+import shutil
+import tempfile
+import threading
+from bson import ObjectId
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+
+from django.conf import settings
+
+from wstore.charging_engine.invoice_renderer import get_invoice_renderer
+from wstore.store_commons.database import get_database_connection
+from wstore.store_commons.response_cache import bump_version
+
+
+def render_invoice(job):
+    """
+    Compiles the HTML code of an invoice into its PDF file. The
+    temporal files are created in a directory owned by the job
+    """
+    work_dir = tempfile.mkdtemp(prefix='invoice_')
+
+    try:
+        bill_path = os.path.join(work_dir, job['invoice_name'] + '.html')
+        pdf_path = os.path.join(work_dir, job['invoice_name'] + '.pdf')
+
+        f = codecs.open(bill_path, 'wb', 'utf-8')
+        f.write(job['bill_code'])
+        f.close()
+
+        # Compile the bill file
+        get_invoice_renderer().render(bill_path, pdf_path)
+
+        shutil.move(pdf_path, os.path.join(settings.BILL_ROOT, job['invoice_name'] + '.pdf'))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_pending_bills(purchases):
+    """
+    Returns the bills of the given purchases whose invoice has not been
+    compiled yet, the invoice outbox is the only record of these bills
+    so they are not lost by saving a purchase loaded before
+    """
+    db = get_database_connection()
+    pending_bills = dict([(purchase, []) for purchase in purchases])
+
+    if len(purchases):
+        for doc in db.wstore_invoice_outbox.find({'purchase': {'$in': purchases}}, ['purchase', 'bill']):
+            pending_bills[doc['purchase']].append(doc['bill'])
+
+    return pending_bills
+
+
+# Seconds between checks of the outbox when there is nothing to render
+POLL_INTERVAL = 5
+
+
+class InvoicePipeline():
+    """
+    Renders the invoices stored in the invoice outbox using a bounded
+    pool of worker threads, so the invoices are not lost if the process
+    ends before rendering them. Failed renders are retried with an
+    increasing delay, the invoices that reach the maximum number of
+    retries remain in the outbox as failed
+    """
+
+    def __init__(self, workers, max_retries=3, retry_delay=30, claim_timeout=300):
+        self._workers = workers
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        # Time after which the invoices being rendered by a dead
+        # process can be claimed again
+        self._claim_timeout = claim_timeout
+        self._threads = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        # Outbox ids of the invoices submitted by this process
+        self._submitted = []
+
+    def _start(self):
+        with self._lock:
+            if len(self._threads):
+                return
+
+            self._stopped.clear()
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                dispatched = self.dispatch_job()
+            except:
+                dispatched = 0
+
+            if dispatched:
+                # Wake up the threads waiting for the submitted invoices
+                self._notify()
+            else:
+                with self._cond:
+                    self._cond.wait(POLL_INTERVAL)
+
+    def _claim_job(self):
+        """
+        Marks as being rendered the oldest invoice of the outbox that
+        is ready to be rendered
+        """
+        db = get_database_connection()
+        now = datetime.now()
+
+        return db.wstore_invoice_outbox.find_and_modify({
+            '$or': [
+                {'state': 'pending', 'next_attempt': {'$lte': now}},
+                {'state': 'rendering', 'claimed': {'$lte': now - timedelta(seconds=self._claim_timeout)}}
+            ]
+        }, {
+            '$set': {
+                'state': 'rendering',
+                'claimed': now,
+                'claim': ObjectId()
+            }
+        }, sort=[('created', ASCENDING)], new=True)
+
+    def _retry(self, doc, error):
+        db = get_database_connection()
+        attempts = doc['attempts'] + 1
+        update = {
+            'attempts': attempts,
+            'error': error,
+            'claim': None
+        }
+
+        if attempts > self._max_retries:
+            # The invoice remains pending in the purchase and it is
+            # kept in the outbox to be retried manually
+            update['state'] = 'failed'
+        else:
+            update['state'] = 'pending'
+            update['next_attempt'] = datetime.now() + timedelta(seconds=self._retry_delay * attempts)
+
+        db.wstore_invoice_outbox.update({'_id': doc['_id'], 'claim': doc['claim']}, {'$set': update})
+
+    def _render(self, doc):
+        try:
+            render_invoice(doc)
+        except Exception, e:
+            self._retry(doc, unicode(e))
+            raise
+
+        db = get_database_connection()
+        db.wstore_invoice_outbox.remove({'_id': doc['_id'], 'claim': doc['claim']})
+
+        # The bill is no longer pending, so the cached responses
+        # including it as pending are discarded
+        bump_version('purchase')
+
+    def dispatch_job(self):
+        """
+        Renders the next invoice of the outbox, returning the number
+        of invoices processed
+        """
+        doc = self._claim_job()
+        if doc is None:
+            return 0
+
+        try:
+            self._render(doc)
+        except:
+            pass
+
+        return 1
+
+    def submit(self, job):
+        """
+        Includes an invoice in the outbox, if no workers has been
+        configured the invoice is rendered synchronously
+        """
+        now = datetime.now()
+        doc = {
+            '_id': ObjectId(),
+            'purchase': job['purchase'],
+            'bill': job['bill'],
+            'bill_code': job['bill_code'],
+            'invoice_name': job['invoice_name'],
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt': now,
+            'created': now
+        }
+
+        if not self._workers:
+            # The invoice is claimed by the calling thread
+            doc['state'] = 'rendering'
+            doc['claimed'] = now
+            doc['claim'] = ObjectId()
+
+        db = get_database_connection()
+        db.wstore_invoice_outbox.insert(doc)
+
+        if not self._workers:
+            self._render(doc)
+            return
+
+        with self._lock:
+            self._submitted.append(doc['_id'])
+
+        self._start()
+        self._notify()
+
+    def join(self):
+        """
+        Waits until the invoices submitted by this process have been
+        rendered or discarded after the configured retries
+        """
+        db = get_database_connection()
+
+        with self._lock:
+            submitted = self._submitted
+            self._submitted = []
+
+        query = {'_id': {'$in': submitted}, 'state': {'$in': ['pending', 'rendering']}}
+
+        while len(submitted) and db.wstore_invoice_outbox.find(query).count():
+            with self._cond:
+                self._cond.wait(POLL_INTERVAL)
+
+    def stop(self):
+        """
+        Stops the worker threads, the invoices not rendered yet
+        remain in the outbox
+        """
+        with self._lock:
+            threads = self._threads
+            self._threads = []
+            self._stopped.set()
+
+        self._notify()
+
+        for thread in threads:
+            thread.join()
+
+    def drain(self):
+        """
+        Renders the invoices of the outbox that are ready to be
+        rendered in the calling thread, returning the number of
+        invoices processed
+        """
+        total = 0
+        dispatched = self.dispatch_job()
+
+        while dispatched:
+            total += dispatched
+            dispatched = self.dispatch_job()
+
+        return total
+
+    def requeue_failed(self):
+        """
+        Includes again as pending the invoices of the outbox that
+        reached the maximum number of retries, returning the number of
+        invoices requeued
+        """
+        db = get_database_connection()
+        result = db.wstore_invoice_outbox.update({'state': 'failed'}, {
+            '$set': {
+                'state': 'pending',
+                'attempts': 0,
+                'next_attempt': datetime.now()
+            }
+        }, multi=True)
+
+        return result['n']
+
+    def get_stats(self):
+        """
+        Returns the number of invoices in the outbox in each state
+        """
+        db = get_database_connection()
+        return dict([(state, db.wstore_invoice_outbox.find({'state': state}).count()) for state in ['pending', 'rendering', 'failed']])
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_invoice_pipeline():
+    """
+    Returns the invoice pipeline of the process
+    """
+    global _pipeline
+
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = InvoicePipeline(
+                getattr(settings, 'INVOICE_WORKERS', 2),
+                max_retries=getattr(settings, 'INVOICE_MAX_RETRIES', 3),
+                retry_delay=getattr(settings, 'INVOICE_RETRY_DELAY', 30),
+                claim_timeout=getattr(settings, 'INVOICE_CLAIM_TIMEOUT', 300)
+            )
+
+    return _pipeline
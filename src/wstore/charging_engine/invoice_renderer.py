@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import os
+import threading
+import subprocess
+
+from django.conf import settings
+from django.template import loader
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_bill_template(name):
+    """
+    Returns the compiled bill template, templates are compiled once
+    for the process lifetime
+    """
+    with _templates_lock:
+        if name not in _templates:
+            _templates[name] = loader.get_template(name)
+
+        return _templates[name]
+
+
+class InvoiceRenderer():
+    """
+    Compiles the HTML code of an invoice into a PDF file
+    """
+
+    def render(self, bill_path, pdf_path):
+        pass
+
+
+class ScriptInvoiceRenderer(InvoiceRenderer):
+    """
+    Renderer that uses the create_invoice.sh script, which runs
+    wkhtmltopdf in a new process for each invoice
+    """
+
+    def render(self, bill_path, pdf_path):
+        if subprocess.call([settings.BASEDIR + '/create_invoice.sh', bill_path, pdf_path]) != 0 \
+                or not os.path.exists(pdf_path):
+            raise Exception('Invoice generation problem')
+
+
+class XHTML2PDFInvoiceRenderer(InvoiceRenderer):
+    """
+    In process renderer that uses xhtml2pdf, avoiding a process
+    spawn for each invoice
+    """
+
+    def __init__(self):
+        try:
+            from xhtml2pdf import pisa
+        except ImportError:
+            raise Exception('xhtml2pdf is required in order to use the in process invoice renderer')
+
+        self._pisa = pisa
+
+    def render(self, bill_path, pdf_path):
+        with open(bill_path, 'rb') as bill:
+            with open(pdf_path, 'wb') as pdf:
+                status = self._pisa.CreatePDF(bill, dest=pdf, path=bill_path, encoding='utf-8')
+
+        if status.err:
+            raise Exception('Invoice generation problem')
+
+
+RENDERERS = {
+    'script': 'wstore.charging_engine.invoice_renderer.ScriptInvoiceRenderer',
+    'xhtml2pdf': 'wstore.charging_engine.invoice_renderer.XHTML2PDFInvoiceRenderer'
+}
+
+
+def load_invoice_renderer(renderer):
+    """
+    Builds the renderer identified by its name or its class path
+    """
+    rnd_str = RENDERERS.get(renderer, renderer)
+    renderer_class = rnd_str.split('.')[-1]
+    renderer_package = rnd_str.partition('.' + renderer_class)[0]
+
+    return getattr(__import__(renderer_package, globals(), locals(), [renderer_class], -1), renderer_class)()
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_invoice_renderer():
+    """
+    Returns the renderer configured in the INVOICE_RENDERER setting
+    """
+    global _renderer
+
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = load_invoice_renderer(getattr(settings, 'INVOICE_RENDERER', 'script'))
+
+    return _renderer
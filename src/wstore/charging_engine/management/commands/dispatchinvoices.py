@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from django.core.management.base import BaseCommand
+
+from wstore.charging_engine.invoice_pipeline import get_invoice_pipeline
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+            This method is used to render the invoices pending in the
+            outbox, including again the failed ones
+        """
+        pipeline = get_invoice_pipeline()
+
+        print str(pipeline.requeue_failed()) + ' failed invoices requeued'
+        print str(pipeline.drain()) + ' invoices processed'
+
+        stats = pipeline.get_stats()
+        print str(stats['pending']) + ' invoices pending and ' + str(stats['failed']) + ' failed'
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import os
+import time
+import codecs
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Context
+
+from wstore.charging_engine.invoice_renderer import RENDERERS
+from wstore.charging_engine.invoice_renderer import get_bill_template, load_invoice_renderer
+
+
+DEFAULT_INVOICES = 20
+
+
+class Command(BaseCommand):
+
+    def _get_bill_code(self, i):
+        bill_template = get_bill_template('contracting/bill_template_initial.html')
+
+        context = {
+            'BASEDIR': settings.BASEDIR,
+            'offering_name': 'benchmark_offering',
+            'off_organization': 'benchmark_organization',
+            'off_version': '1.0',
+            'ref': 'benchmark_' + str(i),
+            'date': '2013-04-01',
+            'organization': 'benchmark_organization',
+            'customer': 'Benchmark Customer',
+            'address': 'Street',
+            'postal': '28000',
+            'city': 'City',
+            'country': 'Country',
+            'taxes': [],
+            'subtotal': '10',
+            'tax': '0',
+            'total': '10',
+            'resources': [('resource', 'Benchmark resource')],
+            'cur': 'EUR',
+            'exists_single': True,
+            'exists_subs': False,
+            'single_parts': [('single payment', '10', 'EUR')]
+        }
+        return bill_template.render(Context(context))
+
+    def _benchmark(self, renderer, invoices, work_dir):
+        start = time.time()
+
+        for i in range(invoices):
+            bill_path = os.path.join(work_dir, 'benchmark_' + str(i) + '.html')
+
+            f = codecs.open(bill_path, 'wb', 'utf-8')
+            f.write(self._get_bill_code(i))
+            f.close()
+
+            renderer.render(bill_path, bill_path[:-4] + 'pdf')
+
+        return invoices / (time.time() - start)
+
+    def handle(self, *args, **options):
+        """
+            This method is used to compare the invoices per second
+            generated by the available invoice renderers
+        """
+        invoices = DEFAULT_INVOICES
+        if len(args) > 0:
+            invoices = int(args[0])
+
+        renderers = args[1:]
+        if not len(renderers):
+            renderers = RENDERERS.keys()
+
+        for name in renderers:
+            work_dir = tempfile.mkdtemp(prefix='invoice_benchmark_')
+            try:
+                renderer = load_invoice_renderer(name)
+                print name + ': ' + ('%.2f' % self._benchmark(renderer, invoices, work_dir)) + ' invoices/second'
+            except Exception, e:
+                print name + ': ' + unicode(e)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
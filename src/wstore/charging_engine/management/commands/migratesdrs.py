@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from wstore.store_commons.database import get_database_connection
+
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+
+    def _get_time_stamp(self, time_stamp):
+        if isinstance(time_stamp, datetime):
+            return time_stamp
+
+        for date_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+            try:
+                return datetime.strptime(time_stamp, date_format)
+            except:
+                pass
+
+        raise Exception('Invalid time stamp: ' + unicode(time_stamp))
+
+    def _build_record(self, contract_id, state, sdr):
+        return {
+            'contract_id': contract_id,
+            'state': state,
+            'correlation_number': int(sdr['correlation_number']),
+            'time_stamp': self._get_time_stamp(sdr['time_stamp']),
+            'offering': sdr['offering'],
+            'customer': sdr['customer'],
+            'record_type': sdr.get('record_type', ''),
+            'unit': sdr.get('unit', ''),
+            'value': unicode(sdr['value']),
+            'component_label': sdr.get('component_label', '')
+        }
+
+    def _migrate_sdrs(self, db, contract_id, state, sdrs, chunk_size):
+        for i in range(0, len(sdrs), chunk_size):
+            records = [self._build_record(contract_id, state, sdr) for sdr in sdrs[i:i + chunk_size]]
+
+            # Remove the records migrated by a previous interrupted
+            # execution in order to avoid duplicating SDRs
+            db.charging_engine_servicerecord.remove({
+                'contract_id': contract_id,
+                'correlation_number': {'$in': [record['correlation_number'] for record in records]}
+            })
+            db.charging_engine_servicerecord.insert(records)
+
+    def handle(self, *args, **options):
+        """
+            This method is used to move the SDRs embedded in the
+            contract documents to the ServiceRecord collection
+        """
+        if len(args) > 1:
+            raise Exception('Invalid number of arguments')
+
+        chunk_size = DEFAULT_CHUNK_SIZE
+        if len(args) == 1:
+            try:
+                chunk_size = int(args[0])
+            except:
+                raise Exception('The chunk size must be an integer')
+
+            if chunk_size <= 0:
+                raise Exception('The chunk size must be a positive integer')
+
+        db = get_database_connection()
+
+        # Only the contracts with embedded SDRs are loaded
+        contracts = db.charging_engine_contract.find({
+            '$or': [{
+                'applied_sdrs.0': {'$exists': True}
+            }, {
+                'pending_sdrs.0': {'$exists': True}
+            }]
+        }, fields=['applied_sdrs', 'pending_sdrs'])
+
+        migrated = 0
+        for contract in contracts:
+            for state in ('applied', 'pending'):
+                sdrs = contract.get(state + '_sdrs', [])
+                self._migrate_sdrs(db, contract['_id'], state, sdrs, chunk_size)
+                migrated += len(sdrs)
+
+            db.charging_engine_contract.update({
+                '_id': contract['_id']
+            }, {
+                '$set': {
+                    'applied_sdrs': [],
+                    'pending_sdrs': []
+                }
+            })
+
+        print str(migrated) + ' SDRs migrated'
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from wstore.charging_engine.invoice_pipeline import get_invoice_pipeline
+from wstore.charging_engine.renovation_scheduler import RenovationScheduler
+from wstore.rss_adaptor.cdr_outbox import get_cdr_dispatcher
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--look-ahead',
+                action='store',
+                type='int',
+                dest='look_ahead',
+                default=None,
+                help="Hours in advance whose expiring subscriptions are renovated"),
+        make_option('--batch-size',
+                action='store',
+                type='int',
+                dest='batch_size',
+                default=None,
+                help="Number of contracts renovated in each batch"),
+        make_option('--rebuild',
+                action='store_true',
+                dest='rebuild',
+                default=False,
+                help="Calculate the renovation date of all the contracts"),
+    )
+
+    def handle(self, *args, **options):
+        """
+            This method is used to renovate the subscriptions
+            of the contracts that are due
+        """
+        scheduler = RenovationScheduler(look_ahead=options.get('look_ahead'), batch_size=options.get('batch_size'))
+
+        if options.get('rebuild'):
+            updated = scheduler.rebuild()
+            print str(updated) + ' contracts updated'
+            return
+
+        report = scheduler.resolve()
+
+        print str(len(report['charged'])) + ' purchases renovated, ' + str(len(report['locked'])) + \
+            ' locked and ' + str(len(report['failed'])) + ' failed in ' + ('%.2f' % report['elapsed']) + \
+            ' seconds (' + ('%.2f' % report['throughput']) + ' purchases/second)'
+
+        for purchase_id, error in report['failed'].iteritems():
+            print 'Error renovating purchase ' + purchase_id + ': ' + error
+
+        # Wait until the generated invoices have been compiled
+        get_invoice_pipeline().join()
+
+        # Send the generated CDRs before the process ends
+        get_cdr_dispatcher().drain()
@@ -18,19 +18,32 @@
 # along with WStore.
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
-import time
-
-from datetime import datetime
+from optparse import make_option
 
 from django.core.management.base import BaseCommand
 
+from wstore.charging_engine.batch_charging import BatchChargingEngine, get_payment_info
 from wstore.charging_engine.charging_engine import ChargingEngine
-from wstore.charging_engine.models import Contract
-from wstore.models import Organization
+from wstore.charging_engine.invoice_pipeline import get_invoice_pipeline
+from wstore.charging_engine.models import ServiceRecord
 from wstore.contracting.models import Purchase
+from wstore.rss_adaptor.cdr_outbox import get_cdr_dispatcher
 
 
 class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+                action='store',
+                type='int',
+                dest='workers',
+                default=None,
+                help="Number of workers used to resolve the charges"),
+        make_option('--mode',
+                action='store',
+                dest='mode',
+                default=None,
+                help="Kind of workers, thread or process"),
+    )
 
     def handle(self, *args, **options):
         """
@@ -38,30 +51,16 @@ class Command(BaseCommand):
             of the offerings that have pending SDR for more than
             a month
         """
-        now = time.mktime(datetime.now().timetuple())
-
         if len(args) == 0:
-            # Get contracts
-            for contract in Contract.objects.all():
-
-                pending_sdrs = contract.pending_sdrs
-
-                # If there are subscriptions the renovations are used as triggers
-                if len(pending_sdrs) > 0 and (not 'subscription' in contract.pricing_model):
-                    time_stamp = time.mktime(pending_sdrs[0]['time_stamp'].timetuple())
+            charging = BatchChargingEngine(workers=options.get('workers'), mode=options.get('mode'))
+            report = charging.resolve()
 
-                    if (time_stamp + 2592000) <= now:  # A month
-                        # Get the related payment info
-                        purchase = contract.purchase
+            print str(len(report['charged'])) + ' purchases charged, ' + str(len(report['locked'])) + \
+                ' locked and ' + str(len(report['failed'])) + ' failed in ' + ('%.2f' % report['elapsed']) + \
+                ' seconds (' + ('%.2f' % report['throughput']) + ' purchases/second)'
 
-                        if purchase.organization_owned:
-                            org = purchase.owner_organization
-                            payment_info = org.payment_info
-                        else:
-                            payment_info = purchase.customer.userprofile.payment_info
-
-                        charging = ChargingEngine(purchase, payment_method='credit_card', credit_card=payment_info)
-                        charging.resolve_charging(sdr=True)
+            for purchase_id, error in report['failed'].iteritems():
+                print 'Error charging purchase ' + purchase_id + ': ' + error
 
         elif len(args) == 1:
             # Get the purchase
@@ -74,19 +73,18 @@ class Command(BaseCommand):
             contract = purchase.contract
 
             # Check if there are pending SDRs
-            if (len(contract.pending_sdrs) > 0):
-
-                # Get payment info
-                if purchase.organization_owned:
-                    org = purchase.owner_organization
-                    payment_info = org.payment_info
-                else:
-                    payment_info = purchase.customer.userprofile.payment_info
+            if ServiceRecord.objects.filter(contract=contract, state='pending').count() > 0:
 
-                charging = ChargingEngine(purchase, payment_method='credit_card', credit_card=payment_info)
+                charging = ChargingEngine(purchase, payment_method='credit_card', credit_card=get_payment_info(purchase))
                 charging.resolve_charging(sdr=True)
 
             else:
                 raise Exception('No accounting info in the provided purchase')
         else:
             raise Exception('Invalid number of arguments')
+
+        # Wait until the generated invoices have been compiled
+        get_invoice_pipeline().join()
+
+        # Send the generated CDRs before the process ends
+        get_cdr_dispatcher().drain()
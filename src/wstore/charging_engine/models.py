@@ -19,9 +19,11 @@
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from djangotoolbox.fields import ListField, DictField
 
 from wstore.models import Purchase
+from wstore.store_commons.config_cache import invalidate_units
 
 
 class Contract(models.Model):
@@ -29,11 +31,15 @@ class Contract(models.Model):
     pricing_model = DictField()
     # Date of the last charge to the customer
     last_charge = models.DateTimeField(blank=True, null=True)
+    # Nearest renovation date of the subscriptions of the pricing model,
+    # used by the renovation scheduler to find due contracts
+    next_renovation_date = models.DateTimeField(blank=True, null=True)
     # List with the made charges
     charges = ListField()
-    # List with the charged SDRs for that offering
+    # Legacy embedded lists of charged and pending SDRs, the SDRs are
+    # now stored in the ServiceRecord collection. These fields are only
+    # read by the migratesdrs command
     applied_sdrs = ListField()
-    # List the pending SDRs for that offering
     pending_sdrs = ListField()
     # Related purchase
     purchase = models.OneToOneField(Purchase)
@@ -43,6 +49,37 @@ class Contract(models.Model):
     revenue_class = models.CharField(max_length=15, blank=True, null=True)
 
 
+class ServiceRecord(models.Model):
+    # Contract the SDR is related to
+    contract = models.ForeignKey(Contract)
+    # State of the SDR: pending or applied
+    state = models.CharField(max_length=10, default='pending')
+    correlation_number = models.IntegerField()
+    time_stamp = models.DateTimeField()
+    # Offering info (name, organization and version) included in the SDR
+    offering = DictField()
+    customer = models.CharField(max_length=100)
+    record_type = models.CharField(max_length=50)
+    unit = models.CharField(max_length=50)
+    value = models.CharField(max_length=50)
+    component_label = models.CharField(max_length=100, blank=True)
+
+    def get_info(self):
+        """
+        Returns the SDR document as received by the accounting API
+        """
+        return {
+            'offering': self.offering,
+            'customer': self.customer,
+            'time_stamp': self.time_stamp,
+            'correlation_number': self.correlation_number,
+            'record_type': self.record_type,
+            'unit': self.unit,
+            'value': self.value,
+            'component_label': self.component_label
+        }
+
+
 # This model is used as a unit dictionary in order to determine
 # the pricing model that is being used
 class Unit(models.Model):
@@ -52,3 +89,8 @@ class Unit(models.Model):
     defined_model = models.CharField(max_length=50)
     # Period of time defined by the unit for subscription models
     renovation_period = models.IntegerField(null=True, blank=True)
+
+
+# Invalidate the cached units when they are modified
+post_save.connect(invalidate_units, sender=Unit)
+post_delete.connect(invalidate_units, sender=Unit)
@@ -19,17 +19,26 @@
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
 import json
-import urllib2
+import requests
 
+from django.conf import settings
 from django.contrib.sites.models import Site
 
 from wstore.charging_engine.payment_client.payment_client import PaymentClient
-from wstore.store_commons.utils.method_request import MethodRequest
-from urllib2 import HTTPError
 
 
 FIPAY_ENDPOINT = 'http://antares.ls.fi.upm.es:8002'
 
+# Session shared between the charges in order to reuse the
+# keep-alive connections with FiPay
+_session = requests.Session()
+
+
+def _get_timeout():
+    # Seconds to wait for FiPay, so a charge does not hang the worker
+    return getattr(settings, 'PAYMENT_TIMEOUT', 30)
+
+
 class FiPayClient(PaymentClient):
 
     _purchase = None
@@ -56,21 +65,18 @@ class FiPayClient(PaymentClient):
         body = json.dumps(request_data)
         headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + token}
 
-        request = MethodRequest('POST', FIPAY_ENDPOINT + '/api/payment', body, headers)
-
-        opener = urllib2.build_opener()
-
         try:
-            response = opener.open(request)
-        except HTTPError, e:
-            if e.code == 401:
-                msg = 'The connection with FiPay has returned an unauthorized code, this can happen if you have never accessed FiPay, so your user profile has not been created.'
-            else:
-                msg = 'The connection with FiPay has failed'
-            raise Exception(msg)
+            response = _session.post(FIPAY_ENDPOINT + '/api/payment', data=body, headers=headers, timeout=_get_timeout())
+        except:
+            raise Exception('The connection with FiPay has failed')
+
+        if response.status_code == 401:
+            raise Exception('The connection with FiPay has returned an unauthorized code, this can happen if you have never accessed FiPay, so your user profile has not been created.')
+        elif response.status_code >= 400:
+            raise Exception('The connection with FiPay has failed')
 
         # Return redirection URL
-        self._redirection = json.loads(response.read())['url']
+        self._redirection = json.loads(response.text)['url']
         
 
     def end_redirection_payment(self, token, payer_id):
@@ -85,15 +91,14 @@ class FiPayClient(PaymentClient):
         body = json.dumps(request_data)
         headers = {'Content-type': 'application/json', 'Authorization': 'Bearer ' + user_token}
 
-        request = MethodRequest('POST', FIPAY_ENDPOINT+ '/api/end', body, headers)
-
-        opener = urllib2.build_opener()
-
         try:
-            opener.open(request)
+            response = _session.post(FIPAY_ENDPOINT + '/api/end', data=body, headers=headers, timeout=_get_timeout())
         except:
             raise Exception('The connection with FiPay has failed')
 
+        if response.status_code >= 400:
+            raise Exception('The connection with FiPay has failed')
+
     def direct_payment(self, currency, price, credit_card):
         pass
 
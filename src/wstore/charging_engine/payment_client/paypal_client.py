@@ -19,6 +19,7 @@
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
 
+import threading
 from paypalpy import paypal
 
 from django.contrib.sites.models import Site
@@ -33,6 +34,25 @@ PAYPAL_SIGNATURE = ''
 PAYPAL_URL = 'https://api-3t.sandbox.paypal.com/nvp'
 PAYPAL_CHECKOUT_URL='https://www.sandbox.paypal.com/webscr?cmd=_express-checkout'
 
+_paypal = None
+_paypal_lock = threading.Lock()
+
+
+def get_paypal_api():
+    """
+    Returns the PayPal API client, which keeps the credentials, shared
+    between the charges of the process
+    """
+    global _paypal
+
+    with _paypal_lock:
+        if _paypal is None:
+            paypal.SKIP_AMT_VALIDATION = True
+            _paypal = paypal.PayPal(PAYPAL_USER, PAYPAL_PASSWD, PAYPAL_SIGNATURE, PAYPAL_URL)
+
+    return _paypal
+
+
 class PayPalClient(PaymentClient):
 
     _purchase = None
@@ -41,8 +61,7 @@ class PayPalClient(PaymentClient):
 
     def __init__(self, purchase):
         self._purchase = purchase
-        paypal.SKIP_AMT_VALIDATION = True
-        self._client = paypal.PayPal(PAYPAL_USER, PAYPAL_PASSWD, PAYPAL_SIGNATURE, PAYPAL_URL)
+        self._client = get_paypal_api()
 
     def _get_country_code(self, country):
 
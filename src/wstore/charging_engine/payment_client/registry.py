@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import time
+import bisect
+import threading
+
+from django.conf import settings
+
+
+# Upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS = [10, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class LatencyHistogram():
+    """
+    Histogram of the time spent in the calls to a payment gateway
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._total = 0.0
+
+    def record(self, seconds):
+        millis = seconds * 1000
+
+        with self._lock:
+            self._counts[bisect.bisect_left(LATENCY_BUCKETS, millis)] += 1
+            self._total += millis
+
+    def get_info(self):
+        with self._lock:
+            buckets = []
+            for bound, count in zip(LATENCY_BUCKETS + ['inf'], self._counts):
+                buckets.append({
+                    'le': bound,
+                    'count': count
+                })
+
+            return {
+                'count': sum(self._counts),
+                'total_ms': self._total,
+                'buckets': buckets
+            }
+
+
+class PaymentClientRegistry():
+    """
+    Resolves the payment client class configured in PAYMENT_CLIENT
+    setting once and keeps the latency of the calls made to the
+    payment gateways
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classes = {}
+        self._histograms = {}
+
+    def _load_class(self, cln_str):
+        client_class = cln_str.split('.')[-1]
+        client_package = cln_str.partition('.' + client_class)[0]
+
+        return getattr(__import__(client_package, globals(), locals(), [client_class], -1), client_class)
+
+    def get_client_class(self):
+        cln_str = settings.PAYMENT_CLIENT
+
+        with self._lock:
+            if cln_str not in self._classes:
+                self._classes[cln_str] = self._load_class(cln_str)
+
+            return self._classes[cln_str]
+
+    def get_client(self, purchase):
+        """
+        Builds the payment client of a purchase
+        """
+        return self.get_client_class()(purchase)
+
+    def _get_histogram(self, name):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = LatencyHistogram()
+
+            return self._histograms[name]
+
+    def call(self, client, method, *args):
+        """
+        Calls a method of a payment client measuring the time spent
+        in the payment gateway
+        """
+        start = time.time()
+        try:
+            return getattr(client, method)(*args)
+        finally:
+            self._get_histogram(client.__class__.__name__).record(time.time() - start)
+
+    def get_latencies(self):
+        """
+        Returns the latency histogram of each payment client
+        """
+        with self._lock:
+            histograms = self._histograms.items()
+
+        return dict([(name, histogram.get_info()) for name, histogram in histograms])
+
+
+payment_clients = PaymentClientRegistry()
@@ -19,6 +19,175 @@
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
 
+import json
+import hashlib
+import operator
+import threading
+from array import array
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+
+
+OPERATIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.div
+}
+
+# Number of decimal digits of the currencies whose minor unit
+# is not the cent, the rest of currencies use 2 decimal digits
+CURRENCY_EXPONENTS = {
+    'BHD': 3,
+    'CLP': 0,
+    'ISK': 0,
+    'JPY': 0,
+    'JOD': 3,
+    'KRW': 0,
+    'KWD': 3,
+    'OMR': 3,
+    'TND': 3,
+    'VND': 0
+}
+
+
+class CompiledPriceFunction():
+    """
+    Flat evaluation plan of a price function. The function tree is
+    translated into a postfix program, and the usage variables are
+    indexed by their lowercased label
+    """
+
+    def __init__(self, price_function):
+        self._program = []
+        self.constants = {}
+        self.decimal_constants = {}
+        self.usage_labels = {}
+
+        for k, v in price_function.get('variables', {}).iteritems():
+            if v['type'] == 'usage':
+                label = v['label'].lower()
+                if label not in self.usage_labels:
+                    self.usage_labels[label] = []
+
+                self.usage_labels[label].append(k)
+            else:
+                self.constants[k] = float(v['value'])
+                self.decimal_constants[k] = Decimal(unicode(v['value']))
+
+        self._compile(price_function['function'])
+
+    def _compile(self, function):
+        # Get arguments
+        for arg, error in (('arg1', 'Invalid argument 1'), ('arg2', 'Invalid argument 2')):
+            if type(function[arg]) == str or type(function[arg]) == unicode:
+                self._program.append((function[arg], None))
+            elif type(function[arg]) == dict:
+                self._compile(function[arg])
+            else:
+                raise Exception(error)
+
+        if function['operation'] not in OPERATIONS:
+            raise Exception('Unsupported operation')
+
+        self._program.append((None, OPERATIONS[function['operation']]))
+
+    def evaluate(self, variables):
+        stack = []
+        for var, operation in self._program:
+            if operation is None:
+                stack.append(variables[var])
+            else:
+                arg2 = stack.pop()
+                arg1 = stack.pop()
+                stack.append(operation(arg1, arg2))
+
+        return stack[0]
+
+
+class PriceFunctionCache():
+    """
+    LRU cache of compiled price functions indexed by the hash
+    of the price function definition
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._functions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, price_function):
+        key = hashlib.md5(json.dumps(price_function, sort_keys=True)).hexdigest()
+
+        with self._lock:
+            compiled = self._functions.pop(key, None)
+
+        # Functions are compiled outside the lock, since compiling the same
+        # function twice in concurrent requests is harmless
+        if compiled is None:
+            compiled = CompiledPriceFunction(price_function)
+
+        with self._lock:
+            self._functions[key] = compiled
+
+            if len(self._functions) > self._size:
+                self._functions.popitem(last=False)
+
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._functions.clear()
+
+
+compiled_functions = PriceFunctionCache(getattr(settings, 'PRICE_FUNCTION_CACHE_SIZE', 512))
+
+
+class AccountingIndex():
+    """
+    Index of the accounting info by lowercased unit and component label
+    built in a single pass. SDR values are parsed once and stored in a
+    compact array of floats, or in a list of decimals if exact values
+    are required
+    """
+
+    def __init__(self, accounting, exact=False):
+        self._sdrs = accounting
+        self._units = {}
+        self._labels = {}
+
+        if exact:
+            self.values = [Decimal(unicode(sdr['value'])) for sdr in accounting]
+        else:
+            self.values = array('d', [float(sdr['value']) for sdr in accounting])
+
+        for pos, sdr in enumerate(accounting):
+
+            unit = sdr['unit'].lower()
+            if unit not in self._units:
+                self._units[unit] = []
+            self._units[unit].append(pos)
+
+            label = sdr.get('component_label', '').lower()
+            if label not in self._labels:
+                self._labels[label] = []
+            self._labels[label].append(pos)
+
+    def get_unit_positions(self, unit):
+        return self._units.get(unit.lower(), [])
+
+    def get_label_positions(self, label):
+        """
+        Returns the positions of the SDRs with the given lowercased label
+        """
+        return self._labels.get(label, [])
+
+    def get_sdrs(self, positions):
+        return [self._sdrs[pos] for pos in positions]
+
+
 class PriceResolver():
 
     _applied_sdrs = None
@@ -35,84 +204,54 @@ class PriceResolver():
             using the provided function value extracted
             from the different SDR documents
        """
-       
-        # Get arguments
-        if type(function['arg1']) == str or type(function['arg1']) == unicode:
-            arg1 = variables[function['arg1']]
-        elif type(function['arg1']) == dict:
-            arg1 = self._price_function_calculation(function['arg1'], variables)
-        else:
-            raise Exception('Invalid argument 1')
+        return CompiledPriceFunction({'function': function}).evaluate(variables)
 
-        if type(function['arg2']) == str or type(function['arg2']) == unicode:
-            arg2 = variables[function['arg2']]
-        elif type(function['arg2']) == dict:
-            arg2 = self._price_function_calculation(function['arg2'], variables)
-        else:
-            raise Exception('Invalid argument 2')
+    def _parse_value(self, value):
+        return float(value)
 
-        result = 0
-        # Make operation
-        if function['operation'] == '+':
-            result = arg1 + arg2
-        elif function['operation'] == '-':
-            result = arg1 - arg2
-        elif function['operation'] == '*':
-            result = arg1 * arg2
-        elif function['operation'] == '/':
-            result = arg1 / arg2
-        else:
-            raise Exception('Unsupported operation')
+    def _get_index(self, accounting_info):
+        return AccountingIndex(accounting_info)
 
-        return result
+    def _get_constants(self, compiled):
+        return compiled.constants
 
-    def _resolve_price_function(self, function, accounting):
+    def _round(self, price):
+        return price
+
+    def _resolve_price_function(self, compiled, index):
         """
            Aggregates the accounting information in the 
            different variables present in a price function
            in order to calculate the related charging
        """
 
-        function = function['price_function']
-        # Map price variables id with SDR documents
-        aggregated_accounting_val = {}
-        for k, v in function['variables'].iteritems():
-
-            if v['type'] == 'usage':
-                aggregated_accounting_val[k] = []
-
-                for sdr in accounting:
-                    if sdr['component_label'].lower() == v['label'].lower():
-                        aggregated_accounting_val[k].append(sdr)
-            else:
-                aggregated_accounting_val[k] = float(v['value'])
-
-        # Reduce accounting info to a single value per price variable
-        for k in aggregated_accounting_val:
+        # Map price variables id with the aggregated SDR values
+        aggregated_accounting_val = dict(self._get_constants(compiled))
+        for label, variables in compiled.usage_labels.iteritems():
             usage = 0
-            # Avoid iterations over constants
-            if type(aggregated_accounting_val[k]) == list:
-                for value in aggregated_accounting_val[k]:
-                    usage += float(value['value'])
+            for pos in index.get_label_positions(label):
+                usage += index.values[pos]
 
+            for k in variables:
                 aggregated_accounting_val[k] = usage
 
-        return self._price_function_calculation(function['function'], aggregated_accounting_val)
+        return compiled.evaluate(aggregated_accounting_val)
 
-    def _resolve_pay_per_use_agregation(self, component, accounting):
+    def _resolve_pay_per_use_agregation(self, component, index, positions):
         """
            Resolves the charging of pay per use component based
            on a fixed use value
        """
 
         result = 0
-        for sdr in accounting:
+        value = float(component['value'])
+        for pos in positions:
             # Calculate and aggregate price based on value per consumption
-            result += (float(sdr['value']) * float(component['value']))
+            result += (index.values[pos] * value)
 
         return result
 
-    def _pay_per_use_preprocesing(self, use_models, accounting_info, discount=False):
+    def _pay_per_use_preprocesing(self, use_models, index, discount=False):
         """
            Process pay-per-use payments and call the corresponding
            price calculator
@@ -120,29 +259,27 @@ class PriceResolver():
 
         price = 0
         for payment in use_models: # TODO check if the payment can be applied
-            related_accounting = []
             # Check price function
             if 'price_function' in payment:
-                for sdr in accounting_info:
-                    # Iterate over price variables
-                    for k, var in payment['price_function']['variables'].iteritems():
-                        if var['label'].lower() == sdr['component_label'].lower():
-                            related_accounting.append(sdr)
-                agregator = self._resolve_price_function
+                compiled = compiled_functions.get(payment['price_function'])
+
+                # Get the related accounting info keeping the SDRs order
+                positions = set()
+                for label in compiled.usage_labels:
+                    positions.update(index.get_label_positions(label))
+                positions = sorted(positions)
+
+                price += self._resolve_price_function(compiled, index)
             else:
                 # Get the related accounting info
-                for sdr in accounting_info:
-                    if sdr['unit'].lower() == payment['unit'].lower():
-                        related_accounting.append(sdr)
-
-                agregator = self._resolve_pay_per_use_agregation
+                positions = index.get_unit_positions(payment['unit'])
+                price += self._resolve_pay_per_use_agregation(payment, index, positions)
 
             # Include the applied SDRs
-            price += agregator(payment, related_accounting)
             applied_accounting = {
                 'model': payment,
-                'accounting': related_accounting,
-                'price': price
+                'accounting': index.get_sdrs(positions),
+                'price': self._round(price)
             }
             if discount:
                 self._applied_sdrs['deductions'].append(applied_accounting)
@@ -168,23 +305,71 @@ class PriceResolver():
         # Check the pricing model
         if 'single_payment' in pricing_model:
             for payment in pricing_model['single_payment']:
-                price = price + float(payment['value'])
+                price = price + self._parse_value(payment['value'])
 
         if 'subscription' in pricing_model:
             for payment in pricing_model['subscription']:
-                price = price + float(payment['value'])
+                price = price + self._parse_value(payment['value'])
+
+        # The accounting info is indexed once for all the components
+        index = None
+        if 'pay_per_use' in pricing_model or 'deductions' in pricing_model:
+            index = self._get_index(accounting_info or [])
 
         if 'pay_per_use' in pricing_model:
             # Calculate the payment associated with the price component
-            price = price + self._pay_per_use_preprocesing(pricing_model['pay_per_use'], accounting_info)
+            price = price + self._pay_per_use_preprocesing(pricing_model['pay_per_use'], index)
 
         if 'deductions' in pricing_model:
             # Calculate deductions
-            price = price - self._pay_per_use_preprocesing(pricing_model['deductions'], accounting_info, discount=True)
+            price = price - self._pay_per_use_preprocesing(pricing_model['deductions'], index, discount=True)
 
         # If the price is negative i.e too much deductions
         # the value is set to 0
         if price < 0:
             price = 0
 
-        return price
+        return self._round(price)
+
+
+class DecimalPriceResolver(PriceResolver):
+    """
+    Price resolver that makes all the calculations using decimal
+    numbers, avoiding the float rounding drift. Final amounts are
+    rounded to the minor unit of the currency
+    """
+
+    def __init__(self, currency=None):
+        PriceResolver.__init__(self)
+
+        exponent = CURRENCY_EXPONENTS.get((currency or '').upper(), 2)
+        self._quantum = Decimal(1).scaleb(-exponent)
+
+    def _parse_value(self, value):
+        return Decimal(unicode(value))
+
+    def _get_index(self, accounting_info):
+        return AccountingIndex(accounting_info, exact=True)
+
+    def _get_constants(self, compiled):
+        return compiled.decimal_constants
+
+    def _round(self, price):
+        # Prices are returned as floats in order to keep the resolver
+        # API, once rounded its representation is exact
+        return float(Decimal(price).quantize(self._quantum, rounding=ROUND_HALF_UP))
+
+    def _resolve_pay_per_use_agregation(self, component, index, positions):
+        # Exact arithmetic allows to aggregate the consumption
+        # before applying the price per unit
+        return sum([index.values[pos] for pos in positions], Decimal(0)) * self._parse_value(component['value'])
+
+
+def get_price_resolver(currency=None):
+    """
+    Returns the price resolver configured in PRICE_RESOLVER_MODE setting
+    """
+    if getattr(settings, 'PRICE_RESOLVER_MODE', 'float') == 'decimal':
+        return DecimalPriceResolver(currency)
+
+    return PriceResolver()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from datetime import datetime, timedelta
+from functools import partial
+
+from django.conf import settings
+from pymongo import ASCENDING
+
+from wstore.charging_engine.batch_charging import BatchChargingEngine, renovate_purchase
+from wstore.store_commons.database import get_database_connection
+
+
+class RenovationScheduler():
+    """
+    Renovates the subscriptions of the contracts that are due, using
+    the next_renovation_date index in order to avoid loading all the
+    contracts
+    """
+
+    def __init__(self, look_ahead=None, batch_size=None, charging_engine=None):
+        # Window in hours whose expiring subscriptions are renovated
+        self._look_ahead = look_ahead
+        if self._look_ahead is None:
+            self._look_ahead = getattr(settings, 'RENOVATION_LOOK_AHEAD', 0)
+
+        self._batch_size = batch_size or getattr(settings, 'RENOVATION_BATCH_SIZE', 100)
+        self._charging_engine = charging_engine or BatchChargingEngine()
+
+    def get_renovation_limit(self):
+        return datetime.now() + timedelta(hours=self._look_ahead)
+
+    def get_due_purchases(self, limit, last=None):
+        """
+        Returns a batch of purchases whose contracts have a subscription
+        expiring before the limit, in renovation date order. The last
+        returned renovation date and contract id are used as cursor
+        """
+        db = get_database_connection()
+
+        query = {
+            'next_renovation_date': {'$lte': limit}
+        }
+
+        if last is not None:
+            query['$or'] = [{
+                'next_renovation_date': {'$gt': last[0]}
+            }, {
+                'next_renovation_date': last[0],
+                '_id': {'$gt': last[1]}
+            }]
+
+        contracts = db.charging_engine_contract.find(
+            query,
+            fields=['purchase_id', 'next_renovation_date']
+        ).sort([
+            ('next_renovation_date', ASCENDING),
+            ('_id', ASCENDING)
+        ]).limit(self._batch_size)
+
+        return list(contracts)
+
+    def resolve(self):
+        """
+        Renovates the due contracts in bounded batches, returning a report
+        with the results
+        """
+        limit = self.get_renovation_limit()
+        task = partial(renovate_purchase, renovation_limit=limit)
+
+        report = {
+            'total': 0,
+            'charged': [],
+            'locked': [],
+            'failed': {},
+            'elapsed': 0,
+            'throughput': 0
+        }
+
+        last = None
+        batch = self.get_due_purchases(limit)
+        while len(batch):
+            result = self._charging_engine.resolve(
+                [unicode(contract['purchase_id']) for contract in batch],
+                task=task
+            )
+
+            report['total'] += result['total']
+            report['charged'].extend(result['charged'])
+            report['locked'].extend(result['locked'])
+            report['failed'].update(result['failed'])
+            report['elapsed'] += result['elapsed']
+
+            # Failed contracts keep their renovation date, so the
+            # cursor is used to avoid processing them again
+            last = (batch[-1]['next_renovation_date'], batch[-1]['_id'])
+            batch = self.get_due_purchases(limit, last)
+
+        if report['elapsed'] > 0:
+            report['throughput'] = report['total'] / report['elapsed']
+
+        return report
+
+    def rebuild(self):
+        """
+        Calculates the next renovation date of all the contracts with
+        subscriptions, used to initialize existing installations
+        """
+        db = get_database_connection()
+        updated = 0
+
+        contracts = db.charging_engine_contract.find({
+            'pricing_model.subscription': {'$exists': True}
+        }, fields=['pricing_model.subscription'])
+
+        for contract in contracts:
+            renovation_dates = [s['renovation_date'] for s in contract['pricing_model']['subscription'] if s.get('renovation_date')]
+
+            next_renovation_date = None
+            if len(renovation_dates):
+                next_renovation_date = min(renovation_dates)
+
+            db.charging_engine_contract.update(
+                {'_id': contract['_id']},
+                {'$set': {'next_renovation_date': next_renovation_date}}
+            )
+            updated += 1
+
+        return updated
@@ -22,10 +22,14 @@ from __future__ import absolute_import
 
 import os
 import json
+import shutil
+import tempfile
+import time
 import rdflib
 from copy import deepcopy
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ASCENDING
 from mock import MagicMock
 from nose_parameterized import parameterized
 
@@ -40,14 +44,40 @@ from wstore.charging_engine import views
 from wstore.models import Purchase
 from wstore.models import UserProfile
 from wstore.models import Organization
+from wstore.charging_engine.models import ServiceRecord
+from wstore.charging_engine import batch_charging
+from wstore.charging_engine import invoice_pipeline
+from wstore.charging_engine import invoice_renderer
+from wstore.charging_engine.payment_client import registry as registry_module
+from wstore.charging_engine.payment_client import fipay_client
+from wstore.charging_engine import renovation_scheduler
 from wstore.charging_engine.management.commands import resolve_use_charging
+from wstore.charging_engine.management.commands import migratesdrs
 from wstore.store_commons.database import get_database_connection
 
 
 __test__ = False
 
 
-def fake_renovation_date(unit):
+def get_sdrs(contract, state):
+    return ServiceRecord.objects.filter(contract=contract, state=state).order_by('correlation_number')
+
+
+def create_sdr(contract, time_stamp, correlation_number=1):
+    return ServiceRecord.objects.create(
+        contract=contract,
+        state='pending',
+        correlation_number=correlation_number,
+        time_stamp=time_stamp,
+        offering={},
+        customer='test_user',
+        record_type='event',
+        unit='invocation',
+        value='1'
+    )
+
+
+def fake_renovation_date(unit, start=None):
 
     if unit == 'per month':
         return datetime(2013, 04, 01, 00, 00, 00)
@@ -95,13 +125,10 @@ class FakeChargingEngine():
         self._payment_method = payment_method
         self._credit_card = credit_card
 
-    def resolve_charging(self, sdr=False):
+    def resolve_charging(self, sdr=False, renovation_limit=None):
 
         if sdr and self._payment_method == 'credit_card':
-            sdrs = self._purchase.contract.pending_sdrs
-            self._purchase.contract.pending_sdrs = []
-            self._purchase.contract.applied_sdrs.extend(sdrs)
-            self._purchase.contract.save()
+            get_sdrs(self._purchase.contract, 'pending').update(state='applied')
 
 
 def fake_cdr_generation(parts, time):
@@ -113,8 +140,10 @@ class FakeSubprocess():
     def __init__(self):
         pass
 
-    def call(self, prams):
-        pass
+    def call(self, params):
+        # Create the compiled invoice
+        open(params[2], 'w').close()
+        return 0
 
 BASIC_PRCING = {
     "pricing": {
@@ -171,7 +200,7 @@ class SinglePaymentChargingTestCase(TestCase):
     def setUpClass(cls):
         reload(charging_engine)
         cls._auth = settings.OILAUTH
-        charging_engine.subprocess = FakeSubprocess()
+        charging_engine.get_invoice_pipeline = MagicMock()
         settings.OILAUTH = False
         settings.PAYMENT_CLIENT = 'wstore.charging_engine.tests.FakeClient'
         super(SinglePaymentChargingTestCase, cls).setUpClass()
@@ -252,6 +281,21 @@ class SinglePaymentChargingTestCase(TestCase):
             elif pay['label'] == 'Price component 3':
                 self.assertEqual(pay['value'], '7')
 
+    @parameterized.expand([
+        ('integer', 5, 'EUR', '5.00'),
+        ('rounded_up', 10.125, 'EUR', '10.13'),
+        ('rounded_down', 10.124, 'EUR', '10.12'),
+        ('float_error', 0.1 + 0.2, 'EUR', '0.30'),
+        ('no_minor_unit', 1234.5, 'JPY', '1235'),
+        ('three_decimals', 1.2345, 'KWD', '1.235'),
+        ('lower_case', 1.2345, 'kwd', '1.235')
+    ])
+    def test_fix_price(self, name, price, currency, expected):
+        purchase = Purchase.objects.get(pk='61005aba8e05ac2115f022f0')
+        charging = charging_engine.ChargingEngine(purchase)
+
+        self.assertEqual(charging._fix_price(price, currency), expected)
+
 
 class SubscriptionChargingTestCase(TestCase):
 
@@ -263,7 +307,7 @@ class SubscriptionChargingTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
         settings.PAYMENT_CLIENT = 'wstore.charging_engine.tests.FakeClient'
-        charging_engine.subprocess = FakeSubprocess()
+        charging_engine.get_invoice_pipeline = MagicMock()
         super(SubscriptionChargingTestCase, cls).setUpClass()
 
     def test_basic_subscription_charging(self):
@@ -513,7 +557,7 @@ class PayPerUseChargingTestCase(TestCase):
     def setUpClass(cls):
         cls._auth = settings.OILAUTH
         settings.PAYMENT_CLIENT = 'wstore.charging_engine.tests.FakeClient'
-        charging_engine.subprocess = FakeSubprocess()
+        charging_engine.get_invoice_pipeline = MagicMock()
         settings.OILAUTH = False
         super(PayPerUseChargingTestCase, cls).setUpClass()
 
@@ -547,12 +591,12 @@ class PayPerUseChargingTestCase(TestCase):
         purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 1)
 
-        loaded_sdr = contract.pending_sdrs[0]
+        loaded_sdr = get_sdrs(contract, 'pending')[0].get_info()
 
         self.assertEqual(loaded_sdr['customer'], 'test_user')
-        self.assertEqual(loaded_sdr['correlation_number'], '1')
+        self.assertEqual(loaded_sdr['correlation_number'], 1)
         self.assertEqual(loaded_sdr['record_type'], 'event')
         self.assertEqual(loaded_sdr['value'], '10')
         self.assertEqual(loaded_sdr['unit'], 'invocation')
@@ -579,11 +623,6 @@ class PayPerUseChargingTestCase(TestCase):
         }
 
         purchase = Purchase.objects.get(pk='61074ab65e05acc415f322f2')
-        applied_date = purchase.contract.applied_sdrs[0]['time_stamp']
-        applied_date = datetime.strptime(applied_date, '%Y-%m-%d %H:%M:%S')
-        purchase.contract.applied_sdrs[0]['time_stamp'] = applied_date
-        purchase.contract.save()
-
         charging = charging_engine.ChargingEngine(purchase)
         charging.include_sdr(sdr)
 
@@ -591,14 +630,14 @@ class PayPerUseChargingTestCase(TestCase):
         purchase = Purchase.objects.get(pk='61074ab65e05acc415f322f2')
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 1)
-        self.assertEqual(len(contract.applied_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 1)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 1)
         self.assertEqual(len(contract.charges), 1)
 
-        loaded_sdr = contract.pending_sdrs[0]
+        loaded_sdr = get_sdrs(contract, 'pending')[0].get_info()
 
         self.assertEqual(loaded_sdr['customer'], 'test_user')
-        self.assertEqual(loaded_sdr['correlation_number'], '2')
+        self.assertEqual(loaded_sdr['correlation_number'], 2)
         self.assertEqual(loaded_sdr['record_type'], 'event')
         self.assertEqual(loaded_sdr['value'], '10')
         self.assertEqual(loaded_sdr['unit'], 'invocation')
@@ -623,11 +662,6 @@ class PayPerUseChargingTestCase(TestCase):
         }
 
         purchase = Purchase.objects.get(pk='61077ab75e07a7c415f372f2')
-        applied_date = purchase.contract.pending_sdrs[0]['time_stamp']
-        applied_date = datetime.strptime(applied_date, '%Y-%m-%d %H:%M:%S')
-        purchase.contract.pending_sdrs[0]['time_stamp'] = applied_date
-        purchase.contract.save()
-
         charging = charging_engine.ChargingEngine(purchase)
         charging.include_sdr(sdr)
 
@@ -635,12 +669,12 @@ class PayPerUseChargingTestCase(TestCase):
         purchase = Purchase.objects.get(pk='61077ab75e07a7c415f372f2')
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 2)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 2)
 
-        loaded_sdr = contract.pending_sdrs[1]
+        loaded_sdr = get_sdrs(contract, 'pending')[1].get_info()
 
         self.assertEqual(loaded_sdr['customer'], 'test_user')
-        self.assertEqual(loaded_sdr['correlation_number'], '2')
+        self.assertEqual(loaded_sdr['correlation_number'], 2)
         self.assertEqual(loaded_sdr['record_type'], 'event')
         self.assertEqual(loaded_sdr['value'], '10')
         self.assertEqual(loaded_sdr['unit'], 'invocation')
@@ -682,12 +716,12 @@ class PayPerUseChargingTestCase(TestCase):
         purchase = Purchase.objects.get(pk='61004a9a5e95ac9115902290')
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 1)
 
-        loaded_sdr = contract.pending_sdrs[0]
+        loaded_sdr = get_sdrs(contract, 'pending')[0].get_info()
 
         self.assertEqual(loaded_sdr['customer'], 'test_user2')
-        self.assertEqual(loaded_sdr['correlation_number'], '1')
+        self.assertEqual(loaded_sdr['correlation_number'], 1)
         self.assertEqual(loaded_sdr['record_type'], 'event')
         self.assertEqual(loaded_sdr['value'], '10')
         self.assertEqual(loaded_sdr['unit'], 'invocation')
@@ -776,11 +810,6 @@ class PayPerUseChargingTestCase(TestCase):
         }
 
         purchase = Purchase.objects.get(pk='61074ab65e05acc415f322f2')
-        applied_date = purchase.contract.applied_sdrs[0]['time_stamp']
-        applied_date = datetime.strptime(applied_date, '%Y-%m-%d %H:%M:%S')
-        purchase.contract.applied_sdrs[0]['time_stamp'] = applied_date
-        purchase.contract.save()
-
         charging = charging_engine.ChargingEngine(purchase)
 
         error = False
@@ -860,6 +889,104 @@ class PayPerUseChargingTestCase(TestCase):
 
     test_sdr_feeding_invalid_purchase.tags = ('fiware-ut-14',)
 
+    def test_sdr_batch_feeding(self):
+
+        sdrs = []
+        for corr in ('1', '2', '4', '3'):
+            sdrs.append({
+                'offering': {
+                    'name': 'test_offering',
+                    'organization': 'test_organization',
+                    'version': '1.0'
+                },
+                'component_label': 'invocations',
+                'customer': 'test_user',
+                'correlation_number': corr,
+                'time_stamp': str(datetime.now()),
+                'record_type': 'event',
+                'value': '10',
+                'unit': 'invocation'
+            })
+
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        charging = charging_engine.ChargingEngine(purchase)
+        results = charging.include_sdrs(sdrs)
+
+        self.assertEquals(results, [{
+            'correlation_number': '1',
+            'result': 'accepted'
+        }, {
+            'correlation_number': '2',
+            'result': 'accepted'
+        }, {
+            'correlation_number': '4',
+            'result': 'rejected',
+            'reason': 'Invalid correlation number, expected: 3'
+        }, {
+            'correlation_number': '3',
+            'result': 'accepted'
+        }])
+
+        # Refresh the purchase
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        contract = purchase.contract
+
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 3)
+        self.assertEqual([sdr.correlation_number for sdr in get_sdrs(contract, 'pending')], [1, 2, 3])
+
+    def _get_batch_sdrs(self, correlation_numbers):
+        sdrs = []
+        for corr in correlation_numbers:
+            sdrs.append({
+                'offering': {
+                    'name': 'test_offering',
+                    'organization': 'test_organization',
+                    'version': '1.0'
+                },
+                'component_label': 'invocations',
+                'customer': 'test_user',
+                'correlation_number': corr,
+                'time_stamp': str(datetime.now()),
+                'record_type': 'event',
+                'value': '10',
+                'unit': 'invocation'
+            })
+
+        return sdrs
+
+    def test_sdr_batch_concurrent_feeding(self):
+
+        get_database_connection().charging_engine_servicerecord.ensure_index([
+            ('contract_id', ASCENDING),
+            ('correlation_number', ASCENDING)
+        ], unique=True)
+
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        charging = charging_engine.ChargingEngine(purchase)
+        charging.include_sdrs(self._get_batch_sdrs(('1', '2')))
+
+        # A concurrent request read the last SDR before the previous insert
+        charging._get_last_sdr_info = MagicMock()
+        charging._get_last_sdr_info.return_value = (0, 0)
+
+        results = charging.include_sdrs(self._get_batch_sdrs(('1', '2', '3')))
+
+        self.assertEquals(results, [{
+            'correlation_number': '1',
+            'result': 'rejected',
+            'reason': 'Invalid correlation number, 1 has already been received'
+        }, {
+            'correlation_number': '2',
+            'result': 'rejected',
+            'reason': 'Invalid correlation number, 2 has already been received'
+        }, {
+            'correlation_number': '3',
+            'result': 'accepted'
+        }])
+
+        contract = Purchase.objects.get(pk='61004aba5e05acc115f022f0').contract
+        self.assertEqual([sdr.correlation_number for sdr in get_sdrs(contract, 'pending')], [1, 2, 3])
+
     def test_new_purchase_use(self):
 
         user = User.objects.get(pk='51070aba8e05cc2115f022f9')
@@ -955,8 +1082,8 @@ class PayPerUseChargingTestCase(TestCase):
         self.assertEqual(contract.charges[0]['cost'], 10.00)
         self.assertEqual(contract.charges[0]['concept'], 'pay per use')
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 1)
 
     test_basic_resolve_use_charging.tags = ('fiware-ut-15',)
 
@@ -979,6 +1106,104 @@ class PayPerUseChargingTestCase(TestCase):
     test_resolve_use_charging_no_sdr.tags = ('fiware-ut-15',)
 
 
+class SDRBatchFeedingTestCase(TestCase):
+
+    tags = ('sdrs',)
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        self.user = User.objects.create_user(
+            username='test_user',
+            email='',
+            password='passwd'
+        )
+
+        views.Purchase = MagicMock()
+        views.ChargingEngine = MagicMock()
+        self._engine_mock = views.ChargingEngine.return_value
+        self._engine_mock.include_sdrs.return_value = [{
+            'correlation_number': '1',
+            'result': 'accepted'
+        }]
+
+    def tearDown(self):
+        reload(views)
+
+    def _get_sdr(self, corr):
+        return {
+            'offering': {
+                'name': 'test_offering',
+                'organization': 'test_organization',
+                'version': '1.0'
+            },
+            'component_label': 'invocations',
+            'customer': 'test_user',
+            'correlation_number': corr,
+            'time_stamp': '2015-09-14 10:00:01.0',
+            'record_type': 'event',
+            'value': '10',
+            'unit': 'invocation'
+        }
+
+    def _call_view(self, data, content_type):
+        collection = views.ServiceRecordBatchCollection(permitted_methods=('POST',))
+
+        request = self.factory.post(
+            '/api/contracting/aaaaa/accounting/batch',
+            data,
+            HTTP_ACCEPT='application/json; charset=utf-8',
+            content_type=content_type
+        )
+        request.user = self.user
+
+        return collection.create(request, 'aaaaa')
+
+    @parameterized.expand([
+        ('json', 'application/json', lambda sdrs: json.dumps(sdrs)),
+        ('ndjson', 'application/x-ndjson', lambda sdrs: '\n'.join([json.dumps(sdr) for sdr in sdrs]))
+    ])
+    def test_sdr_batch_feeding(self, name, content_type, serializer):
+        invalid_sdr = self._get_sdr('2')
+        del invalid_sdr['unit']
+
+        response = self._call_view(serializer([self._get_sdr('1'), invalid_sdr]), content_type)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), [{
+            'correlation_number': '1',
+            'result': 'accepted'
+        }, {
+            'correlation_number': '2',
+            'result': 'rejected',
+            'reason': 'Invalid JSON content'
+        }])
+
+        views.Purchase.objects.get.assert_called_once_with(ref='aaaaa')
+        views.ChargingEngine.assert_called_once_with(views.Purchase.objects.get.return_value)
+        self._engine_mock.include_sdrs.assert_called_once_with([self._get_sdr('1')])
+
+    def test_sdr_batch_feeding_invalid_body(self):
+        response = self._call_view(json.dumps(self._get_sdr('1')), 'application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEquals(json.loads(response.content), {
+            'result': 'error',
+            'message': 'Invalid JSON content'
+        })
+
+    def test_sdr_batch_feeding_not_found(self):
+        views.Purchase.objects.get.side_effect = Exception('')
+
+        response = self._call_view(json.dumps([self._get_sdr('1')]), 'application/json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEquals(json.loads(response.content), {
+            'result': 'error',
+            'message': 'There is not any purchase with reference aaaaa'
+        })
+
+
 class AsynchronousPaymentTestCase(TestCase):
 
     tags = ('fiware-ut-17',)
@@ -989,7 +1214,7 @@ class AsynchronousPaymentTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
         settings.PAYMENT_CLIENT = 'wstore.charging_engine.tests.FakeClient'
-        charging_engine.subprocess = FakeSubprocess()
+        charging_engine.get_invoice_pipeline = MagicMock()
         charging_engine.threading = FakeThreading()
         super(AsynchronousPaymentTestCase, cls).setUpClass()
 
@@ -1123,9 +1348,15 @@ class ChargingDaemonTestCase(TestCase):
     def setUpClass(cls):
 
         resolve_use_charging.ChargingEngine = FakeChargingEngine
+        batch_charging.ChargingEngine = FakeChargingEngine
         cls._command = resolve_use_charging.Command()
         super(ChargingDaemonTestCase, cls).setUpClass()
 
+    @classmethod
+    def tearDownClass(cls):
+        reload(batch_charging)
+        super(ChargingDaemonTestCase, cls).tearDownClass()
+
     def test_basic_charging_daemon(self):
 
         # Fill userprofile model
@@ -1140,15 +1371,8 @@ class ChargingDaemonTestCase(TestCase):
 
         purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
 
-        # Add dateinfo to sdr
-        pending_sdrs = []
-        pending_sdrs.append({
-            'time_stamp': datetime(2013, 04, 01, 00, 00, 00, 00)
-        })
-
-        purchase.contract.pending_sdrs = pending_sdrs
-
-        purchase.contract.save()
+        # Add a pending sdr
+        create_sdr(purchase.contract, datetime(2013, 04, 01, 00, 00, 00, 00))
 
         # Run the method
         self._command.handle()
@@ -1158,8 +1382,8 @@ class ChargingDaemonTestCase(TestCase):
 
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 1)
 
     def test_charging_daemon_multiple_sdrs(self):
 
@@ -1175,21 +1399,10 @@ class ChargingDaemonTestCase(TestCase):
 
         purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
 
-        # Add dateinfo to sdr
-        pending_sdrs = []
-        pending_sdrs.append({
-            'time_stamp': datetime(2013, 04, 01, 00, 00, 00, 00)
-        })
-        pending_sdrs.append({
-            'time_stamp': datetime(2013, 04, 02, 00, 00, 00, 00)
-        })
-        pending_sdrs.append({
-            'time_stamp': datetime(2013, 04, 03, 00, 00, 00, 00)
-        })
-
-        purchase.contract.pending_sdrs = pending_sdrs
-
-        purchase.contract.save()
+        # Add pending sdrs
+        create_sdr(purchase.contract, datetime(2013, 04, 01, 00, 00, 00, 00), 1)
+        create_sdr(purchase.contract, datetime(2013, 04, 02, 00, 00, 00, 00), 2)
+        create_sdr(purchase.contract, datetime(2013, 04, 03, 00, 00, 00, 00), 3)
 
         # Run the method
         self._command.handle()
@@ -1199,8 +1412,8 @@ class ChargingDaemonTestCase(TestCase):
 
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 3)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 3)
 
     def test_charging_daemon_multiple_contracts(self):
 
@@ -1217,28 +1430,12 @@ class ChargingDaemonTestCase(TestCase):
         purchase_1 = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
         purchase_2 = Purchase.objects.get(pk='61004aba5e05acc115f03333')
 
-        # Add dateinfo to sdr
-        pending_sdrs_1 = []
-        pending_sdrs_1.append({
-            'time_stamp': datetime(2013, 04, 01, 00, 00, 00, 00)
-        })
-
-        pending_sdrs_2 = []
-        pending_sdrs_2.append({
-            'time_stamp': datetime(2013, 04, 01, 00, 00, 00, 00)
-        })
-        pending_sdrs_2.append({
-            'time_stamp': datetime(2013, 04, 02, 00, 00, 00, 00)
-        })
-        pending_sdrs_2.append({
-            'time_stamp': datetime(2013, 04, 03, 00, 00, 00, 00)
-        })
-
-        purchase_1.contract.pending_sdrs = pending_sdrs_1
-        purchase_1.contract.save()
+        # Add pending sdrs
+        create_sdr(purchase_1.contract, datetime(2013, 04, 01, 00, 00, 00, 00), 1)
 
-        purchase_2.contract.pending_sdrs = pending_sdrs_2
-        purchase_2.contract.save()
+        create_sdr(purchase_2.contract, datetime(2013, 04, 01, 00, 00, 00, 00), 1)
+        create_sdr(purchase_2.contract, datetime(2013, 04, 02, 00, 00, 00, 00), 2)
+        create_sdr(purchase_2.contract, datetime(2013, 04, 03, 00, 00, 00, 00), 3)
 
         # Run the method
         self._command.handle()
@@ -1248,16 +1445,16 @@ class ChargingDaemonTestCase(TestCase):
 
         contract = purchase_1.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 1)
 
         # Check the first contract
         purchase_2 = Purchase.objects.get(pk='61004aba5e05acc115f03333')
 
         contract = purchase_2.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 3)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 3)
 
     def test_charging_daemon_organization_purchased(self):
 
@@ -1274,15 +1471,8 @@ class ChargingDaemonTestCase(TestCase):
 
         purchase = Purchase.objects.get(pk='61004aba5e05acc115f08888')
 
-        # Add dateinfo to sdr
-        pending_sdrs = []
-        pending_sdrs.append({
-            'time_stamp': datetime(2013, 04, 01, 00, 00, 00, 00)
-        })
-
-        purchase.contract.pending_sdrs = pending_sdrs
-
-        purchase.contract.save()
+        # Add a pending sdr
+        create_sdr(purchase.contract, datetime(2013, 04, 01, 00, 00, 00, 00))
 
         # Run the method
         self._command.handle()
@@ -1292,8 +1482,8 @@ class ChargingDaemonTestCase(TestCase):
 
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 1)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 1)
 
     def test_charging_daemon_now_time(self):
 
@@ -1309,15 +1499,8 @@ class ChargingDaemonTestCase(TestCase):
 
         purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
 
-        # Add dateinfo to sdr
-        pending_sdrs = []
-        pending_sdrs.append({
-            'time_stamp': datetime.now()
-        })
-
-        purchase.contract.pending_sdrs = pending_sdrs
-
-        purchase.contract.save()
+        # Add a pending sdr
+        create_sdr(purchase.contract, datetime.now())
 
         # Run the method
         self._command.handle()
@@ -1327,26 +1510,537 @@ class ChargingDaemonTestCase(TestCase):
 
         contract = purchase.contract
 
-        self.assertEqual(len(contract.pending_sdrs), 1)
-        self.assertEqual(len(contract.applied_sdrs), 0)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 1)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 0)
+
+    def test_batch_charging_report(self):
+
+        # Fill userprofile model
+        user = User.objects.get(pk='51000aba8e05ac2115f022f9')
+        org = Organization.objects.get(pk='91000aba8e06ac2115f022f0')
+
+        user.userprofile.organization = org
+        user.userprofile.payment_info = {
+        }
+
+        user.userprofile.save()
+
+        purchase_1 = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        purchase_2 = Purchase.objects.get(pk='61004aba5e05acc115f03333')
+
+        create_sdr(purchase_1.contract, datetime(2013, 04, 01, 00, 00, 00, 00))
+        create_sdr(purchase_2.contract, datetime(2013, 04, 01, 00, 00, 00, 00))
+
+        # Lock the second purchase
+        db = get_database_connection()
+        db.wstore_purchase.update({'_id': ObjectId(purchase_2.pk)}, {'$set': {'_lock': True}})
+
+        charging = batch_charging.BatchChargingEngine(workers=2, mode='thread')
+        purchases = charging.get_pending_purchases()
+        self.assertEquals(sorted(purchases), [purchase_1.pk, purchase_2.pk])
+
+        report = charging.resolve(purchases + ['61004aba5e05acc115f0ffff'])
+
+        self.assertEquals(report['total'], 3)
+        self.assertEquals(report['charged'], [purchase_1.pk])
+        self.assertEquals(report['locked'], [purchase_2.pk])
+        self.assertEquals(report['failed'], {
+            '61004aba5e05acc115f0ffff': 'The purchase does not exist'
+        })
+
+        # The lock of the charged purchase has been released
+        self.assertFalse(db.wstore_purchase.find_one({'_id': ObjectId(purchase_1.pk)})['_lock'])
+        self.assertEqual(len(get_sdrs(purchase_1.contract, 'applied')), 1)
+        self.assertEqual(len(get_sdrs(purchase_2.contract, 'pending')), 1)
+
+    def test_batch_charging_process(self):
+        pool_class = batch_charging.Pool
+        batch_charging.Pool = MagicMock()
+        pool = batch_charging.Pool.return_value
+        pool.map.return_value = [('61004aba5e05acc115f022f0', 'charged', None)]
+
+        try:
+            charging = batch_charging.BatchChargingEngine(workers=2, mode='process')
+            report = charging.resolve(['61004aba5e05acc115f022f0'])
+        finally:
+            batch_charging.Pool = pool_class
+
+        self.assertEquals(report['charged'], ['61004aba5e05acc115f022f0'])
+
+        # The invoices are waited for in the pool processes
+        task = pool.map.call_args[0][0]
+        self.assertEquals(task.func, batch_charging._resolve_in_process)
+        self.assertEquals(task.args, (batch_charging.charge_purchase,))
+
+    def test_resolve_in_process(self):
+        get_pipeline = batch_charging.get_invoice_pipeline
+        batch_charging.get_invoice_pipeline = MagicMock()
+        pipeline = batch_charging.get_invoice_pipeline.return_value
+        task = MagicMock(side_effect=Exception('Charging error'))
+
+        error = None
+        try:
+            batch_charging._resolve_in_process(task, '61004aba5e05acc115f022f0')
+        except Exception, e:
+            error = e
+        finally:
+            batch_charging.get_invoice_pipeline = get_pipeline
+
+        self.assertEquals(unicode(error), 'Charging error')
+        task.assert_called_once_with('61004aba5e05acc115f022f0')
+        pipeline.join.assert_called_once_with()
+
+    def test_batch_charging_invalid_mode(self):
+
+        error = None
+        try:
+            batch_charging.BatchChargingEngine(mode='invalid')
+        except ValueError, e:
+            error = e
+
+        self.assertEquals(unicode(error), 'Invalid batch charging mode: invalid')
+
+
+class SDRMigrationTestCase(TestCase):
+
+    tags = ('sdrs',)
+    fixtures = ['use_daemon.json']
+
+    def test_sdr_migration(self):
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+
+        embedded_sdr = {
+            'offering': {
+                'name': 'test_offering',
+                'organization': 'test_organization',
+                'version': '1.0'
+            },
+            'component_label': 'invocations',
+            'customer': 'test_user',
+            'time_stamp': datetime(2013, 04, 01, 00, 00, 00, 00),
+            'record_type': 'event',
+            'value': '10',
+            'unit': 'invocation'
+        }
+        applied = [dict(embedded_sdr, correlation_number=str(i)) for i in range(1, 4)]
+        pending = [dict(embedded_sdr, correlation_number=str(i)) for i in range(4, 6)]
+
+        db = get_database_connection()
+        db.charging_engine_contract.update({
+            '_id': ObjectId(purchase.contract.pk)
+        }, {
+            '$set': {
+                'applied_sdrs': applied,
+                'pending_sdrs': pending
+            }
+        })
+
+        # Run the command twice with a chunk size smaller than
+        # the number of SDRs, the result must be the same
+        migratesdrs.Command().handle('2')
+        migratesdrs.Command().handle('2')
+
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        contract = purchase.contract
+
+        self.assertEqual(contract.applied_sdrs, [])
+        self.assertEqual(contract.pending_sdrs, [])
+        self.assertEqual([sdr.correlation_number for sdr in get_sdrs(contract, 'applied')], [1, 2, 3])
+        self.assertEqual([sdr.correlation_number for sdr in get_sdrs(contract, 'pending')], [4, 5])
+        self.assertEqual(get_sdrs(contract, 'pending')[0].get_info()['component_label'], 'invocations')
+
+
+class RenovationSchedulerTestCase(TestCase):
+
+    tags = ('renovation-scheduler',)
+    fixtures = ['use_daemon.json']
+
+    def _set_renovation_date(self, purchase_id, renovation_date):
+        purchase = Purchase.objects.get(pk=purchase_id)
+        db = get_database_connection()
+        db.charging_engine_contract.update({
+            '_id': ObjectId(purchase.contract.pk)
+        }, {
+            '$set': {
+                'pricing_model.subscription': [{
+                    'label': 'subscription',
+                    'unit': 'per month',
+                    'value': '10',
+                    'renovation_date': renovation_date
+                }]
+            }
+        })
+
+    def test_renovation_scheduler(self):
+
+        self._set_renovation_date('61004aba5e05acc115f022f0', datetime(2013, 04, 01, 00, 00, 00))
+        self._set_renovation_date('61004aba5e05acc115f03333', datetime(2013, 03, 01, 00, 00, 00))
+        self._set_renovation_date('61004aba5e05acc115f08888', datetime(2100, 01, 01, 00, 00, 00))
+
+        engine = MagicMock()
+        engine.resolve.return_value = {
+            'total': 1,
+            'charged': [],
+            'locked': [],
+            'failed': {},
+            'elapsed': 1
+        }
+
+        scheduler = renovation_scheduler.RenovationScheduler(look_ahead=0, batch_size=1, charging_engine=engine)
+        self.assertEquals(scheduler.rebuild(), 3)
+
+        report = scheduler.resolve()
+
+        # Due contracts are renovated in renovation date order
+        self.assertEquals(engine.resolve.call_count, 2)
+        self.assertEquals(engine.resolve.call_args_list[0][0][0], ['61004aba5e05acc115f03333'])
+        self.assertEquals(engine.resolve.call_args_list[1][0][0], ['61004aba5e05acc115f022f0'])
+        self.assertEquals(report['total'], 2)
+        self.assertEquals(report['throughput'], 1)
+
+    def test_renovation_date_updated(self):
+
+        self._set_renovation_date('61004aba5e05acc115f022f0', datetime(2013, 04, 01, 00, 00, 00))
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        purchase.state = 'paid'
+
+        charging = charging_engine.ChargingEngine(purchase)
+        charging._generate_invoice = MagicMock()
+        charging._calculate_renovation_date = MagicMock()
+        charging._calculate_renovation_date.return_value = datetime(2013, 05, 01, 00, 00, 00)
+
+        related_model = {
+            'subscription': deepcopy(purchase.contract.pricing_model['subscription'])
+        }
+        charging.end_charging(0, 'Renovation', related_model)
+
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        self.assertEquals(purchase.contract.next_renovation_date, datetime(2013, 05, 01, 00, 00, 00))
+
+        # The new date is calculated from the previous renovation date
+        charging._calculate_renovation_date.assert_called_once_with('per month', datetime(2013, 04, 01, 00, 00, 00))
+
+    @parameterized.expand([
+        ('renovation', datetime(2100, 01, 01, 12, 00, 00), datetime(2100, 01, 31, 12, 00, 00)),
+        ('look_ahead', datetime(2100, 02, 01, 00, 00, 00), datetime(2100, 03, 03, 00, 00, 00))
+    ])
+    def test_calculate_renovation_date(self, name, start, expected):
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        charging = charging_engine.ChargingEngine(purchase)
+
+        cache = charging_engine.config_cache
+        charging_engine.config_cache = MagicMock()
+        charging_engine.config_cache.get_unit.return_value.renovation_period = 30
+
+        try:
+            self.assertEquals(charging._calculate_renovation_date('per month', start), expected)
+        finally:
+            charging_engine.config_cache = cache
+
+    @parameterized.expand([
+        ('overdue', datetime(2013, 04, 01, 12, 00, 00)),
+        ('no_start', None)
+    ])
+    def test_calculate_renovation_date_from_now(self, name, start):
+        purchase = Purchase.objects.get(pk='61004aba5e05acc115f022f0')
+        charging = charging_engine.ChargingEngine(purchase)
+
+        cache = charging_engine.config_cache
+        charging_engine.config_cache = MagicMock()
+        charging_engine.config_cache.get_unit.return_value.renovation_period = 30
+
+        try:
+            before = time.mktime(datetime.now().timetuple())
+            renovation_date = charging._calculate_renovation_date('per month', start)
+            after = time.mktime(datetime.now().timetuple())
+        finally:
+            charging_engine.config_cache = cache
+
+        # An overdue subscription is extended from now, so the scheduler
+        # does not renovate it again in its next run
+        renovation_date = time.mktime(renovation_date.timetuple())
+        self.assertTrue(before + 30 * 86400 <= renovation_date <= after + 30 * 86400)
+
+
+class InvoicePipelineTestCase(TestCase):
+
+    tags = ('invoice-pipeline',)
+
+    def setUp(self):
+        self._pipeline = None
+
+    def tearDown(self):
+        # Stop the worker threads started by the test
+        if self._pipeline is not None:
+            self._pipeline.stop()
+
+        reload(invoice_renderer)
+        reload(invoice_pipeline)
+
+    def test_render_invoice(self):
+        bill_root = tempfile.mkdtemp()
+        invoice_renderer.subprocess = FakeSubprocess()
+        invoice_pipeline.get_database_connection = MagicMock()
+        db = invoice_pipeline.get_database_connection.return_value
+
+        try:
+            with self.settings(BILL_ROOT=bill_root):
+                invoice_pipeline.render_invoice({
+                    'purchase': '61004aba5e05acc115f022f0',
+                    'bill': '/media/bills/11111_2013-04-01.pdf',
+                    'bill_code': u'<html></html>',
+                    'invoice_name': '11111_2013-04-01'
+                })
+
+            self.assertEquals(os.listdir(bill_root), ['11111_2013-04-01.pdf'])
+        finally:
+            shutil.rmtree(bill_root)
+
+        # The purchase is not saved, its bills are not modified
+        self.assertFalse(db.wstore_purchase.update.called)
+
+    def _get_job(self, attempts=0):
+        return {
+            '_id': 1,
+            'purchase': '61004aba5e05acc115f022f0',
+            'bill': '/media/bills/11111_2013-04-01.pdf',
+            'bill_code': u'<html></html>',
+            'invoice_name': '11111_2013-04-01',
+            'attempts': attempts,
+            'claim': 'claim'
+        }
+
+    def _mock_outbox(self):
+        invoice_pipeline.get_database_connection = MagicMock()
+        return invoice_pipeline.get_database_connection.return_value
+
+    @parameterized.expand([
+        ('rendered', None, 0, None),
+        ('retried', Exception('Invoice generation problem'), 0, 'pending'),
+        ('failed', Exception('Invoice generation problem'), 2, 'failed')
+    ])
+    def test_dispatch_job(self, name, error, attempts, state):
+        db = self._mock_outbox()
+        invoice_pipeline.render_invoice = MagicMock(side_effect=error)
+        invoice_pipeline.bump_version = MagicMock()
+
+        pipeline = invoice_pipeline.InvoicePipeline(0, max_retries=2, retry_delay=10)
+        pipeline._claim_job = MagicMock(return_value=self._get_job(attempts))
+
+        self.assertEquals(pipeline.dispatch_job(), 1)
+
+        if state is None:
+            db.wstore_invoice_outbox.remove.assert_called_once_with({'_id': 1, 'claim': 'claim'})
+            self.assertFalse(db.wstore_invoice_outbox.update.called)
+            # The bill is no longer pending in the cached responses
+            invoice_pipeline.bump_version.assert_called_once_with('purchase')
+        else:
+            self.assertFalse(db.wstore_invoice_outbox.remove.called)
+            query, update = db.wstore_invoice_outbox.update.call_args[0]
+            self.assertEquals(query, {'_id': 1, 'claim': 'claim'})
+            self.assertEquals(update['$set']['state'], state)
+            self.assertEquals(update['$set']['attempts'], attempts + 1)
+            self.assertEquals(update['$set']['error'], 'Invoice generation problem')
+            self.assertFalse(invoice_pipeline.bump_version.called)
+
+    def test_empty_outbox(self):
+        self._mock_outbox()
+        invoice_pipeline.render_invoice = MagicMock()
+
+        pipeline = invoice_pipeline.InvoicePipeline(0)
+        pipeline._claim_job = MagicMock(return_value=None)
+
+        self.assertEquals(pipeline.dispatch_job(), 0)
+        self.assertFalse(invoice_pipeline.render_invoice.called)
+
+    def test_invoice_pipeline(self):
+        db = self._mock_outbox()
+        db.wstore_invoice_outbox.find.return_value.count.return_value = 0
+        invoice_pipeline.render_invoice = MagicMock()
+
+        self._pipeline = invoice_pipeline.InvoicePipeline(2)
+        self._pipeline._claim_job = MagicMock(return_value=None)
+
+        job = self._get_job()
+        self._pipeline.submit(job)
+        self._pipeline.join()
+
+        # The invoice is stored in the outbox with its code
+        doc = db.wstore_invoice_outbox.insert.call_args[0][0]
+        self.assertEquals(doc['bill_code'], u'<html></html>')
+        self.assertEquals(doc['purchase'], '61004aba5e05acc115f022f0')
+        self.assertEquals(doc['state'], 'pending')
+
+        # The workers are started and waited for the submitted invoice
+        self.assertEquals(len(self._pipeline._threads), 2)
+        query = db.wstore_invoice_outbox.find.call_args[0][0]
+        self.assertEquals(query['_id'], {'$in': [doc['_id']]})
+
+        self._pipeline.stop()
+        self.assertEquals(self._pipeline._threads, [])
+
+    def test_invoice_pipeline_sync(self):
+        db = self._mock_outbox()
+        invoice_pipeline.render_invoice = MagicMock(side_effect=Exception('Invoice generation problem'))
+
+        pipeline = invoice_pipeline.InvoicePipeline(0)
+
+        error = None
+        try:
+            pipeline.submit(self._get_job())
+        except Exception, e:
+            error = e
+
+        self.assertEquals(unicode(error), 'Invoice generation problem')
+
+        # The failed invoice remains in the outbox to be retried
+        doc = db.wstore_invoice_outbox.insert.call_args[0][0]
+        self.assertEquals(doc['state'], 'rendering')
+        update = db.wstore_invoice_outbox.update.call_args[0][1]
+        self.assertEquals(update['$set']['state'], 'pending')
+
+    def test_requeue_failed(self):
+        db = self._mock_outbox()
+        db.wstore_invoice_outbox.update.return_value = {'n': 2}
+
+        pipeline = invoice_pipeline.InvoicePipeline(0)
+
+        self.assertEquals(pipeline.requeue_failed(), 2)
+
+        query, update = db.wstore_invoice_outbox.update.call_args[0]
+        self.assertEquals(query, {'state': 'failed'})
+        self.assertEquals(update['$set']['state'], 'pending')
+        self.assertEquals(update['$set']['attempts'], 0)
+        self.assertTrue(db.wstore_invoice_outbox.update.call_args[1]['multi'])
+
+    def test_pending_bills(self):
+        db = self._mock_outbox()
+        db.wstore_invoice_outbox.find.return_value = [{
+            'purchase': '61004aba5e05acc115f022f0',
+            'bill': '/media/bills/11111_2013-04-01.pdf'
+        }]
+
+        pending_bills = invoice_pipeline.get_pending_bills(['61004aba5e05acc115f022f0', '61005aba8e05ac2115f022f0'])
+
+        self.assertEquals(pending_bills, {
+            '61004aba5e05acc115f022f0': ['/media/bills/11111_2013-04-01.pdf'],
+            '61005aba8e05ac2115f022f0': []
+        })
+        query = db.wstore_invoice_outbox.find.call_args[0][0]
+        self.assertEquals(query, {'purchase': {'$in': ['61004aba5e05acc115f022f0', '61005aba8e05ac2115f022f0']}})
+
+    def test_bill_template_cache(self):
+        invoice_renderer.loader = MagicMock()
+
+        template = invoice_renderer.get_bill_template('contracting/bill_template_use.html')
+
+        self.assertTrue(invoice_renderer.get_bill_template('contracting/bill_template_use.html') is template)
+        invoice_renderer.loader.get_template.assert_called_once_with('contracting/bill_template_use.html')
+
+    @parameterized.expand([
+        ('script', 'ScriptInvoiceRenderer'),
+        ('wstore.charging_engine.invoice_renderer.ScriptInvoiceRenderer', 'ScriptInvoiceRenderer')
+    ])
+    def test_load_invoice_renderer(self, renderer, renderer_class):
+        self.assertEquals(invoice_renderer.load_invoice_renderer(renderer).__class__.__name__, renderer_class)
+
+
+class PaymentClientRegistryTestCase(TestCase):
+
+    tags = ('payment-clients',)
+
+    def setUp(self):
+        self._payment_client = settings.PAYMENT_CLIENT
+        settings.PAYMENT_CLIENT = 'wstore.charging_engine.tests.FakeClient'
+
+    def tearDown(self):
+        settings.PAYMENT_CLIENT = self._payment_client
+        reload(views)
+
+    def test_payment_client_registry(self):
+
+        registry = registry_module.PaymentClientRegistry()
+        registry._load_class = MagicMock(return_value=FakeClient)
+
+        client = registry.get_client(None)
+        registry.get_client(None)
+
+        # The client class is only resolved once
+        self.assertTrue(isinstance(client, FakeClient))
+        registry._load_class.assert_called_once_with('wstore.charging_engine.tests.FakeClient')
+
+        registry_module.time = MagicMock()
+        registry_module.time.time.side_effect = [0, 0.02, 0, 3]
+
+        registry.call(client, 'start_redirection_payment', '10', 'EUR')
+        registry.call(client, 'end_redirection_payment', 'token', 'payer')
+
+        reload(registry_module)
+
+        latencies = registry.get_latencies()
+        self.assertEquals(latencies.keys(), ['FakeClient'])
+        self.assertEquals(latencies['FakeClient']['count'], 2)
+        self.assertEquals(latencies['FakeClient']['total_ms'], 3020)
+
+        buckets = dict([(bucket['le'], bucket['count']) for bucket in latencies['FakeClient']['buckets']])
+        self.assertEquals(buckets[50], 1)
+        self.assertEquals(buckets[5000], 1)
+        self.assertEquals(sum(buckets.values()), 2)
+
+    @parameterized.expand([
+        ('admin', True, 200),
+        ('forbidden', False, 403)
+    ])
+    def test_payment_latency_view(self, name, staff, status):
+
+        user = User.objects.create_user(username='test_user', email='', password='passwd')
+        user.is_staff = staff
+
+        views.payment_clients = MagicMock()
+        views.payment_clients.get_latencies.return_value = {}
+
+        request = RequestFactory().get('/api/administration/payments/latency', HTTP_ACCEPT='application/json')
+        request.user = user
+
+        collection = views.PaymentLatencyCollection(permitted_methods=('GET',))
+        response = collection.read(request)
+
+        self.assertEquals(response.status_code, status)
+
 
+class FiPayClientTestCase(TestCase):
 
-class AdaptorWrapperThread():
+    tags = ('payment-clients',)
+
+    def setUp(self):
+        fipay_client._session = MagicMock()
+        fipay_client._session.post.return_value.status_code = 200
+
+    def tearDown(self):
+        reload(fipay_client)
+
+    @override_settings(PAYMENT_TIMEOUT=10)
+    def test_request_timeout(self):
+        purchase = MagicMock()
+        purchase.customer.userprofile.access_token = 'aaaaa'
+
+        client = fipay_client.FiPayClient(purchase)
+        client.end_redirection_payment('token', 'payer')
+
+        self.assertEquals(fipay_client._session.post.call_args[1]['timeout'], 10)
+
+
+class FakeCDROutbox():
 
     _context = None
-    _url = None
-    _cdr = None
+    _rss = None
 
     def __init__(self, context):
         self._context = context
 
-    def __call__(self, url, cdr):
-        self._url = url
-        self._cdr = cdr
-        return self
-
-    def start(self):
-        self._context._cdrs = self._cdr
+    def __call__(self, rss, cdr):
+        self._rss = rss
+        self._context._cdrs = cdr
 
 
 @override_settings(STORE_NAME='wstore')
@@ -1358,7 +2052,7 @@ class CDRGeranationTestCase(TestCase):
 
     @classmethod
     def setUpClass(cls):
-        charging_engine.RSSAdaptorThread = AdaptorWrapperThread(cls)
+        charging_engine.queue_cdrs = FakeCDROutbox(cls)
         charging_engine.get_country_code = lambda x: '1'
         charging_engine.get_curency_code = lambda x: '1'
         super(CDRGeranationTestCase, cls).setUpClass()
@@ -1554,6 +2248,103 @@ class CDRGeranationTestCase(TestCase):
         self.assertEqual(cdr['country'], '1')
         self.assertEqual(cdr['customer'], 'test_user')
 
+    def _get_subscription_parts(self):
+        return {
+            'subscription': [{
+                'title': 'example part',
+                'unit': 'per month',
+                'currency': 'EUR',
+                'value': '10'
+            }, {
+                'title': 'example part2',
+                'unit': 'per week',
+                'currency': 'EUR',
+                'value': '3'
+            }]
+        }
+
+    def test_cdr_generation_block_reservation(self):
+        purchase = self._create_purchase()
+
+        charging = charging_engine.ChargingEngine(purchase)
+        charging._price_model = {
+            'general_currency': 'EUR'
+        }
+        charging._generate_cdr(self._get_subscription_parts(), str(datetime.now()))
+        charging._generate_cdr(self._get_subscription_parts(), str(datetime.now()))
+
+        # The correlation numbers are reserved once per charge
+        self.assertEqual([cdr['correlation'] for cdr in self._cdrs], ['2', '3'])
+
+        org = Organization.objects.get(pk=purchase.owner_organization.pk)
+        self.assertEqual(org.correlation_number, 4)
+
+    def test_cdr_generation_release(self):
+        purchase = self._create_purchase()
+
+        charging = charging_engine.ChargingEngine(purchase)
+        charging._price_model = {
+            'general_currency': 'EUR'
+        }
+
+        queue_cdrs = charging_engine.queue_cdrs
+        charging_engine.queue_cdrs = MagicMock(side_effect=Exception('Database error'))
+
+        error = None
+        try:
+            charging._generate_cdr(self._get_subscription_parts(), str(datetime.now()))
+        except Exception, e:
+            error = e
+        finally:
+            charging_engine.queue_cdrs = queue_cdrs
+
+        self.assertEqual(unicode(error), 'Database error')
+
+        # The reserved numbers are released to be used by the next charge
+        db = get_database_connection()
+        released = db.wstore_released_correlation.find({'counter': ObjectId(purchase.owner_organization.pk)})
+        self.assertEqual(sorted([doc['correlation_number'] for doc in released]), [0, 1])
+
+        charging._generate_cdr(self._get_subscription_parts(), str(datetime.now()))
+        charging._generate_cdr(self._get_subscription_parts(), str(datetime.now()))
+
+        # The released numbers are consumed first, so no gaps are created
+        self.assertEqual([cdr['correlation'] for cdr in self._cdrs], ['2', '3'])
+        self.assertEqual(db.wstore_released_correlation.find().count(), 0)
+
+        org = Organization.objects.get(pk=purchase.owner_organization.pk)
+        self.assertEqual(org.correlation_number, 4)
+
+    def test_cdr_generation_release_not_fitting(self):
+        purchase = self._create_purchase()
+
+        charging = charging_engine.ChargingEngine(purchase)
+        charging._price_model = {
+            'general_currency': 'EUR'
+        }
+
+        # A failed charge released a single number
+        db = get_database_connection()
+        db.wstore_released_correlation.insert({
+            'counter': ObjectId(purchase.owner_organization.pk),
+            'correlation_number': 0
+        })
+        org = Organization.objects.get(pk=purchase.owner_organization.pk)
+        org.correlation_number = 1
+        org.save()
+
+        charging._generate_cdr(self._get_subscription_parts(), str(datetime.now()))
+
+        # The charge does not fit in the released number, so a new block
+        # is reserved and the released number is kept
+        self.assertEqual([cdr['correlation'] for cdr in self._cdrs], ['1', '2'])
+
+        released = db.wstore_released_correlation.find({'counter': ObjectId(purchase.owner_organization.pk)})
+        self.assertEqual([doc['correlation_number'] for doc in released], [0])
+
+        org = Organization.objects.get(pk=purchase.owner_organization.pk)
+        self.assertEqual(org.correlation_number, 3)
+
 
 class PriceFunctionPaymentTestCase(TestCase):
 
@@ -1564,7 +2355,7 @@ class PriceFunctionPaymentTestCase(TestCase):
     def setUpClass(cls):
         cls._auth = settings.OILAUTH
         settings.PAYMENT_CLIENT = 'wstore.charging_engine.tests.FakeClient'
-        charging_engine.subprocess = FakeSubprocess()
+        charging_engine.get_invoice_pipeline = MagicMock()
         settings.OILAUTH = False
         super(PriceFunctionPaymentTestCase, cls).setUpClass()
 
@@ -1617,8 +2408,8 @@ class PriceFunctionPaymentTestCase(TestCase):
         self.assertEqual(contract.charges[0]['cost'], 33.00)
         self.assertEqual(contract.charges[0]['concept'], 'pay per use')
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 3)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 3)
 
     def test_price_function_payment_renovation(self):
 
@@ -1675,8 +2466,8 @@ class PriceFunctionPaymentTestCase(TestCase):
         self.assertEqual(contract.charges[0]['cost'], 38.00)
         self.assertEqual(contract.charges[0]['concept'], 'Renovation')
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 3)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 3)
 
 
     def test_price_function_payment_deduction(self):
@@ -1734,8 +2525,8 @@ class PriceFunctionPaymentTestCase(TestCase):
         self.assertEqual(contract.charges[0]['cost'], 33.30)
         self.assertEqual(contract.charges[0]['concept'], 'Renovation')
 
-        self.assertEqual(len(contract.pending_sdrs), 0)
-        self.assertEqual(len(contract.applied_sdrs), 3)
+        self.assertEqual(len(get_sdrs(contract, 'pending')), 0)
+        self.assertEqual(len(get_sdrs(contract, 'applied')), 3)
 
     def test_price_function_payment_exception(self):
 
@@ -1778,6 +2569,132 @@ class PriceFunctionPaymentTestCase(TestCase):
             self.assertTrue(error)
             self.assertEquals(msg, err)
 
+    def test_price_function_cache(self):
+
+        from wstore.charging_engine.price_resolver import PriceFunctionCache
+
+        functions = [{
+            'variables': {
+                'var': {
+                    'type': 'usage',
+                    'label': 'Calls'
+                },
+                'const': {
+                    'type': 'constant',
+                    'label': 'constant',
+                    'value': str(i)
+                }
+            },
+            'function': {
+                'operation': '*',
+                'arg1': 'var',
+                'arg2': 'const'
+            }
+        } for i in range(3)]
+
+        cache = PriceFunctionCache(2)
+
+        compiled = cache.get(functions[0])
+        self.assertEquals(compiled.usage_labels, {'calls': ['var']})
+        self.assertEquals(compiled.constants, {'const': 0.0})
+        self.assertEquals(compiled.evaluate({'var': 5.0, 'const': 3.0}), 15.0)
+
+        # Equivalent functions are compiled only once
+        self.assertTrue(cache.get(deepcopy(functions[0])) is compiled)
+
+        # The least recently used function is evicted
+        evicted = cache.get(functions[1])
+        cache.get(functions[0])
+        cache.get(functions[2])
+
+        self.assertTrue(cache.get(functions[0]) is compiled)
+        self.assertFalse(cache.get(functions[1]) is evicted)
+
+    def test_price_resolver_accounting_index(self):
+
+        from wstore.charging_engine.price_resolver import PriceResolver
+
+        sdrs = [{
+            'component_label': 'Calls',
+            'unit': 'Call',
+            'value': '15'
+        }, {
+            'component_label': 'minutes',
+            'unit': 'minute',
+            'value': '7'
+        }, {
+            'component_label': 'calls',
+            'unit': 'call',
+            'value': '5'
+        }]
+
+        pricing_model = {
+            'pay_per_use': [{
+                'label': 'fixed',
+                'unit': 'CALL',
+                'value': '0.5'
+            }, {
+                'label': 'function',
+                'price_function': {
+                    'variables': {
+                        'call_var': {'type': 'usage', 'label': 'CALLS'},
+                        'minute_var': {'type': 'usage', 'label': 'Minutes'}
+                    },
+                    'function': {
+                        'operation': '+',
+                        'arg1': 'call_var',
+                        'arg2': 'minute_var'
+                    }
+                }
+            }]
+        }
+
+        resolver = PriceResolver()
+        self.assertEquals(resolver.resolve_price(pricing_model, sdrs), 37.0)
+
+        # Labels and units are matched ignoring the case and the
+        # related SDRs keep their original order
+        charges = resolver.get_applied_sdr()['charges']
+        self.assertEquals(charges[0]['accounting'], [sdrs[0], sdrs[2]])
+        self.assertEquals(charges[1]['accounting'], sdrs)
+
+    def test_decimal_price_resolver(self):
+
+        from wstore.charging_engine import price_resolver
+
+        sdrs = [{
+            'component_label': 'data',
+            'unit': 'MB',
+            'value': '0.1'
+        }] * 3
+
+        pricing_model = {
+            'single_payment': [{'value': '0.1'}],
+            'subscription': [{'value': '0.2'}],
+            'pay_per_use': [{
+                'unit': 'MB',
+                'value': '0.7'
+            }]
+        }
+
+        # Float calculations drift from the exact amount
+        resolver = price_resolver.PriceResolver()
+        resolver.resolve_price(pricing_model, sdrs)
+        self.assertNotEquals(resolver.get_applied_sdr()['charges'][0]['price'], 0.21)
+
+        with self.settings(PRICE_RESOLVER_MODE='decimal'):
+            resolver = price_resolver.get_price_resolver('EUR')
+
+        self.assertTrue(isinstance(resolver, price_resolver.DecimalPriceResolver))
+        self.assertEquals(resolver.resolve_price(pricing_model, sdrs), 0.51)
+        self.assertEquals(resolver.get_applied_sdr()['charges'][0]['price'], 0.21)
+
+        # Prices are rounded to the minor unit of the currency
+        resolver = price_resolver.get_price_resolver('JPY')
+        self.assertTrue(isinstance(resolver, price_resolver.PriceResolver))
+        resolver = price_resolver.DecimalPriceResolver('JPY')
+        self.assertEquals(resolver.resolve_price({'single_payment': [{'value': '10.5'}]}), 11.0)
+
 
 SDR_INT1 = {
     u'component_label': u'usage',
@@ -1878,16 +2795,29 @@ class CDRRetrievingTestCase(TestCase):
         views.Purchase = MagicMock()
         views.Purchase.objects.get.return_value = self._purchase_mock
 
+        views.ServiceRecord = MagicMock()
+        self._set_sdrs([])
+
     def tearDown(self):
         reload(views)
 
+    def _set_sdrs(self, sdrs):
+        records = []
+        for sdr in sdrs:
+            record = MagicMock()
+            record.get_info.return_value = deepcopy(sdr)
+            records.append(record)
+
+        views.ServiceRecord.objects.filter.return_value.order_by.return_value = records
+
     def _add_pending(self):
-        self._purchase_mock.contract.pending_sdrs = [deepcopy(SDR_INT1), deepcopy(SDR_INT2)]
-        self._purchase_mock.contract.applied_sdrs = []
+        self._set_sdrs([SDR_INT1, SDR_INT2])
 
-    def _add_applied(self):
-        self._purchase_mock.contract.pending_sdrs = [deepcopy(SDR_INT3), deepcopy(SDR_INT4)]
-        self._purchase_mock.contract.applied_sdrs = [deepcopy(SDR_INT1), deepcopy(SDR_INT2)]
+    def _add_from_to(self):
+        self._set_sdrs([SDR_INT2, SDR_INT3])
+
+    def _add_label(self):
+        self._set_sdrs([SDR_INT4])
 
     def _not_staff(self):
         self._add_pending()
@@ -1910,8 +2840,13 @@ class CDRRetrievingTestCase(TestCase):
 
     @parameterized.expand([
         ('basic', (200, [SDR1, SDR2]), _add_pending),
-        ('applied_from_to', (200, [SDR2, SDR3]), _add_applied, "?from=2015-09-14 10:00:01.0&to=2015-09-14 10:00:02.0"),
-        ('label', (200, [SDR4]), _add_applied, "?label=usage2"),
+        ('applied_from_to', (200, [SDR2, SDR3]), _add_from_to, "?from=2015-09-14 10:00:01.0&to=2015-09-14 10:00:02.0", {
+            'time_stamp__gte': datetime(2015, 9, 14, 10, 0, 1),
+            'time_stamp__lte': datetime(2015, 9, 14, 10, 0, 2)
+        }),
+        ('label', (200, [SDR4]), _add_label, "?label=usage2", {
+            'component_label__iexact': 'usage2'
+        }),
         ('not_staff', (200, [SDR1, SDR2]), _not_staff),
         ('contract_error', (200, []), _contract_error),
         ('contract_none', (200, []), _contract_none),
@@ -1932,7 +2867,7 @@ class CDRRetrievingTestCase(TestCase):
             "message": 'Invalid "to" parameter, must be a datetime'
         }), None, "?to=2015:09:14 10:00:01.0")
     ])
-    def test_cdrs_retrieving(self, name, expected, side_effect=None, qstring=""):
+    def test_cdrs_retrieving(self, name, expected, side_effect=None, qstring="", query=None):
 
         if side_effect is not None:
             side_effect(self)
@@ -1955,3 +2890,8 @@ class CDRRetrievingTestCase(TestCase):
 
         # Validate calls
         views.Purchase.objects.get.assert_called_once_with(ref='aaaaa')
+
+        if query is not None:
+            query['contract'] = self._purchase_mock.contract
+            views.ServiceRecord.objects.filter.assert_called_once_with(**query)
+            views.ServiceRecord.objects.filter.return_value.order_by.assert_called_once_with('correlation_number')
@@ -22,7 +22,6 @@ import json
 from bson import ObjectId
 from datetime import datetime
 
-from django.conf import settings
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
@@ -33,11 +32,28 @@ from wstore.store_commons.utils.http import build_response, supported_request_mi
 from wstore.models import Purchase
 from wstore.models import UserProfile
 from wstore.charging_engine.charging_engine import ChargingEngine
+from wstore.charging_engine.models import ServiceRecord
+from wstore.charging_engine.payment_client.registry import payment_clients
 from wstore.contracting.purchase_rollback import rollback
 from wstore.contracting.notify_provider import notify_provider
 from wstore.store_commons.database import get_database_connection
 
 
+SDR_FIELDS = ('offering', 'customer', 'time_stamp', 'correlation_number', 'record_type', 'unit', 'value', 'component_label')
+
+
+def _validate_sdr(data):
+    """
+    Validates the structure of a SDR document
+    """
+    if not isinstance(data, dict):
+        raise Exception('Invalid JSON content')
+
+    for field in SDR_FIELDS:
+        if field not in data:
+            raise Exception('Invalid JSON content')
+
+
 class ServiceRecordCollection(Resource):
 
     def _get_datetime(self, time):
@@ -58,10 +74,7 @@ class ServiceRecordCollection(Resource):
             data = json.loads(request.raw_post_data)
 
             # Validate SDR structure
-            if 'offering' not in data or 'customer' not in data or 'time_stamp' not in data \
-                    or 'correlation_number' not in data or 'record_type' not in data or'unit' not in data \
-                    or 'value' not in data or 'component_label' not in data:
-                raise Exception('Invalid JSON content')
+            _validate_sdr(data)
 
             # Get the purchase
             purchase = Purchase.objects.get(ref=reference)
@@ -116,28 +129,105 @@ class ServiceRecordCollection(Resource):
             except:
                 return build_response(request, 400, 'Invalid "to" parameter, must be a datetime')
 
+        # Filter the SDRs of the contract
+        query = {
+            'contract': contract
+        }
+
+        if from_ is not None:
+            query['time_stamp__gte'] = from_
+
+        if to is not None:
+            query['time_stamp__lte'] = to
+
+        if label is not None:
+            query['component_label__iexact'] = label
+
         # Build response
         response = []
-        sdrs = []
-        sdrs.extend(contract.applied_sdrs)
-        sdrs.extend(contract.pending_sdrs)
+        for sdr in ServiceRecord.objects.filter(**query).order_by('correlation_number'):
+            sdr_info = sdr.get_info()
+            sdr_info['time_stamp'] = unicode(sdr_info['time_stamp'])
+            response.append(sdr_info)
 
-        for sdr in sdrs:
-            if from_ is not None and from_ > sdr['time_stamp']:
-                continue
+        return HttpResponse(json.dumps(response), status=200, mimetype="application/json")
+
+
+class ServiceRecordBatchCollection(Resource):
+
+    def _parse_sdrs(self, request):
+        """
+        Extracts the list of SDRs from a JSON array or a NDJSON stream
+        """
+        if request.META.get('CONTENT_TYPE', '').split(';')[0] == 'application/x-ndjson':
+            return [json.loads(line) for line in request.raw_post_data.splitlines() if line.strip()]
+
+        sdrs = json.loads(request.raw_post_data)
+
+        if not isinstance(sdrs, list):
+            raise Exception('A list of SDRs is required')
+
+        return sdrs
+
+    # This method is used to load a batch of SDR documents
+    # of a single purchase
+    @supported_request_mime_types(('application/json', 'application/x-ndjson'))
+    @authentication_required
+    def create(self, request, reference):
+        try:
+            sdrs = self._parse_sdrs(request)
+        except:
+            return build_response(request, 400, 'Invalid JSON content')
 
-            if to is not None and to < sdr['time_stamp']:
-                break
+        try:
+            purchase = Purchase.objects.get(ref=reference)
+        except:
+            return build_response(request, 404, 'There is not any purchase with reference ' + reference)
+
+        # Records with an invalid structure are rejected without
+        # discarding the rest of the batch
+        response = [None] * len(sdrs)
+        valid_sdrs = []
+        valid_pos = []
 
-            if label is not None and sdr['component_label'].lower() != label.lower():
+        for pos, sdr in enumerate(sdrs):
+            try:
+                _validate_sdr(sdr)
+            except Exception as e:
+                response[pos] = {
+                    'correlation_number': sdr.get('correlation_number') if isinstance(sdr, dict) else None,
+                    'result': 'rejected',
+                    'reason': e.message
+                }
                 continue
 
-            sdr['time_stamp'] = unicode(sdr['time_stamp'])
-            response.append(sdr)
+            valid_sdrs.append(sdr)
+            valid_pos.append(pos)
+
+        try:
+            charging_engine = ChargingEngine(purchase)
+            results = charging_engine.include_sdrs(valid_sdrs)
+        except Exception as e:
+            return build_response(request, 400, e.message)
+
+        for pos, result in zip(valid_pos, results):
+            response[pos] = result
 
         return HttpResponse(json.dumps(response), status=200, mimetype="application/json")
 
 
+class PaymentLatencyCollection(Resource):
+
+    @authentication_required
+    def read(self, request):
+
+        # Only admins can read the latencies of the payment gateways
+        if not request.user.is_staff:
+            return build_response(request, 403, 'Forbidden')
+
+        return HttpResponse(json.dumps(payment_clients.get_latencies()), status=200, mimetype='application/json')
+
+
 class PayPalConfirmation(Resource):
 
     # This method is used to receive the PayPal confirmation
@@ -182,17 +272,9 @@ class PayPalConfirmation(Resource):
 
             pending_info = purchase.contract.pending_payment
 
-            # Get the payment client
-            # Load payment client
-            cln_str = settings.PAYMENT_CLIENT
-            client_class = cln_str.split('.')[-1]
-            client_package = cln_str.partition('.' + client_class)[0]
-
-            payment_client = getattr(__import__(client_package, globals(), locals(), [client_class], -1), client_class)
-
             # build the payment client
-            client = payment_client(purchase)
-            client.end_redirection_payment(token, payer_id)
+            client = payment_clients.get_client(purchase)
+            payment_clients.call(client, 'end_redirection_payment', token, payer_id)
 
             charging_engine = ChargingEngine(purchase)
             accounting = None
@@ -98,9 +98,6 @@ class PurchasesCreationTestCase(TestCase):
     def setUp(self):
         purchases_management.ChargingEngine.resolve_charging = MagicMock()
         purchases_management.ChargingEngine.resolve_charging.return_value = None
-        purchases_management.SearchEngine = MagicMock()
-        se_obj = MagicMock()
-        purchases_management.SearchEngine.return_value = se_obj
         usdl_info = {
             'name': 'test_offering',
             'base_id': 'pk',
@@ -518,11 +515,6 @@ class PurchaseRollbackTestCase(TestCase):
 
     fixtures = ['purch_rollback.json']
 
-    def setUp(self):
-        se_object = MagicMock()
-        purchase_rollback.SearchEngine = MagicMock()
-        purchase_rollback.SearchEngine.return_value = se_object
-
     def test_rollback_not_paid_exeption(self):
 
         user = User.objects.get(pk='51070aba8e05cc2115f022f9')
@@ -890,6 +882,7 @@ class UpdatingPurchasesTestCase(TestCase):
         body_response = json.loads(response.content)
         self.assertEquals(len(body_response['bill']), 1)
         self.assertEquals(body_response['bill'][0], '/media/bills/11111111111.pdf')
+        self.assertEquals(body_response['pending_bills'], [])
         payment_info = {
             'tax_address': {
                 'street': 'test street',
@@ -38,6 +38,7 @@ from wstore.store_commons.utils.version import is_lower_version
 from wstore.offerings.offerings_management import get_offering_info
 from wstore.contracting.purchases_management import create_purchase
 from wstore.charging_engine.charging_engine import ChargingEngine
+from wstore.charging_engine.invoice_pipeline import get_pending_bills
 from wstore.models import Offering, Organization, Context
 from wstore.models import Purchase
 from wstore.models import Resource as store_resource
@@ -271,8 +272,10 @@ class PurchaseCollection(Resource):
                 elif r.download_link != '':
                     response['resources'].append(r.download_link)
 
-            # Load bill URL
+            # Load bill URL, the pending bills are not available
+            # until their invoice is compiled
             response['bill'] = response_info.bill
+            response['pending_bills'] = get_pending_bills([response_info.pk])[response_info.pk]
             status = 201
 
         # Check if it is needed to redirect the user
@@ -28,7 +28,9 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 
 from wstore.models import Offering
+from wstore.search.index_updater import index_updater
 from wstore.social.tagging.tag_manager import TagManager
+from wstore.social.tagging.cooccurrence import cooccurrence_model
 
 
 def read_from_cmd():
@@ -64,6 +66,9 @@ class Command(BaseCommand):
 
         rmtree(index_path, True)
 
+        # The co-occurrence counts are created again with the tags
+        cooccurrence_model.clear()
+
         # Generate new search indexes
         tag_manager = TagManager(index_path)
         for o in Offering.objects.all():
@@ -71,3 +76,6 @@ class Command(BaseCommand):
             o.tags = []
             o.save()
             tag_manager.update_tags(o, aux_tags)
+
+        # Apply the search index updates before the process ends
+        index_updater.flush()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from wstore.rss_adaptor.cdr_outbox import get_cdr_dispatcher
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--retry-failed',
+                action='store_true',
+                dest='retry_failed',
+                default=False,
+                help="Include again in the outbox the CDRs that reached the maximum number of retries"),
+    )
+
+    def handle(self, *args, **options):
+        """
+            This method is used to send the CDRs pending in the
+            outbox to the Revenue Sharing System
+        """
+        dispatcher = get_cdr_dispatcher()
+
+        if options.get('retry_failed'):
+            dispatcher.retry_failed()
+
+        print str(dispatcher.drain()) + ' CDRs processed'
+
+        stats = dispatcher.get_stats()
+        print str(stats['pending']) + ' CDRs pending and ' + str(stats['failed']) + ' failed'
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from django.core.management.base import BaseCommand
+
+from wstore.offerings.rankings import rebuild_rankings
+from wstore.search.index_updater import index_updater
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+            This method is used to compute again the rating of the
+            offerings from their reviews and to reset the newest and
+            top rated rankings
+        """
+        rebuild_rankings()
+
+        # Apply the search index updates before the process ends
+        index_updater.flush()
+        print 'Rankings rebuilt'
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+
+import time
+import rdflib
+
+from django.core.management.base import BaseCommand
+
+from wstore.models import Offering
+from wstore.offerings.usdl.usdl_generator import USDLGenerator
+from wstore.search.searchable_text import extract_text, get_searchable_text
+
+
+DEFAULT_ITERATIONS = 10
+
+
+class Command(BaseCommand):
+
+    def _rdf_text(self, offering):
+        # Text extraction used before the searchable text was cached,
+        # serializing the offering to RDF and parsing it again
+        graph = rdflib.ConjunctiveGraph()
+        graph.parse(
+            data=USDLGenerator().generate_offering_usdl(offering)[0],
+            format='application/rdf+xml'
+        )
+
+        text = offering.name
+        for s, p, o in graph:
+            if isinstance(o, rdflib.Literal):
+                text += ' ' + unicode(o)
+
+        return text
+
+    def _benchmark(self, method, offerings, iterations):
+        start = time.time()
+
+        for i in range(iterations):
+            for offering in offerings:
+                method(offering)
+
+        return ((time.time() - start) * 1000) / (iterations * len(offerings))
+
+    def handle(self, *args, **options):
+        """
+            This method is used to compare the cost per offering of the
+            text extraction methods used for searching and tagging
+        """
+        iterations = DEFAULT_ITERATIONS
+        if len(args) > 0:
+            iterations = int(args[0])
+
+        offerings = list(Offering.objects.all())
+        if not len(offerings):
+            print 'No offerings available'
+            return
+
+        methods = [
+            ('rdf', self._rdf_text),
+            ('description', extract_text),
+            ('cached', get_searchable_text)
+        ]
+
+        for name, method in methods:
+            try:
+                print name + ': ' + ('%.3f' % self._benchmark(method, offerings, iterations)) + ' ms/offering'
+            except Exception, e:
+                print name + ': ' + unicode(e)
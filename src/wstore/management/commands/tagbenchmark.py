@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from wstore.models import Offering
+from wstore.social.tagging.cooccurrence import cooccurrence_model
+from wstore.social.tagging.recommendation_manager import CooccurrenceThead
+
+
+DEFAULT_ITERATIONS = 10
+
+
+class Command(BaseCommand):
+
+    def _index_scan(self, tags):
+        # Recommendation used before the co-occurrence model, scanning
+        # the documents of the tag index for each tag
+        result = []
+        CooccurrenceThead(result, tags).run()
+        return result
+
+    def _benchmark(self, method, tag_sets, iterations):
+        start = time.time()
+
+        for i in range(iterations):
+            for tags in tag_sets:
+                method(tags)
+
+        return ((time.time() - start) * 1000) / (iterations * len(tag_sets))
+
+    def handle(self, *args, **options):
+        """
+            This method is used to compare the cost per request of the
+            tag co-occurrence recommendation methods
+        """
+        iterations = DEFAULT_ITERATIONS
+        if len(args) > 0:
+            iterations = int(args[0])
+
+        tag_sets = [list(o.tags) for o in Offering.objects.all() if len(o.tags)]
+        if not len(tag_sets):
+            print 'No tagged offerings available'
+            return
+
+        methods = [
+            ('index', self._index_scan),
+            ('model', cooccurrence_model.recommend)
+        ]
+
+        for name, method in methods:
+            try:
+                print name + ': ' + ('%.3f' % self._benchmark(method, tag_sets, iterations)) + ' ms/request'
+            except Exception, e:
+                print name + ': ' + unicode(e)
@@ -24,7 +24,7 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, post_syncdb
 from djangotoolbox.fields import ListField
 from djangotoolbox.fields import DictField
 
@@ -32,13 +32,13 @@ from wstore.admin.markets.models import *
 from wstore.admin.repositories.models import *
 from wstore.admin.rss.models import *
 from wstore.admin.searchers import ResourceBrowser
+from wstore.store_commons.config_cache import invalidate_rss, invalidate_context, invalidate_config
+from wstore.store_commons.response_cache import invalidate_offerings, invalidate_resources, invalidate_purchases, invalidate_responses
 
 
 class Context(models.Model):
 
     site = models.OneToOneField(Site)
-    top_rated = ListField()
-    newest = ListField()
     user_refs = DictField()
     allowed_currencies = DictField()
 
@@ -219,6 +219,25 @@ post_save.connect(create_user_profile, sender=User)
 post_save.connect(create_context, sender=Site)
 
 
+# Invalidate the cached configuration when it is modified
+post_save.connect(invalidate_rss, sender=RSS)
+post_delete.connect(invalidate_rss, sender=RSS)
+post_save.connect(invalidate_context, sender=Context)
+post_delete.connect(invalidate_context, sender=Context)
+post_save.connect(invalidate_context, sender=Site)
+post_syncdb.connect(invalidate_config)
+
+
+# Invalidate the cached responses built from the modified objects
+post_save.connect(invalidate_offerings, sender=Offering)
+post_delete.connect(invalidate_offerings, sender=Offering)
+post_save.connect(invalidate_resources, sender=Resource)
+post_delete.connect(invalidate_resources, sender=Resource)
+post_save.connect(invalidate_purchases, sender=Purchase)
+post_delete.connect(invalidate_purchases, sender=Purchase)
+post_syncdb.connect(invalidate_responses)
+
+
 if settings.OILAUTH:
     def set_tokens(sender, instance, created, **kwargs):
         # Check if the user is staff
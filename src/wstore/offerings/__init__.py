@@ -18,9 +18,21 @@
 # along with WStore.
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
+from pymongo import ASCENDING, DESCENDING
+
 from wstore.store_commons.database import get_database_connection
 
 db = get_database_connection()
 
 # Create index for tagging if not created
-db.wstore_offering.ensure_index('tags')
\ No newline at end of file
+db.wstore_offering.ensure_index('tags')
+
+# Create indexes for the queries used to fill the rankings
+db.wstore_offering.ensure_index([
+    ('state', ASCENDING),
+    ('rating', DESCENDING)
+])
+db.wstore_offering.ensure_index([
+    ('state', ASCENDING),
+    ('publication_date', DESCENDING)
+])
@@ -25,7 +25,8 @@ from django.db import models
 from djangotoolbox.fields import ListField, DictField, EmbeddedModelField
 
 from wstore.models import Marketplace
-from wstore.models import Organization, Context
+from wstore.models import Organization
+from wstore.store_commons.config_cache import config_cache
 
 
 class MarketOffering(models.Model):
@@ -55,6 +56,10 @@ class Offering(models.Model):
     publication_date = models.DateTimeField(null=True, blank=True)
     applications = ListField()
     open = models.BooleanField(default=False)
+    # Text of the offering description used for searching, it is
+    # rebuilt when the hash of its source info changes
+    searchable_text = models.TextField(null=True, blank=True)
+    searchable_hash = models.CharField(max_length=40, null=True, blank=True)
 
     def is_owner(self, user):
         """
@@ -69,7 +74,7 @@ class Offering(models.Model):
         return owns
 
     def _get_site(self):
-        return Context.objects.all()[0].site.domain
+        return config_cache.get_site_domain()
 
     def get_uri(self):
         """
@@ -107,6 +112,7 @@ class Offering(models.Model):
 class ResourceVersion(models.Model):
     version = models.CharField(max_length=20)
     resource_path = models.CharField(max_length=100)
+    content_hash = models.CharField(max_length=64, blank=True)
     download_link = models.CharField(max_length=200)
     resource_usdl = models.URLField()
     resource_uri = models.URLField()
@@ -125,6 +131,8 @@ class Resource(models.Model):
     state = models.CharField(max_length=50)
     download_link = models.CharField(max_length=200)
     resource_path = models.CharField(max_length=100)
+    # SHA-256 hash of the uploaded resource file
+    content_hash = models.CharField(max_length=64, blank=True)
     offerings = ListField(models.ForeignKey(Offering))
     open = models.BooleanField(default=False)
     old_versions = ListField(EmbeddedModelField(ResourceVersion))
@@ -140,14 +148,12 @@ class Resource(models.Model):
             url = self.download_link
         else:
             # Build the URL for downloading the resource from WStore
-            cnt = Context.objects.all()[0]
-            url = urljoin(cnt.site.domain, self.resource_path)
+            url = urljoin(config_cache.get_site_domain(), self.resource_path)
 
         return url
 
     def get_uri(self):
-        site_context = Context.objects.all()[0]
-        base_uri = site_context.site.domain
+        base_uri = config_cache.get_site_domain()
         resource_id = urllib2.quote(self.provider.name + '/' + self.name + '/' + self.version)
 
         return urljoin(base_uri, 'api/offering/resources/' + resource_id)
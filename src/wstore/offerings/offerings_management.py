@@ -29,16 +29,18 @@ from copy import deepcopy
 from urllib2 import HTTPError
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 
 from wstore.repository_adaptor.repositoryAdaptor import repository_adaptor_factory, unreg_repository_adaptor_factory
 from wstore.market_adaptor.marketadaptor import marketadaptor_factory
 from wstore.search.search_engine import SearchEngine
 from wstore.offerings.offering_rollback import OfferingRollback
+from wstore.offerings import rankings
 from wstore.models import Offering, Resource, Repository
 from wstore.models import Marketplace, MarketOffering
 from wstore.models import Purchase
-from wstore.models import UserProfile, Context
+from wstore.models import UserProfile, Organization
 from wstore.store_commons.utils.version import is_lower_version
 from wstore.store_commons.utils.name import is_valid_id
 from wstore.store_commons.utils.url import is_valid_url
@@ -47,13 +49,67 @@ from wstore.store_commons.errors import ConflictError
 from wstore.store_commons.database import get_database_connection
 from wstore.offerings.usdl.usdl_generator import USDLGenerator
 from wstore.models import RSS
-from wstore.charging_engine.models import Unit
+from wstore.charging_engine.models import Unit, Contract
+from wstore.charging_engine.invoice_pipeline import get_pending_bills
 from wstore.rss_adaptor.rss_manager_factory import RSSManagerFactory
 
 
-def get_offering_info(offering, user):
+class OfferingInfoLoader():
+    """
+    Loads the objects related to a list of offerings needed for building
+    their info for a given user, using a fixed number of queries
+    """
+
+    def __init__(self, offerings, user):
+        self.user_profile = UserProfile.objects.get(user=user)
+        self.organization = self.user_profile.current_organization
+
+        self.organizations = Organization.objects.in_bulk(list(set([off.owner_organization_id for off in offerings])))
+        self.users = User.objects.in_bulk(list(set([off.owner_admin_user_id for off in offerings])))
+
+        # The resources bound to an offering can be stored as ObjectIds,
+        # so the map is keyed by the unicode value of their pks
+        self.resources = Resource.objects.in_bulk(list(set([unicode(res) for off in offerings for res in off.resources])))
+
+        # Load the purchases of the offerings acquired by the user
+        # or its current organization, including their contracts
+        self.purchases = {}
+        self.contracts = {}
+        self.pending_bills = {}
+
+        if self.user_profile.is_user_org():
+            purchased = [off.pk for off in offerings if off.pk in self.user_profile.offerings_purchased]
+            owner = {'customer': user, 'organization_owned': False}
+        else:
+            purchased = [off.pk for off in offerings if off.pk in self.organization.offerings_purchased]
+            owner = {'owner_organization': self.organization}
+
+        if len(purchased):
+            purchases = Purchase.objects.filter(offering__in=purchased, **owner)
+            self.purchases = dict([(purchase.offering_id, purchase) for purchase in purchases])
+
+            contracts = Contract.objects.filter(purchase__in=[purchase.pk for purchase in self.purchases.values()])
+            self.contracts = dict([(contract.purchase_id, contract) for contract in contracts])
+
+            # Bills whose invoice has not been compiled yet
+            self.pending_bills = get_pending_bills([purchase.pk for purchase in self.purchases.values()])
+
+
+def get_offerings_info(offerings, user):
+    """
+    Builds the info of a list of offerings loading their related
+    objects for all of them at once
+    """
+    loader = OfferingInfoLoader(offerings, user)
+    return [get_offering_info(offering, user, loader=loader) for offering in offerings]
+
+
+def get_offering_info(offering, user, loader=None):
+
+    if loader is None:
+        loader = OfferingInfoLoader([offering], user)
 
-    user_profile = UserProfile.objects.get(user=user)
+    user_profile = loader.user_profile
 
     # Check if the user has purchased the offering
     state = offering.state
@@ -63,24 +119,24 @@ def get_offering_info(offering, user):
 
         if offering.pk in user_profile.offerings_purchased:
             state = 'purchased'
-            purchase = Purchase.objects.get(offering=offering, customer=user, organization_owned=False)
+            purchase = loader.purchases[offering.pk]
 
         if offering.pk in user_profile.rated_offerings:
             state = 'rated'
 
     else:
-        if offering.pk in user_profile.current_organization.offerings_purchased:
+        if offering.pk in loader.organization.offerings_purchased:
             state = 'purchased'
-            purchase = Purchase.objects.get(offering=offering, owner_organization=user_profile.current_organization)
+            purchase = loader.purchases[offering.pk]
 
-        if user_profile.current_organization.has_rated_offering(user, offering):
+        if loader.organization.has_rated_offering(user, offering):
             state = 'rated'
 
     # Load offering data
     result = {
         'name': offering.name,
-        'owner_organization': offering.owner_organization.name,
-        'owner_admin_user_id': offering.owner_admin_user.username,
+        'owner_organization': loader.organizations[offering.owner_organization_id].name,
+        'owner_admin_user_id': loader.users[offering.owner_admin_user_id].username,
         'version': offering.version,
         'state': state,
         'description_url': offering.description_url,
@@ -98,7 +154,7 @@ def get_offering_info(offering, user):
 
     # Load resources
     for res in offering.resources:
-        resource = Resource.objects.get(pk=res)
+        resource = loader.resources[unicode(res)]
         res_info = {
             'name': resource.name,
             'version': resource.version,
@@ -123,6 +179,7 @@ def get_offering_info(offering, user):
 
     if not offering.open and (state == 'purchased' or state == 'rated'):
         result['bill'] = purchase.bill
+        result['pending_bills'] = loader.pending_bills.get(purchase.pk, [])
 
         # If the offering has been purchased the parsed pricing model is replaced
         # With the pricing model of the contract in order to included the extra info
@@ -130,7 +187,7 @@ def get_offering_info(offering, user):
 
         if len(result['offering_description']['pricing']['price_plans']) > 0:
 
-            pricing_model = purchase.contract.pricing_model
+            pricing_model = loader.contracts[purchase.pk].pricing_model
             related_plan = None
 
             if len(result['offering_description']['pricing']['price_plans']) > 1:
@@ -160,6 +217,16 @@ def get_offering_info(offering, user):
     return result
 
 
+# Fields that can be used for sorting purchased offerings and
+# whether they are sorted in descending order
+PURCHASED_SORTING = {
+    'creation_date': True,
+    'publication_date': True,
+    'name': False,
+    'rating': True
+}
+
+
 def _get_purchased_offerings(user, db, pagination=None, sort=None):
 
     # Get the user profile purchased offerings
@@ -176,29 +243,36 @@ def _get_purchased_offerings(user, db, pagination=None, sort=None):
         user_purchased = user_profile['offerings_purchased']
 
         # Append user offerings from organization offerings
+        included = set(user_purchased)
         for offer in organization['offerings_purchased']:
-            if offer not in user_purchased:
+            if offer not in included:
                 user_purchased.append(offer)
+                included.add(offer)
 
     # Check sorting
-    if sort == 'creation_date':
-        user_purchased = sorted(user_purchased, key=lambda off: Offering.objects.get(pk=off).creation_date, reverse=True)
-    elif sort == 'publication_date':
-        user_purchased = sorted(user_purchased, key=lambda off: Offering.objects.get(pk=off).publication_date, reverse=True)
-    elif sort == 'name':
-        user_purchased = sorted(user_purchased, key=lambda off: Offering.objects.get(pk=off).name)
-    elif sort == 'rating':
-        user_purchased = sorted(user_purchased, key=lambda off: Offering.objects.get(pk=off).rating, reverse=True)
+    if sort not in PURCHASED_SORTING:
+        # If pagination has been defined take the offerings corresponding to the page
+        if pagination:
+            skip = int(pagination['skip']) - 1
+            limit = int(pagination['limit'])
+            user_purchased = user_purchased[skip:(skip + limit)]
+
+        return user_purchased
+
+    # Load the sorting field of all the purchased offerings in a single
+    # query. The offerings are sorted with a stable sort, so the ones with
+    # the same value keep the purchase order
+    values = dict([(unicode(off['_id']), off.get(sort)) for off in db.wstore_offering.find(
+        {'_id': {'$in': [ObjectId(off) for off in user_purchased]}},
+        fields=[sort]
+    )])
+    user_purchased = sorted(user_purchased, key=lambda off: values[off], reverse=PURCHASED_SORTING[sort])
 
     # If pagination has been defined take the offerings corresponding to the page
     if pagination:
         skip = int(pagination['skip']) - 1
         limit = int(pagination['limit'])
-
-        if skip < len(user_purchased):
-            user_purchased = user_purchased[skip:(skip + limit)]
-        else:
-            user_purchased = []
+        user_purchased = user_purchased[skip:(skip + limit)]
 
     return user_purchased
 
@@ -260,19 +334,17 @@ def get_offerings(user, filter_='published', state=None, pagination=None, sort=N
     if pagination:
         prov_offerings = prov_offerings.skip(int(pagination['skip']) - 1).limit(int(pagination['limit']))
 
-    result = []
-
+    pks = []
     for offer in prov_offerings:
         if '_id' in offer:
-            pk = str(offer['_id'])
+            pks.append(str(offer['_id']))
         else:
-            pk = offer
+            pks.append(offer)
 
-        offering = Offering.objects.get(pk=pk)
-        # Use get_offering_info to create the JSON with the offering info
-        result.append(get_offering_info(offering, user))
+    # Get the offerings with a single query keeping the order
+    offerings = Offering.objects.in_bulk(pks)
 
-    return result
+    return get_offerings_info([offerings[pk] for pk in pks], user)
 
 
 def count_offerings(user, filter_='published', state=None):
@@ -692,6 +764,9 @@ def publish_offering(user, offering, data):
     offering.publication_date = datetime.now()
     offering.save()
 
+    # Include the offering in the newest and top rated rankings
+    rankings.update_offering(offering)
+
     # Update offering indexes
     index_path = os.path.join(settings.BASEDIR, 'wstore')
     index_path = os.path.join(index_path, 'search')
@@ -774,45 +849,8 @@ def delete_offering(user, offering):
         if not offering.open:
             se.update_index(offering)
 
-        context = Context.objects.all()[0]
-        # Check if the offering is in the newest list
-        if offering.pk in context.newest:
-            # Remove the offering from the newest list
-            newest = context.newest
-
-            if len(newest) < 8:
-                newest.remove(offering.pk)
-            else:
-                # Get the 8 newest offerings using the publication date for sorting
-                db = get_database_connection()
-                offerings = db.wstore_offering
-                newest_off = offerings.find({'state': 'published'}).sort('publication_date', -1).limit(8)
-
-                newest = []
-                for n in newest_off:
-                    newest.append(str(n['_id']))
-
-            context.newest = newest
-            context.save()
-
-        # Check if the offering is in the top rated list
-        if offering.pk in context.top_rated:
-            # Remove the offering from the top rated list
-            top_rated = context.top_rated
-            if len(top_rated) < 8:
-                top_rated.remove(offering.pk)
-            else:
-                # Get the 4 top rated offerings
-                db = get_database_connection()
-                offerings = db.wstore_offering
-                top_off = offerings.find({'state': 'published', 'rating': {'$gt': 0}}).sort('rating', -1).limit(8)
-
-                top_rated = []
-                for t in top_off:
-                    top_rated.append(str(t['_id']))
-
-            context.top_rated = top_rated
-            context.save()
+        # Remove the offering from the newest and top rated rankings
+        rankings.update_offering(offering)
 
         if offering.open:
             _remove_offering(offering, se)
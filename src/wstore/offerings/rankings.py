@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 - 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from __future__ import unicode_literals
+
+import os
+
+from django.conf import settings
+
+from wstore.store_commons.database import get_database_connection
+from wstore.store_commons.response_cache import bump_version
+
+
+# Field of the offering documents used for sorting each ranking
+RANKINGS = {
+    'top_rated': 'rating',
+    'newest': 'publication_date'
+}
+
+# Number of attempts of a ranking update before giving up when other
+# processes are updating the same ranking
+MAX_ATTEMPTS = 5
+
+
+def update_rating(offering, rating_delta, count_delta):
+    """
+    Updates the running sum and count of the ratings of an offering,
+    returning its new average rating
+    """
+    db = get_database_connection()
+
+    counter = db.wstore_offering_rating.find_and_modify(
+        query={'_id': offering.pk},
+        update={'$inc': {'sum': rating_delta, 'count': count_delta}},
+        upsert=True,
+        new=True
+    )
+
+    if counter['count'] <= 0:
+        return 0
+
+    return float(counter['sum']) / counter['count']
+
+
+def _get_size():
+    return getattr(settings, 'RANKING_SIZE', 24)
+
+
+def _get_capacity():
+    # The rankings keep some extra offerings so removing an offering
+    # does not require querying the collection
+    return _get_size() * 2
+
+
+def _get_key(name, category):
+    if category is None:
+        return name
+
+    return name + ':' + category
+
+
+def _get_score(offering, name):
+    if offering.state != 'published':
+        return None
+
+    return getattr(offering, RANKINGS[name])
+
+
+def _query_ranking(name, category):
+    """
+    Sorts the published offerings of a ranking, this is only done when
+    the ranking does not contain enough offerings
+    """
+    db = get_database_connection()
+
+    query = {'state': 'published'}
+    if category is not None:
+        query['tags'] = category
+
+    field = RANKINGS[name]
+    capacity = _get_capacity()
+
+    entries = [{
+        'id': unicode(doc['_id']),
+        'score': doc[field]
+    } for doc in db.wstore_offering.find(query, fields=[field]).sort(field, -1).limit(capacity)]
+
+    # If the query has returned less offerings than the capacity
+    # the ranking contains all the published offerings
+    return entries, len(entries) < capacity
+
+
+def _save_ranking(key, version, entries, complete):
+    """
+    Saves a ranking if it has not been modified since it was read
+    """
+    db = get_database_connection()
+    doc = {
+        'entries': entries,
+        'complete': complete,
+        'version': version + 1
+    }
+
+    if version == 0:
+        doc['_id'] = key
+        try:
+            db.wstore_ranking.insert(doc)
+        except Exception:
+            return False
+
+        bump_version('ranking')
+        return True
+
+    result = db.wstore_ranking.update({'_id': key, 'version': version}, {'$set': doc})
+    if not result['n']:
+        return False
+
+    # The cached rankings are no longer valid
+    bump_version('ranking')
+    return True
+
+
+def _insert_entry(entries, pk, score):
+    for i, entry in enumerate(entries):
+        if entry['score'] < score:
+            entries.insert(i, {'id': pk, 'score': score})
+            return
+
+    entries.append({'id': pk, 'score': score})
+
+
+def _update_ranking(name, category, pk, score):
+    """
+    Moves an offering to the position given by its score, or removes it
+    if the score is None, without sorting the ranking again
+    """
+    db = get_database_connection()
+    key = _get_key(name, category)
+
+    for attempt in range(MAX_ATTEMPTS):
+        doc = db.wstore_ranking.find_one({'_id': key})
+
+        if doc is None:
+            if score is None:
+                return
+
+            # The ranking is created including the offering
+            entries, complete = _query_ranking(name, category)
+            if _save_ranking(key, 0, entries, complete):
+                return
+
+            continue
+
+        entries = [entry for entry in doc['entries'] if entry['id'] != pk]
+        changed = len(entries) != len(doc['entries'])
+        complete = doc['complete']
+
+        # The offering can only be placed if the ranking contains all the
+        # offerings with a higher score
+        if score is not None and (complete or (len(entries) and score >= entries[-1]['score'])):
+            _insert_entry(entries, pk, score)
+            changed = True
+
+            if len(entries) > _get_capacity():
+                entries = entries[:_get_capacity()]
+                complete = False
+
+        if not changed:
+            return
+
+        if not complete and len(entries) < _get_size():
+            entries, complete = _query_ranking(name, category)
+
+        if _save_ranking(key, doc['version'], entries, complete):
+            return
+
+
+def update_offering(offering, categories=None):
+    """
+    Updates the position of an offering in the global rankings and in the
+    rankings of its categories, which are given by its tags. Offerings
+    not published are removed from the rankings
+    """
+    if categories is None:
+        categories = [None] + list(offering.tags)
+
+    for name in RANKINGS:
+        score = _get_score(offering, name)
+        for category in categories:
+            _update_ranking(name, category, offering.pk, score)
+
+
+def update_categories(offering, old_tags):
+    """
+    Updates the category rankings of an offering whose tags have changed
+    """
+    for name in RANKINGS:
+        for category in set(old_tags) - set(offering.tags):
+            _update_ranking(name, category, offering.pk, None)
+
+    update_offering(offering, categories=list(set(offering.tags) - set(old_tags)))
+
+
+def get_ranking(name, limit=8, category=None):
+    """
+    Returns the ids of the first offerings of a ranking
+    """
+    if name not in RANKINGS:
+        raise ValueError('Invalid ranking')
+
+    if limit <= 0:
+        raise ValueError('The limit must be higher than 0')
+
+    if limit > _get_size():
+        raise ValueError('The ranking only contains ' + unicode(_get_size()) + ' offerings')
+
+    db = get_database_connection()
+    key = _get_key(name, category)
+    doc = db.wstore_ranking.find_one({'_id': key}, fields={'entries': {'$slice': limit}})
+
+    if doc is None:
+        entries, complete = _query_ranking(name, category)
+        _save_ranking(key, 0, entries, complete)
+    else:
+        entries = doc['entries']
+
+    return [entry['id'] for entry in entries[:limit]]
+
+
+def rebuild_rankings():
+    """
+    Computes again the rating counters of the offerings from their
+    reviews and removes the rankings, which are created when needed.
+    The search documents of the offerings whose rating changes are
+    scheduled to be updated
+    """
+    from wstore.models import Offering
+    from wstore.search.search_engine import SearchEngine
+    from wstore.social.reviews.models import Review
+
+    db = get_database_connection()
+    db.wstore_offering_rating.remove()
+
+    se = SearchEngine(os.path.join(settings.BASEDIR, 'wstore', 'search', 'indexes'))
+
+    counters = {}
+    for review in Review.objects.all():
+        counter = counters.setdefault(review.offering_id, {'sum': 0, 'count': 0})
+        counter['sum'] += review.rating
+        counter['count'] += 1
+
+    for offering in Offering.objects.all():
+        counter = counters.get(offering.pk, {'sum': 0, 'count': 0})
+        db.wstore_offering_rating.insert({
+            '_id': offering.pk,
+            'sum': counter['sum'],
+            'count': counter['count']
+        })
+
+        rating = 0
+        if counter['count']:
+            rating = float(counter['sum']) / counter['count']
+
+        if offering.rating != rating:
+            Offering.objects.filter(pk=offering.pk).update(rating=rating)
+            se.schedule_update(offering)
+
+    db.wstore_ranking.remove()
+
+    # The raw updates do not send the save signals
+    bump_version('offering')
+    bump_version('ranking')
@@ -21,27 +21,13 @@
 
 from __future__ import unicode_literals
 
-from wstore.models import ResourcePlugin, Resource
+from wstore.models import Resource
+from wstore.offerings.resource_plugins.plugin_registry import plugin_registry
 from functools import wraps
 
 
-def load_plugin_module(module):
-    module_class_name = module.split('.')[-1]
-    module_package = module.partition('.' + module_class_name)[0]
-
-    module_class = getattr(__import__(module_package, globals(), locals(), [module_class_name], -1), module_class_name)
-
-    return module_class()
-
-
-def _get_plugin_model(name):
-    try:
-        plugin_model = ResourcePlugin.objects.get(name=name)
-    except:
-        # Validate resource type
-        raise ValueError('Invalid request: The specified resource type is not registered')
-
-    return plugin_model
+def _is_plugin_type(resource_type):
+    return resource_type != 'Downloadable' and resource_type != 'API'
 
 
 def register_resource_validation_events(func):
@@ -52,16 +38,16 @@ def register_resource_validation_events(func):
             raise ValueError('Invalid request: Missing required field resource_type')
 
         new_data = data
-        if data['resource_type'] != 'Downloadable' and data['resource_type'] != 'API':
-            plugin_model = _get_plugin_model(data['resource_type'])
-            plugin_module = load_plugin_module(plugin_model.module)
+        if _is_plugin_type(data['resource_type']):
+            plugin = plugin_registry.get_plugin(data['resource_type'])
 
-            new_data = plugin_module.on_pre_create_validation(provider, data, file_=file_)
+            if plugin.implements('on_pre_create_validation'):
+                new_data = plugin.call('on_pre_create_validation', provider, data, file_=file_)
 
         resource_data = func(provider, new_data, file_=None)
 
-        if data['resource_type'] != 'Downloadable' and data['resource_type'] != 'API':
-            plugin_module.on_post_create_validation(provider, data, file_=file)
+        if _is_plugin_type(data['resource_type']):
+            plugin.call('on_post_create_validation', provider, data, file_=file_)
 
         return resource_data
 
@@ -73,9 +59,10 @@ def register_resource_events(func):
     @wraps(func)
     def wrapper(provider, user, data):
         # Get plugin models
-        if data['resource_type'] != 'Downloadable' and data['resource_type'] != 'API':
+        if _is_plugin_type(data['resource_type']):
 
-            plugin_model = _get_plugin_model(data['resource_type'])
+            plugin = plugin_registry.get_plugin(data['resource_type'])
+            plugin_model = plugin.model
 
             # Validate format
             if data['link'] != "" and 'URL' not in plugin_model.formats:
@@ -88,11 +75,8 @@ def register_resource_events(func):
             if len(plugin_model.media_types) > 0 and data['content_type'] not in plugin_model.media_types:
                 raise ValueError('Invalid media type: ' + data['content_type'] + ' is not allowed for the resource type')
 
-            # Load plugin module
-            plugin_module = load_plugin_module(plugin_model.module)
-
             # Call on pre create event handler
-            plugin_module.on_pre_create(provider, data)
+            plugin.call('on_pre_create', provider, data)
 
         if data['resource_type'] == 'API' and data['content_path'] != "":
             raise ValueError('Invalid plugin format: File not allowed for the resource type')
@@ -101,9 +85,9 @@ def register_resource_events(func):
         func(provider, user, data)
 
         # Call on post create event handler
-        if data['resource_type'] != 'Downloadable' and data['resource_type'] != 'API':
+        if _is_plugin_type(data['resource_type']) and plugin.implements('on_post_create'):
             resource = Resource.objects.get(name=data['name'], provider=provider, version=data['version'])
-            plugin_module.on_post_create(resource)
+            plugin.call('on_post_create', resource)
 
     return wrapper
 
@@ -113,16 +97,16 @@ def upgrade_resource_validation_events(func):
     @wraps(func)
     def wrapper(resource, data, file_=None):
         new_data = data
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_model = _get_plugin_model(resource.resource_type)
-            plugin_module = load_plugin_module(plugin_model.module)
+        if _is_plugin_type(resource.resource_type):
+            plugin = plugin_registry.get_plugin(resource.resource_type)
 
-            new_data = plugin_module.on_pre_upgrade_validation(resource, data, file_=file_)
+            if plugin.implements('on_pre_upgrade_validation'):
+                new_data = plugin.call('on_pre_upgrade_validation', resource, data, file_=file_)
 
         resource_data = func(resource, new_data, file_=None)
 
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_module.on_post_upgrade_validation(resource, data, file_=file)
+        if _is_plugin_type(resource.resource_type):
+            plugin.call('on_post_upgrade_validation', resource, data, file_=file_)
 
         return resource_data
 
@@ -134,8 +118,9 @@ def upgrade_resource_events(func):
     @wraps(func)
     def wrapper(resource, user):
 
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_model = _get_plugin_model(resource.resource_type)
+        if _is_plugin_type(resource.resource_type):
+            plugin = plugin_registry.get_plugin(resource.resource_type)
+            plugin_model = plugin.model
 
             # Validate format
             if resource.download_link != "" and 'URL' not in plugin_model.formats:
@@ -144,11 +129,8 @@ def upgrade_resource_events(func):
             if resource.resource_path != "" and 'FILE' not in plugin_model.formats:
                 raise ValueError('Invalid plugin format: File not allowed for the resource type')
 
-            # Load plugin module
-            plugin_module = load_plugin_module(plugin_model.module)
-
             # Call on pre upgrade event handler
-            plugin_module.on_pre_upgrade(resource)
+            plugin.call('on_pre_upgrade', resource)
 
         if resource.resource_type == 'API' and resource.resource_path != "":
             raise ValueError('Invalid plugin format: File not allowed for the resource type')
@@ -157,8 +139,8 @@ def upgrade_resource_events(func):
         func(resource, user)
 
         # Call on post upgrade event handler
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_module.on_post_upgrade(resource)
+        if _is_plugin_type(resource.resource_type):
+            plugin.call('on_post_upgrade', resource)
 
     return wrapper
 
@@ -168,25 +150,23 @@ def update_resource_events(func):
     @wraps(func)
     def wrapper(resource, user):
 
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_model = _get_plugin_model(resource.resource_type)
+        if _is_plugin_type(resource.resource_type):
+            plugin = plugin_registry.get_plugin(resource.resource_type)
+            plugin_model = plugin.model
 
             # Validate media type
             if len(plugin_model.media_types) > 0 and resource.content_type not in plugin_model.media_types:
                 raise ValueError('Invalid media type: ' + resource.content_type + ' is not allowed for the resource type')
 
-            # Load plugin module
-            plugin_module = load_plugin_module(plugin_model.module)
-
             # Call on pre update event handler
-            plugin_module.on_pre_update(resource)
+            plugin.call('on_pre_update', resource)
 
         # Call method
         func(resource, user)
 
         # Call on post update event handler
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_module.on_post_update(resource)
+        if _is_plugin_type(resource.resource_type):
+            plugin.call('on_post_update', resource)
 
     return wrapper
 
@@ -195,20 +175,17 @@ def delete_resource_events(func):
 
     @wraps(func)
     def wrapper(resource, user):
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_model = _get_plugin_model(resource.resource_type)
-
-            # Load plugin module
-            plugin_module = load_plugin_module(plugin_model.module)
+        if _is_plugin_type(resource.resource_type):
+            plugin = plugin_registry.get_plugin(resource.resource_type)
 
             # Call on pre delete event handler
-            plugin_module.on_pre_delete(resource)
+            plugin.call('on_pre_delete', resource)
 
         # Call method
         func(resource, user)
 
         # Call on post delete event handler
-        if resource.resource_type != 'Downloadable' and resource.resource_type != 'API':
-            plugin_module.on_post_delete(resource)
+        if _is_plugin_type(resource.resource_type):
+            plugin.call('on_post_delete', resource)
 
     return wrapper
@@ -34,6 +34,8 @@ from wstore.offerings.resource_plugins.plugin_error import PluginError
 from wstore.offerings.resource_plugins.plugin_rollback import installPluginRollback
 from wstore.models import ResourcePlugin, Resource
 from wstore.offerings.resource_plugins.plugin import Plugin
+from wstore.offerings.resource_plugins.plugin_registry import plugin_registry
+from wstore.store_commons.response_cache import bump_version
 
 
 class PluginLoader():
@@ -121,6 +123,11 @@ class PluginLoader():
             overrides=json_info.get('overrides', [])
         )
 
+        # Discard any previous plugin with the same name, the
+        # other processes are notified through the plugin version
+        plugin_registry.invalidate(json_info['name'])
+        bump_version('plugin')
+
         return plugin_id
 
     def uninstall_plugin(self, plugin_id):
@@ -148,3 +155,5 @@ class PluginLoader():
 
         # Remove model
         plugin_model.delete()
+        plugin_registry.invalidate(name)
+        bump_version('plugin')
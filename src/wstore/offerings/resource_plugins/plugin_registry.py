@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from __future__ import unicode_literals
+
+import time
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_syncdb
+
+from wstore.models import ResourcePlugin
+from wstore.offerings.resource_plugins.plugin import Plugin
+from wstore.charging_engine.payment_client.registry import LatencyHistogram
+from wstore.store_commons.response_cache import get_versions
+
+
+HOOKS = (
+    'on_pre_create_validation',
+    'on_post_create_validation',
+    'on_pre_create',
+    'on_post_create',
+    'on_pre_update',
+    'on_post_update',
+    'on_pre_upgrade_validation',
+    'on_post_upgrade_validation',
+    'on_pre_upgrade',
+    'on_post_upgrade',
+    'on_pre_delete',
+    'on_post_delete'
+)
+
+
+def load_plugin_module(module):
+    module_class_name = module.split('.')[-1]
+    module_package = module.partition('.' + module_class_name)[0]
+
+    module_class = getattr(__import__(module_package, globals(), locals(), [module_class_name], -1), module_class_name)
+
+    return module_class()
+
+
+def _get_plugin_model(name):
+    try:
+        plugin_model = ResourcePlugin.objects.get(name=name)
+    except:
+        # Validate resource type
+        raise ValueError('Invalid request: The specified resource type is not registered')
+
+    return plugin_model
+
+
+def _get_hooks(plugin_module):
+    """
+    Returns the hooks overridden by a plugin, the hooks inherited from
+    the Plugin class do nothing so they are not called
+    """
+    hooks = {}
+    for hook in HOOKS:
+        method = getattr(plugin_module, hook, None)
+        if method is None:
+            continue
+
+        if getattr(method, 'im_func', None) is not getattr(Plugin, hook).im_func:
+            hooks[hook] = method
+
+    return hooks
+
+
+class LoadedPlugin():
+    """
+    Resource plugin model together with its instantiated module and the
+    table of the hooks it implements
+    """
+
+    def __init__(self, registry, model, module):
+        self._registry = registry
+        self.model = model
+        self.module = module
+        self.hooks = _get_hooks(module)
+
+    def implements(self, hook):
+        return hook in self.hooks
+
+    def call(self, hook, *args, **kwargs):
+        """
+        Calls a hook of the plugin measuring the time spent on it, not
+        implemented hooks are skipped returning None
+        """
+        if hook not in self.hooks:
+            return None
+
+        start = time.time()
+        try:
+            return self.hooks[hook](*args, **kwargs)
+        finally:
+            self._registry.record(self.model.name, hook, time.time() - start)
+
+
+class PluginRegistry():
+    """
+    Process local cache of the registered resource plugins and their
+    instantiated modules. Entries expire after PLUGIN_CACHE_TTL seconds
+    and are invalidated when the plugin is installed or removed in this
+    process, or when the database is flushed. The plugins installed or
+    removed in other processes are checked once per PLUGIN_CACHE_TTL
+    seconds. Not registered plugins are not cached, so new plugins are
+    available without waiting
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._plugins = {}
+        self._histograms = {}
+        # Plugins version of the last check and the time it was done
+        self._version = None
+        self._version_checked = 0
+
+    def _get_ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+
+        return getattr(settings, 'PLUGIN_CACHE_TTL', 60)
+
+    def get_plugin(self, name):
+        """
+        Returns the loaded plugin of a resource type, raising ValueError
+        if the type is not registered
+        """
+        now = time.time()
+        self._check_version(now)
+
+        with self._lock:
+            entry = self._plugins.get(name)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        plugin_model = _get_plugin_model(name)
+        plugin = LoadedPlugin(self, plugin_model, load_plugin_module(plugin_model.module))
+
+        with self._lock:
+            self._plugins[name] = (now + self._get_ttl(), plugin)
+
+        return plugin
+
+    def _check_version(self, now):
+        """
+        Discards the cached plugins if a plugin has been installed or
+        removed by any process, the version is read from the database
+        at most once per TTL
+        """
+        with self._lock:
+            if now < self._version_checked + self._get_ttl():
+                return
+
+        version = get_versions(['plugin'])['plugin']
+
+        with self._lock:
+            if version != self._version:
+                self._plugins = {}
+                self._version = version
+
+            self._version_checked = now
+
+    def invalidate(self, *names):
+        """
+        Removes the given plugins from the cache, or all the plugins
+        if no name is provided
+        """
+        with self._lock:
+            if not len(names):
+                self._plugins = {}
+
+            for name in names:
+                self._plugins.pop(name, None)
+
+    def record(self, name, hook, seconds):
+        with self._lock:
+            key = (name, hook)
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram()
+
+            histogram = self._histograms[key]
+
+        histogram.record(seconds)
+
+    def get_latencies(self):
+        """
+        Returns the latency histogram of each hook called per plugin
+        """
+        with self._lock:
+            histograms = self._histograms.items()
+
+        latencies = {}
+        for (name, hook), histogram in histograms:
+            latencies.setdefault(name, {})[hook] = histogram.get_info()
+
+        return latencies
+
+
+plugin_registry = PluginRegistry()
+
+
+def invalidate_plugins(sender, **kwargs):
+    # The database has been flushed
+    plugin_registry.invalidate()
+
+
+post_syncdb.connect(invalidate_plugins)
@@ -27,11 +27,17 @@ from nose_parameterized import parameterized
 from shutil import rmtree
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.test.client import RequestFactory
+from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 
 from wstore.offerings.resource_plugins.plugin_manager import PluginManager
 from wstore.offerings.resource_plugins.plugin_error import PluginError
 from wstore.offerings.resource_plugins import plugin_loader
+from wstore.offerings.resource_plugins import plugin_registry
+from wstore.offerings.resource_plugins import views
+from wstore.offerings.resource_plugins.plugin import Plugin
 from wstore.models import ResourcePlugin
 from wstore.offerings.resource_plugins.test_data import *
 
@@ -164,6 +170,7 @@ class PluginLoaderTestCase(TestCase):
         plugin_loader.ResourcePlugin.objects.get.return_value = plugin_mock
 
         plugin_loader.rmtree = MagicMock(name="rmtree")
+        plugin_loader.bump_version = MagicMock(name="bump_version")
 
         if side_effect is not None:
             side_effect(self)
@@ -183,6 +190,9 @@ class PluginLoaderTestCase(TestCase):
             plugin_loader.ResourcePlugin.objects.get.assert_called_once_with(plugin_id='test_plugin')
             plugin_loader.rmtree.assert_called_once_with(os.path.join(plugin_l._plugins_path, 'test_plugin'))
             plugin_mock.delete.assert_called_once_with()
+
+            # The plugin is discarded by the other processes
+            plugin_loader.bump_version.assert_called_once_with('plugin')
         else:
             self.assertTrue(isinstance(error, err_type))
             self.assertEquals(unicode(e), err_msg)
@@ -222,3 +232,141 @@ class PluginValidatorTestCase(TestCase):
 
         reason = plugin_manager.validate_plugin_info(plugin_info)
         self.assertEquals(reason, validation_msg)
+
+
+class FakeHookPlugin(Plugin):
+
+    def on_pre_create(self, provider, data):
+        self.provider = provider
+
+
+class PluginRegistryTestCase(TestCase):
+
+    tags = ('plugin', )
+
+    def setUp(self):
+        self.plugin_model = MagicMock()
+        self.plugin_model.name = 'test plugin'
+        self.plugin_model.module = 'wstore.offerings.resource_plugins.tests.FakeHookPlugin'
+
+        plugin_registry._get_plugin_model = MagicMock(name='_get_plugin_model')
+        plugin_registry._get_plugin_model.return_value = self.plugin_model
+
+        self.registry = plugin_registry.PluginRegistry(ttl=60)
+
+    def tearDown(self):
+        reload(plugin_registry)
+        reload(views)
+
+    def test_plugin_cached(self):
+        plugin = self.registry.get_plugin('test plugin')
+
+        self.assertTrue(isinstance(plugin.module, FakeHookPlugin))
+        self.assertEquals(plugin.model, self.plugin_model)
+        self.assertEquals(self.registry.get_plugin('test plugin'), plugin)
+        plugin_registry._get_plugin_model.assert_called_once_with('test plugin')
+
+        # The plugin is loaded again when invalidated
+        self.registry.invalidate('test plugin')
+        self.assertNotEquals(self.registry.get_plugin('test plugin'), plugin)
+        self.assertEquals(plugin_registry._get_plugin_model.call_count, 2)
+
+    def test_plugin_expired(self):
+        self.registry._ttl = 0
+
+        self.registry.get_plugin('test plugin')
+        self.registry.get_plugin('test plugin')
+
+        self.assertEquals(plugin_registry._get_plugin_model.call_count, 2)
+
+    def test_plugin_changed_in_other_process(self):
+        plugin_registry.get_versions = MagicMock()
+        plugin_registry.get_versions.return_value = {'plugin': 0}
+
+        plugin = self.registry.get_plugin('test plugin')
+        self.assertEquals(self.registry.get_plugin('test plugin'), plugin)
+
+        # The version is not read again until the TTL passes
+        plugin_registry.get_versions.assert_called_once_with(['plugin'])
+
+        # A plugin has been installed or removed by other process
+        plugin_registry.get_versions.return_value = {'plugin': 1}
+        self.assertEquals(self.registry.get_plugin('test plugin'), plugin)
+
+        self.registry._version_checked -= 60
+        self.assertNotEquals(self.registry.get_plugin('test plugin'), plugin)
+        self.assertEquals(plugin_registry._get_plugin_model.call_count, 2)
+        self.assertEquals(plugin_registry.get_versions.call_count, 2)
+
+    @override_settings(PLUGIN_CACHE_TTL=60)
+    def test_default_ttl(self):
+        registry = plugin_registry.PluginRegistry()
+
+        registry.get_plugin('test plugin')
+        registry.get_plugin('test plugin')
+
+        self.assertEquals(plugin_registry._get_plugin_model.call_count, 1)
+
+    def test_invalidated_on_flush(self):
+        plugin_registry.plugin_registry = self.registry
+        self.registry.get_plugin('test plugin')
+
+        # The database is flushed between tests
+        plugin_registry.invalidate_plugins(None)
+
+        self.registry.get_plugin('test plugin')
+        self.assertEquals(plugin_registry._get_plugin_model.call_count, 2)
+
+    def test_not_registered_plugin(self):
+        plugin_registry._get_plugin_model.side_effect = ValueError('Invalid request: The specified resource type is not registered')
+
+        for i in range(2):
+            error = None
+            try:
+                self.registry.get_plugin('not_existing')
+            except Exception, e:
+                error = e
+
+            self.assertTrue(isinstance(error, ValueError))
+
+        # Not registered plugins are not cached
+        self.assertEquals(plugin_registry._get_plugin_model.call_count, 2)
+
+    def test_hooks_dispatch(self):
+        plugin = self.registry.get_plugin('test plugin')
+
+        self.assertEquals(plugin.hooks.keys(), ['on_pre_create'])
+        self.assertTrue(plugin.implements('on_pre_create'))
+        self.assertFalse(plugin.implements('on_post_create'))
+
+        provider = MagicMock()
+        plugin.call('on_pre_create', provider, {})
+        self.assertEquals(plugin.module.provider, provider)
+
+        # Inherited hooks are skipped
+        self.assertEquals(plugin.call('on_pre_create_validation', provider, {}), None)
+
+        latencies = self.registry.get_latencies()
+        self.assertEquals(latencies.keys(), ['test plugin'])
+        self.assertEquals(latencies['test plugin'].keys(), ['on_pre_create'])
+        self.assertEquals(latencies['test plugin']['on_pre_create']['count'], 1)
+
+    @parameterized.expand([
+        ('admin', True, 200),
+        ('forbidden', False, 403)
+    ])
+    def test_plugin_latency_view(self, name, staff, status):
+
+        user = User.objects.create_user(username='test_user', email='', password='passwd')
+        user.is_staff = staff
+
+        views.plugin_registry = MagicMock()
+        views.plugin_registry.get_latencies.return_value = {}
+
+        request = RequestFactory().get('/api/administration/plugins/latency', HTTP_ACCEPT='application/json')
+        request.user = user
+
+        collection = views.PluginLatencyCollection(permitted_methods=('GET',))
+        response = collection.read(request)
+
+        self.assertEquals(response.status_code, status)
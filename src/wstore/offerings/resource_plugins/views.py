@@ -25,8 +25,9 @@ import json
 from django.http import HttpResponse
 
 from wstore.store_commons.resource import Resource
-from wstore.store_commons.utils.http import authentication_required
+from wstore.store_commons.utils.http import build_response, authentication_required
 from wstore.models import ResourcePlugin
+from wstore.offerings.resource_plugins.plugin_registry import plugin_registry
 
 
 class PluginCollection(Resource):
@@ -75,3 +76,15 @@ class PluginCollection(Resource):
 
         mime_type = 'application/JSON; charset=UTF-8'
         return HttpResponse(json.dumps(result), status=200, mimetype=mime_type)
+
+
+class PluginLatencyCollection(Resource):
+
+    @authentication_required
+    def read(self, request):
+
+        # Only admins can read the time spent in the plugin hooks
+        if not request.user.is_staff:
+            return build_response(request, 403, 'Forbidden')
+
+        return HttpResponse(json.dumps(plugin_registry.get_latencies()), status=200, mimetype='application/json')
@@ -20,7 +20,6 @@
 
 from __future__ import unicode_literals
 
-import base64
 import os
 from bson import ObjectId
 
@@ -35,6 +34,7 @@ from wstore.offerings.models import ResourceVersion
 from wstore.store_commons.utils.name import is_valid_id, is_valid_file
 from wstore.store_commons.utils.url import is_valid_url
 from wstore.store_commons.utils.version import Version
+from wstore.store_commons.utils.files import iter_file_chunks, iter_base64_chunks, save_file_chunks
 from wstore.store_commons.errors import ConflictError
 from wstore.offerings.offerings_management import delete_offering
 from wstore.offerings.resource_plugins.plugins.ckan_validation import validate_dataset
@@ -44,14 +44,13 @@ from wstore.offerings.resource_plugins.decorators import register_resource_event
 
 
 def _save_resource_file(provider, name, version, file_):
-    # Load file contents
+    # Load file contents in chunks
     if isinstance(file_, dict):
         f_name = file_['name']
-        content = base64.b64decode(file_['data'])
+        chunks = iter_base64_chunks(file_['data'])
     else:
         f_name = file_.name
-        file_.seek(0)
-        content = file_.read()
+        chunks = iter_file_chunks(file_)
 
     # Check file name
     if not is_valid_file(f_name):
@@ -61,11 +60,9 @@ def _save_resource_file(provider, name, version, file_):
     file_name = provider + '__' + name + '__' + version + '__' + f_name
     path = os.path.join(settings.MEDIA_ROOT, 'resources')
     file_path = os.path.join(path, file_name)
-    f = open(file_path, "wb")
-    f.write(content)
-    f.close()
+    content_hash = save_file_chunks(chunks, file_path)
 
-    return settings.MEDIA_URL + 'resources/' + file_name
+    return settings.MEDIA_URL + 'resources/' + file_name, content_hash
 
 
 def _build_usdl(resource):
@@ -130,6 +127,7 @@ def _create_resource_model(provider, user, resource_data):
         description=resource_data['description'],
         download_link=resource_data['link'],
         resource_path=resource_data['content_path'],
+        content_hash=resource_data['content_hash'],
         content_type=resource_data['content_type'],
         state='created',
         open=resource_data['open'],
@@ -185,7 +183,7 @@ def register_resource(provider, data, file_=None):
 
     if not file_:
         if 'content' in data:
-            resource_data['content_path'] = _save_resource_file(current_organization.name, resource_data['name'], resource_data['version'], data['content'])
+            resource_data['content_path'], resource_data['content_hash'] = _save_resource_file(current_organization.name, resource_data['name'], resource_data['version'], data['content'])
             resource_data['link'] = ''
 
         elif 'link' in data:
@@ -201,11 +199,12 @@ def register_resource(provider, data, file_=None):
 
             resource_data['link'] = data['link']
             resource_data['content_path'] = ''
+            resource_data['content_hash'] = ''
         else:
             raise ValueError('Invalid request: Missing resource content')
 
     else:
-        resource_data['content_path'] = _save_resource_file(current_organization.name, resource_data['name'], resource_data['version'], file_)
+        resource_data['content_path'], resource_data['content_hash'] = _save_resource_file(current_organization.name, resource_data['name'], resource_data['version'], file_)
         resource_data['link'] = ''
 
     resource_data['metadata'] = data.get('metadata', {})
@@ -266,6 +265,7 @@ def upgrade_resource(resource, user, data, file_=None):
     resource.old_versions.append(ResourceVersion(
         version=resource.version,
         resource_path=resource.resource_path,
+        content_hash=resource.content_hash,
         download_link=resource.download_link,
         resource_usdl=resource.resource_usdl,
         resource_uri=resource.resource_uri
@@ -282,7 +282,7 @@ def upgrade_resource(resource, user, data, file_=None):
             file_content = data['content']
 
         # Create new file
-        resource.resource_path = _save_resource_file(resource.provider.name, resource.name, resource.version, file_content)
+        resource.resource_path, resource.content_hash = _save_resource_file(resource.provider.name, resource.name, resource.version, file_content)
         resource.download_link = ''
     elif 'link' in data:
         if not is_valid_url(data['link']):
@@ -290,6 +290,7 @@ def upgrade_resource(resource, user, data, file_=None):
 
         resource.download_link = data['link']
         resource.resource_path = ''
+        resource.content_hash = ''
     else:
         raise ValueError('No resource has been provided')
 
@@ -35,12 +35,13 @@ from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.test.utils import override_settings
 
-from wstore.offerings import offerings_management
+from wstore.offerings import offerings_management, rankings
 from wstore.models import UserProfile
 from wstore.models import Offering
 from wstore.models import Marketplace, MarketOffering
 from wstore.models import Resource
 from wstore.models import Organization
+from wstore.store_commons.database import get_database_connection
 
 from wstore.offerings.test.offering_test_data import *
 
@@ -715,6 +716,44 @@ class PurchasedOfferingRetrievingTestCase(TestCase):
 
         self.assertEquals(validated, len(expected_offerings))
 
+    def test_bulk_offering_info(self):
+        user = User.objects.get(username='test_user2')
+        profile = UserProfile.objects.get(user=user)
+        org = Organization.objects.get(name='test_organization1')
+        org.offerings_purchased = ['21000aba8e05ac2115f022ff', '11000aba8e05ac2115f022f9']
+        org.save()
+        profile.current_organization = org
+        profile.organizations.append({
+            'organization': org.pk,
+            'roles': ['customer', 'provider']
+        })
+        profile.save()
+
+        offerings = list(Offering.objects.all())
+
+        # The info built for a page of offerings using the preloaded
+        # objects is the same built for each offering
+        bulk_info = offerings_management.get_offerings_info(offerings, user)
+        single_info = [offerings_management.get_offering_info(Offering.objects.get(pk=off.pk), user) for off in offerings]
+
+        self.assertEquals(bulk_info, single_info)
+        self.assertEquals(len([info for info in bulk_info if info['state'] == 'purchased']), 2)
+
+    def test_bulk_offering_info_bound_resources(self):
+        user = User.objects.get(username='test_user2')
+
+        # The resources bound through the API are stored as ObjectIds
+        offering = Offering.objects.get(pk='11000aba8e05ac2115f022f9')
+        offering.resources = [ObjectId('61000bba8e05ac2116f022f9')]
+        offering.save()
+
+        offering = Offering.objects.get(pk='11000aba8e05ac2115f022f9')
+        info = offerings_management.get_offerings_info([offering], user)
+
+        self.assertEquals(len(info), 1)
+        self.assertEquals(len(info[0]['resources']), 1)
+        self.assertEquals(info[0]['resources'][0]['name'], Resource.objects.get(pk='61000bba8e05ac2116f022f9').name)
+
 
 class OfferingPaginationTestCase(TestCase):
 
@@ -818,6 +857,57 @@ class PurchasedOfferingPaginationTestCase(TestCase):
         self.assertEqual(offerings[0]['name'], 'test_offering4')
         self.assertEqual(offerings[1]['name'], 'test_offering5')
 
+    @parameterized.expand([
+        ('name', False, None),
+        ('rating', True, None),
+        ('publication_date', True, {'skip': '2', 'limit': '2'}),
+        ('creation_date', True, {'skip': '4', 'limit': '3'}),
+        ('name', False, {'skip': '6', 'limit': '2'})
+    ])
+    def test_purchased_sorting(self, sort, reverse, pagination):
+        user = User.objects.get(username='test_user')
+        profile = UserProfile.objects.get(user=user)
+        org = Organization.objects.get(name='test_organization1')
+        org.offerings_purchased = ['41000aba8e05ac2115f022f0', '11000aba8e05ac2115f022f9', '51100aba8e05ac2115f022f0',
+                                   '21000aba8e05ac2115f022ff', '31000aba8e05ac2115f022f0']
+        org.save()
+        profile.current_organization = org
+        profile.organizations.append({
+            'organization': org.pk,
+            'roles': ['customer', 'provider']
+        })
+        profile.save()
+
+        # Offerings with the same value keep the purchase order
+        purchased = offerings_management._get_purchased_offerings(user, get_database_connection())
+        expected = sorted(purchased, key=lambda off: getattr(Offering.objects.get(pk=off), sort), reverse=reverse)
+
+        if pagination:
+            skip = int(pagination['skip']) - 1
+            expected = expected[skip:skip + int(pagination['limit'])]
+
+        offerings = offerings_management._get_purchased_offerings(user, get_database_connection(), pagination=pagination, sort=sort)
+
+        self.assertEquals(offerings, expected)
+
+    def test_purchased_sorting_ties(self):
+        user = User.objects.get(username='test_user')
+        profile = UserProfile.objects.get(user=user)
+        org = Organization.objects.get(name='test_organization1')
+        org.offerings_purchased = ['41000aba8e05ac2115f022f0', '11000aba8e05ac2115f022f9', '21000aba8e05ac2115f022ff']
+        org.save()
+        profile.current_organization = org
+        profile.organizations.append({
+            'organization': org.pk,
+            'roles': ['customer', 'provider']
+        })
+        profile.save()
+
+        # All the offerings have the same rating
+        offerings = offerings_management._get_purchased_offerings(user, get_database_connection(), sort='rating')
+
+        self.assertEquals(offerings, ['41000aba8e05ac2115f022f0', '11000aba8e05ac2115f022f9', '21000aba8e05ac2115f022ff'])
+
 
 @override_settings(OILAUTH=True)
 class OfferingPublicationTestCase(TestCase):
@@ -1092,11 +1182,7 @@ class OfferingDeletionTestCase(TestCase):
         offerings_management.TagManager = MagicMock()
         offerings_management.TagManager.return_value = self.tag_mock
 
-        offerings_management.Context = MagicMock()
-        self.context_obj = MagicMock()
-        self.context_obj.newest = []
-        self.context_obj.top_rated = []
-        offerings_management.Context.objects.all.return_value = [self.context_obj]
+        offerings_management.rankings = MagicMock()
 
         self._user = MagicMock()
         self._user.userprofile.access_token = "access_token"
@@ -1121,14 +1207,6 @@ class OfferingDeletionTestCase(TestCase):
         offering.open = True
         offering.save()
 
-    def _latest_top(self, offering):
-        self.context_obj.newest = [offering.pk, 'primary1', 'primary2', 'primary3']
-        self.context_obj.top_rated = [offering.pk, 'primary1', 'primary2', 'primary3', 'primary4', 'primary5', 'primary6', 'primary7']
-
-    def _top_latest(self, offering):
-        self.context_obj.newest = [offering.pk, 'primary1', 'primary2', 'primary3', 'primary4', 'primary5', 'primary6', 'primary7']
-        self.context_obj.top_rated = [offering.pk, 'primary1', 'primary2', 'primary3']
-
     def _add_resources(self, offering):
         # Mock resources
         offerings_management.Resource = MagicMock()
@@ -1144,8 +1222,6 @@ class OfferingDeletionTestCase(TestCase):
         ('published', 'test_offering2'),
         ('published_market', 'test_offering3'),
         ('published_open', 'test_offering3', True, False, _open_offering),
-        ('published_newest', 'test_offering3', False, False, _latest_top),
-        ('published_toprated', 'test_offering3', False, False, _top_latest),
         ('deleted', 'test_offering3', False, False, _deleted, PermissionDenied, 'The offering is already deleted'),
     ])
     def test_delete_offering(self, name, offering_name, deleted=False, del_resources=False, side_effect=None, err_type=None, err_msg=None):
@@ -1170,10 +1246,6 @@ class OfferingDeletionTestCase(TestCase):
             # Not error expected
             self.assertEquals(error, None)
 
-            # Assert no included in the context lists
-            self.assertFalse(offering.pk in self.context_obj.newest)
-            self.assertFalse(offering.pk in self.context_obj.top_rated)
-
             if offering.state == 'published':
                 offerings_management.unreg_repository_adaptor_factory.assert_called_once_with(offering.description_url)
 
@@ -1195,6 +1267,13 @@ class OfferingDeletionTestCase(TestCase):
                 self.assertEqual(offering.state, 'deleted')
                 self.se_object.update_index.assert_called_with(offering)
 
+            # Check that published offerings are removed from the rankings
+            if offering_name != 'test_offering':
+                self.assertEquals(offerings_management.rankings.update_offering.call_count, 1)
+                self.assertEquals(offerings_management.rankings.update_offering.call_args[0][0].state, 'deleted')
+            else:
+                self.assertEquals(offerings_management.rankings.update_offering.call_count, 0)
+
             if market_pub:
                 market = Marketplace.objects.get(name="test_marketplace")
                 offerings_management.marketadaptor_factory.assert_called_once_with(market, self._user)
@@ -1203,3 +1282,117 @@ class OfferingDeletionTestCase(TestCase):
         else:
             self.assertTrue(isinstance(error, err_type))
             self.assertEquals(unicode(error), err_msg)
+
+
+def _entries(*entries):
+    return [{'id': pk, 'score': score} for pk, score in entries]
+
+
+@override_settings(RANKING_SIZE=2)
+class RankingsTestCase(TestCase):
+
+    tags = ('rankings',)
+
+    def setUp(self):
+        self._db = get_database_connection()
+        self._db.wstore_ranking.remove()
+        self._db.wstore_offering_rating.remove()
+
+        rankings._query_ranking = MagicMock()
+        rankings._query_ranking.return_value = (_entries(('b', 4), ('c', 3)), True)
+
+    def tearDown(self):
+        reload(rankings)
+        TestCase.tearDown(self)
+
+    def test_update_rating(self):
+        offering = MagicMock()
+        offering.pk = '111111'
+
+        self.assertEquals(rankings.update_rating(offering, 4, 1), 4.0)
+        self.assertEquals(rankings.update_rating(offering, 2, 1), 3.0)
+        self.assertEquals(rankings.update_rating(offering, -2, 0), 2.0)
+        self.assertEquals(rankings.update_rating(offering, -2, -1), 2.0)
+        self.assertEquals(rankings.update_rating(offering, -2, -1), 0)
+
+    @parameterized.expand([
+        ('new_top', _entries(('a', 5), ('b', 4), ('c', 3), ('d', 2)), False, 'e', 4.5, ['a', 'e', 'b', 'c']),
+        ('below_incomplete', _entries(('a', 5), ('b', 4), ('c', 3), ('d', 2)), False, 'e', 1, ['a', 'b', 'c', 'd']),
+        ('below_complete', _entries(('a', 5), ('b', 4)), True, 'e', 1, ['a', 'b', 'e']),
+        ('moved_down', _entries(('a', 5), ('b', 4), ('c', 3), ('d', 2)), False, 'a', 2.5, ['b', 'c', 'a', 'd']),
+        ('dropped', _entries(('a', 5), ('b', 4), ('c', 3)), False, 'a', 1, ['b', 'c']),
+        ('removed_refill', _entries(('a', 5), ('b', 4)), False, 'a', None, ['b', 'c'], True),
+        ('removed_not_included', _entries(('a', 5), ('b', 4)), True, 'e', None, ['a', 'b']),
+        ('not_created', None, False, 'c', 3, ['b', 'c'], True)
+    ])
+    def test_ranking_update(self, name, entries, complete, pk, score, expected, queried=False):
+        if entries is not None:
+            self._db.wstore_ranking.insert({
+                '_id': 'top_rated',
+                'entries': entries,
+                'complete': complete,
+                'version': 1
+            })
+
+        rankings._update_ranking('top_rated', None, pk, score)
+
+        doc = self._db.wstore_ranking.find_one({'_id': 'top_rated'})
+        self.assertEquals([entry['id'] for entry in doc['entries']], expected)
+        self.assertEquals(rankings._query_ranking.called, queried)
+
+    def test_ranking_created(self):
+        rankings.bump_version = MagicMock()
+
+        self.assertTrue(rankings._save_ranking('top_rated', 0, _entries(('a', 5)), True))
+
+        # A new ranking invalidates the cached responses too
+        rankings.bump_version.assert_called_once_with('ranking')
+        self.assertFalse(rankings._save_ranking('top_rated', 0, _entries(('a', 5)), True))
+
+    def test_update_offering_categories(self):
+        offering = MagicMock()
+        offering.pk = 'c'
+        offering.state = 'published'
+        offering.rating = 3
+        offering.publication_date = datetime.now()
+        offering.tags = ['cloud']
+
+        rankings.update_offering(offering)
+
+        for key in ('top_rated', 'top_rated:cloud', 'newest', 'newest:cloud'):
+            self.assertNotEquals(self._db.wstore_ranking.find_one({'_id': key}), None)
+
+        # Unpublished offerings are removed from all the rankings
+        offering.state = 'deleted'
+        rankings._query_ranking.return_value = (_entries(('b', 4)), True)
+        rankings.update_offering(offering)
+
+        for doc in self._db.wstore_ranking.find():
+            self.assertEquals([entry['id'] for entry in doc['entries']], ['b'])
+
+    @parameterized.expand([
+        (1, ['a']),
+        (2, ['a', 'b']),
+        (3, None, 'The ranking only contains 2 offerings'),
+        (0, None, 'The limit must be higher than 0')
+    ])
+    def test_get_ranking(self, limit, expected, err_msg=None):
+        self._db.wstore_ranking.insert({
+            '_id': 'newest',
+            'entries': _entries(('a', 5), ('b', 4), ('c', 3)),
+            'complete': True,
+            'version': 1
+        })
+
+        error = None
+        try:
+            result = rankings.get_ranking('newest', limit=limit)
+        except Exception as e:
+            error = e
+
+        if err_msg is None:
+            self.assertEquals(error, None)
+            self.assertEquals(result, expected)
+        else:
+            self.assertTrue(isinstance(error, ValueError))
+            self.assertEquals(unicode(error), err_msg)
@@ -21,6 +21,7 @@
 from __future__ import unicode_literals
 
 import base64
+import hashlib
 import os
 import wstore
 from StringIO import StringIO
@@ -52,6 +53,7 @@ class ResourceRegisteringTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        reload(wstore.offerings.resource_plugins.plugin_registry)
         reload(wstore.offerings.resource_plugins.decorators)
         reload(resources_management)
 
@@ -214,6 +216,18 @@ class ResourceRegisteringTestCase(TestCase):
 
                 self.assertEquals(res.resource_path, '/media/resources/' + 'test_user__' + data['name'] + '__' + data['version'] + '__' + f_name)
                 res_path = settings.BASEDIR + res.resource_path
+
+                # Check the stored contents and their hash
+                f = open(res_path, 'rb')
+                content = f.read()
+                f.close()
+                self.assertEquals(res.content_hash, hashlib.sha256(content).hexdigest())
+
+                if is_file:
+                    self.assertEquals(content, f1.getvalue())
+                else:
+                    self.assertEquals(content, base64.b64decode(data['content']['data']))
+
                 os.remove(res_path)
             elif 'link' in data:
                 self.assertEquals(res.download_link, data['link'])
@@ -264,8 +278,8 @@ class ResourceRegisteringTestCase(TestCase):
         # Create plugin module mocks
         plugin_mock = MagicMock(name="test_plugin")
         plugin_mock.on_pre_create_validation.return_value = data
-        wstore.offerings.resource_plugins.decorators.load_plugin_module = MagicMock(name="load_plugin_module")
-        wstore.offerings.resource_plugins.decorators.load_plugin_module.return_value = plugin_mock
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module = MagicMock(name="load_plugin_module")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module.return_value = plugin_mock
         reload(resources_management)
 
         self.setUp()
@@ -284,10 +298,15 @@ class ResourceRegisteringTestCase(TestCase):
         if err_type is None:
             self.assertEquals(error, None)
             # Check event calls
+            f = open(settings.BASEDIR + '/wstore/test/test_usdl.rdf')
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+            f.close()
+
             expected_data = {
                 'name': 'Download',
                 'metadata': {},
                 'content_path': '/media/resources/test_user__Download__1.0__test_usdl.rdf',
+                'content_hash': content_hash,
                 'version': '1.0',
                 'link': '',
                 'content_type': 'application/x-widget',
@@ -306,7 +325,7 @@ class ResourceRegisteringTestCase(TestCase):
 
     def test_load_plugin_module(self):
         module = 'wstore.offerings.test.resource_tests.FakePlugin'
-        from wstore.offerings.resource_plugins.decorators import load_plugin_module
+        from wstore.offerings.resource_plugins.plugin_registry import load_plugin_module
 
         loaded_module = load_plugin_module(module)
 
@@ -459,6 +478,7 @@ class ResourceDeletionTestCase(TestCase):
     @classmethod
     def tearDownClass(cls):
         reload(os)
+        reload(wstore.offerings.resource_plugins.plugin_registry)
         reload(wstore.offerings.resource_plugins.decorators)
         reload(resources_management)
         super(ResourceDeletionTestCase, cls).tearDownClass()
@@ -555,9 +575,9 @@ class ResourceDeletionTestCase(TestCase):
 
         # Create plugin module mocks
         self.plugin_mock = MagicMock(name="test_plugin")
-        wstore.offerings.resource_plugins.decorators._get_plugin_model = MagicMock(name="_get_plugin_model")
-        wstore.offerings.resource_plugins.decorators.load_plugin_module = MagicMock(name="load_plugin_module")
-        wstore.offerings.resource_plugins.decorators.load_plugin_module.return_value = self.plugin_mock
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model = MagicMock(name="_get_plugin_model")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module = MagicMock(name="load_plugin_module")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module.return_value = self.plugin_mock
         reload(resources_management)
         self._adaptor_mock = MagicMock()
         resources_management.unreg_repository_adaptor_factory = MagicMock()
@@ -623,6 +643,7 @@ class ResourceUpdateTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        reload(wstore.offerings.resource_plugins.plugin_registry)
         reload(wstore.offerings.resource_plugins.decorators)
         reload(resources_management)
         reload(os)
@@ -637,21 +658,23 @@ class ResourceUpdateTestCase(TestCase):
     def _res_plugin_type(self):
         self.resource.resource_type = 'test_plugin'
         self.plugin_mock = MagicMock(name="test_plugin")
-        wstore.offerings.resource_plugins.decorators._get_plugin_model = MagicMock(name="_get_plugin_model")
-        wstore.offerings.resource_plugins.decorators.load_plugin_module = MagicMock(name="load_plugin_module")
-        wstore.offerings.resource_plugins.decorators.load_plugin_module.return_value = self.plugin_mock
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model = MagicMock(name="_get_plugin_model")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module = MagicMock(name="load_plugin_module")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module.return_value = self.plugin_mock
         reload(resources_management)
         self._mock_resource_libs()
 
     def _invalid_media(self):
         self.resource.resource_type = 'test_plugin'
         self.plugin_mock = MagicMock(name="test_plugin")
-        wstore.offerings.resource_plugins.decorators._get_plugin_model = MagicMock(name="_get_plugin_model")
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model = MagicMock(name="_get_plugin_model")
 
         mock_model = MagicMock(name="ResourcePluginModel")
         mock_model.media_types = ['application/x-widget']
 
-        wstore.offerings.resource_plugins.decorators._get_plugin_model.return_value = mock_model
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model.return_value = mock_model
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module = MagicMock(name="load_plugin_module")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module.return_value = self.plugin_mock
         reload(resources_management)
         self._mock_resource_libs()
 
@@ -688,7 +711,7 @@ class ResourceUpdateTestCase(TestCase):
         # Check event calls
         self.plugin_mock.on_pre_update.assert_called_once_with(self.resource)
         self.plugin_mock.on_post_update.assert_called_once_with(self.resource)
-        wstore.offerings.resource_plugins.decorators._get_plugin_model.assert_called_once_with('test_plugin')
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model.assert_called_once_with('test_plugin')
 
     def _check_no_uploaded(self):
         self.assertEquals(self.resource.resource_usdl, "")
@@ -748,6 +771,7 @@ class ResourceUpgradeTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        reload(wstore.offerings.resource_plugins.plugin_registry)
         reload(wstore.offerings.resource_plugins.decorators)
         reload(resources_management)
         super(ResourceUpgradeTestCase, cls).tearDownClass()
@@ -761,6 +785,7 @@ class ResourceUpgradeTestCase(TestCase):
         self.resource.provider = org
         self.resource.download_link = ''
         self.resource.resource_path = '/media/resources/test_res1.0.rdf'
+        self.resource.content_hash = 'old_hash'
         self.resource.resource_type = 'Downloadable'
         self.resource.version = '0.1'
         self.resource.old_versions = []
@@ -777,18 +802,18 @@ class ResourceUpgradeTestCase(TestCase):
 
     def _mock_save_file(self, data):
         resources_management._save_resource_file = MagicMock()
-        resources_management._save_resource_file.return_value = '/media/resources/test_usdl.rdf'
+        resources_management._save_resource_file.return_value = ('/media/resources/test_usdl.rdf', 'new_hash')
 
     def _mock_res_plugin(self, data):
         self.resource.resource_type = 'test_plugin'
         self.plugin_mock = MagicMock(name="test_plugin")
         self.plugin_mock.on_pre_upgrade_validation.return_value = data
-        wstore.offerings.resource_plugins.decorators._get_plugin_model = MagicMock(name="_get_plugin_model")
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model = MagicMock(name="_get_plugin_model")
         self.mock_model = MagicMock()
         self.mock_model.formats = ['FILE']
-        wstore.offerings.resource_plugins.decorators._get_plugin_model.return_value = self.mock_model
-        wstore.offerings.resource_plugins.decorators.load_plugin_module = MagicMock(name="load_plugin_module")
-        wstore.offerings.resource_plugins.decorators.load_plugin_module.return_value = self.plugin_mock
+        wstore.offerings.resource_plugins.plugin_registry._get_plugin_model.return_value = self.mock_model
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module = MagicMock(name="load_plugin_module")
+        wstore.offerings.resource_plugins.plugin_registry.load_plugin_module.return_value = self.plugin_mock
 
         reload(resources_management)
         resources_management._upload_usdl = MagicMock(name="_upload_usdl")
@@ -842,6 +867,7 @@ class ResourceUpgradeTestCase(TestCase):
             # Check new resource contents
             if 'link' not in data:
                 self.assertEquals(self.resource.resource_path, '/media/resources/test_usdl.rdf')
+                self.assertEquals(self.resource.content_hash, 'new_hash')
                 self.assertEquals(self.resource.download_link, '')
 
                 file_info = self.res_file
@@ -859,6 +885,7 @@ class ResourceUpgradeTestCase(TestCase):
                 )
             else:
                 self.assertEquals(self.resource.resource_path, '')
+                self.assertEquals(self.resource.content_hash, '')
                 self.assertEquals(self.resource.download_link, 'http://newlinktoresource.com')
 
             self.resource.save.assert_called_once_with()
@@ -869,6 +896,7 @@ class ResourceUpgradeTestCase(TestCase):
             old_ver = self.resource.old_versions[0]
             self.assertEquals(old_ver.version, '0.1')
             self.assertEquals(old_ver.resource_path, '/media/resources/test_res1.0.rdf')
+            self.assertEquals(old_ver.content_hash, 'old_hash')
             self.assertEquals(old_ver.download_link, '')
 
             # Check events calls if needed
@@ -24,16 +24,16 @@ import json
 from urllib2 import HTTPError
 
 from django.http import HttpResponse
-from django.contrib.sites.models import get_current_site
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 
 from wstore.store_commons.resource import Resource
+from wstore.store_commons.response_cache import cached_response
 from wstore.store_commons.utils.http import build_response, get_content_type, supported_request_mime_types, \
 authentication_required, identity_manager_required
 from wstore.models import Offering, Organization, Resource as OfferingResource
-from wstore.models import Context
+from wstore.offerings import rankings
 from wstore.offerings.offerings_management import create_offering, get_offerings, get_offering_info, delete_offering,\
-publish_offering, bind_resources, count_offerings, update_offering
+publish_offering, bind_resources, count_offerings, update_offering, get_offerings_info
 from wstore.offerings.resources_management import register_resource, get_provider_resources, delete_resource,\
 update_resource, upgrade_resource
 from wstore.social.reviews.review_manager import ReviewManager
@@ -91,6 +91,7 @@ class OfferingCollection(Resource):
         return build_response(request, 201, 'Created')
 
     @authentication_required
+    @cached_response('offering', 'resource', 'purchase')
     def read(self, request):
         try:
             # Read the query string in order to know the filter and the page
@@ -137,6 +138,7 @@ class OfferingCollection(Resource):
 class OfferingEntry(Resource):
 
     @authentication_required
+    @cached_response('offering', 'resource', 'purchase')
     def read(self, request, organization, name, version):
         user = request.user
         try:
@@ -241,51 +243,41 @@ class PublishEntry(Resource):
             except Exception, e:
                 return build_response(request, 400, unicode(e))
 
-        # Append the new offering to the newest list
-        site = get_current_site(request)
-        context = Context.objects.get(site=site)
+        return build_response(request, 200, 'OK')
 
-        if len(context.newest) < 8:
-            context.newest.insert(0, offering.pk)
-        else:
-            context.newest.pop()
-            context.newest.insert(0, offering.pk)
 
-        context.save()
+def _get_ranking(request, name):
+    """
+    Builds the response of a ranking, which can be limited to the
+    offerings of a category using its tag
+    """
+    try:
+        limit = int(request.GET.get('limit', 8))
+        offerings = rankings.get_ranking(name, limit=limit, category=request.GET.get('category', None))
+    except Exception as e:
+        return build_response(request, 400, unicode(e))
 
-        return build_response(request, 200, 'OK')
+    # Get the offerings with a single query keeping the ranking order
+    offering_objs = Offering.objects.in_bulk(offerings)
+    response = get_offerings_info([offering_objs[pk] for pk in offerings], request.user)
+
+    return HttpResponse(json.dumps(response), status=200, mimetype='application/json;charset=UTF-8')
 
 
 class NewestCollection(Resource):
 
     @authentication_required
+    @cached_response('offering', 'resource', 'purchase', 'ranking')
     def read(self, request):
-
-        site = get_current_site(request)
-        context = Context.objects.get(site=site)
-
-        response = []
-        for off in context.newest:
-            offering = Offering.objects.get(pk=off)
-            response.append(get_offering_info(offering, request.user))
-
-        return HttpResponse(json.dumps(response), status=200, mimetype='application/json')
+        return _get_ranking(request, 'newest')
 
 
 class TopRatedCollection(Resource):
 
     @authentication_required
+    @cached_response('offering', 'resource', 'purchase', 'ranking')
     def read(self, request):
-
-        site = get_current_site(request)
-        context = Context.objects.get(site=site)
-
-        response = []
-        for off in context.top_rated:
-            offering = Offering.objects.get(pk=off)
-            response.append(get_offering_info(offering, request.user))
-
-        return HttpResponse(json.dumps(response), status=200, mimetype='application/json;charset=UTF-8')
+        return _get_ranking(request, 'top_rated')
 
 
 ####################################################################################################
@@ -325,6 +317,7 @@ class ResourceCollection(Resource):
         return build_response(request, 201, 'Created')
 
     @authentication_required
+    @cached_response('resource')
     def read(self, request):
 
         pagination = {
@@ -536,6 +529,7 @@ def _make_review_action(action, request, organization, name, version, review=Non
 class ReviewCollection(Resource):
 
     @authentication_required
+    @cached_response('review')
     def read(self, request, organization, name, version):
         # Get pagination params
         start = request.GET.get('start', None)
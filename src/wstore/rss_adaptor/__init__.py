@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from pymongo import ASCENDING
+
+from wstore.store_commons.database import get_database_connection
+
+db = get_database_connection()
+
+# Create CDR outbox indexes if not created
+db.wstore_cdr_outbox.ensure_index([
+    ('state', ASCENDING),
+    ('next_attempt', ASCENDING)
+])
+db.wstore_cdr_outbox.ensure_index('claim')
+db.wstore_cdr_outbox.ensure_index([
+    ('rss_id', ASCENDING),
+    ('state', ASCENDING),
+    ('created', ASCENDING)
+])
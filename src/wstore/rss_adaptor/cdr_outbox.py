@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import threading
+from bson import ObjectId
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from django.conf import settings
+
+from wstore.models import RSS
+from wstore.rss_adaptor.rss_manager_factory import RSSManagerFactory
+from wstore.store_commons.database import get_database_connection
+
+
+# Seconds between checks of the outbox when there is nothing to send
+POLL_INTERVAL = 5
+
+
+def queue_cdrs(rss, cdrs):
+    """
+    Stores the CDRs to be sent to the RSS in the outbox, so they
+    are not lost if the process ends before sending them
+    """
+    if not len(cdrs):
+        return
+
+    now = datetime.now()
+    db = get_database_connection()
+    db.wstore_cdr_outbox.insert([{
+        'rss_id': ObjectId(rss.pk),
+        'cdr': cdr,
+        'state': 'pending',
+        'attempts': 0,
+        'next_attempt': now,
+        'created': now
+    } for cdr in cdrs])
+
+    get_cdr_dispatcher().notify()
+
+
+class CDRDispatcher():
+    """
+    Sends the CDRs of the outbox to the RSS using a bounded pool of
+    worker threads. The CDRs of an RSS are sent in order of creation,
+    a single batch per RSS at a time, so its correlation numbers are
+    received in sequence. Failed batches are split in order to isolate
+    the invalid CDRs, which are retried with an increasing delay
+    """
+
+    def __init__(self, workers, batch_size=100, max_retries=10, retry_delay=30, claim_timeout=300):
+        self._workers = workers
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        # Time after which the CDRs being sent by a dead process
+        # can be claimed again, it must be greater than the timeout
+        # of the requests made to the RSS
+        self._claim_timeout = claim_timeout
+        self._threads = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+
+    def _start(self):
+        with self._lock:
+            if len(self._threads):
+                return
+
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """
+        Wakes up the workers when new CDRs are included in the outbox.
+        If no workers has been configured the outbox is only drained
+        using the dispatch_cdrs command
+        """
+        if not self._workers:
+            return
+
+        self._start()
+
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            try:
+                dispatched = self.dispatch_batch()
+            except:
+                dispatched = 0
+
+            if not dispatched:
+                with self._cond:
+                    self._cond.wait(POLL_INTERVAL)
+
+    def _lock_rss(self, rss_id, claim, now):
+        """
+        Acquires the lock of an RSS, which is held while a batch of its
+        CDRs is being sent. Locks older than the claim timeout belong
+        to dead processes and can be acquired again
+        """
+        db = get_database_connection()
+
+        try:
+            db.wstore_cdr_lock.find_and_modify({
+                '_id': rss_id,
+                '$or': [
+                    {'claim': None},
+                    {'claimed': {'$lte': now - timedelta(seconds=self._claim_timeout)}}
+                ]
+            }, {
+                '$set': {
+                    'claim': claim,
+                    'claimed': now
+                }
+            }, upsert=True)
+        except DuplicateKeyError:
+            # The lock document exists and it is held by another worker
+            return False
+
+        return True
+
+    def _release_rss(self, rss_id, claim):
+        db = get_database_connection()
+        db.wstore_cdr_lock.update({'_id': rss_id, 'claim': claim}, {'$set': {'claim': None}})
+
+    def _claim_batch(self):
+        """
+        Marks as being sent the next batch of CDRs of an RSS whose oldest
+        not failed CDR is ready to be sent. The newer CDRs of the RSS are
+        not sent while an older one is waiting to be retried
+        """
+        db = get_database_connection()
+        now = datetime.now()
+        query = {'state': {'$in': ['pending', 'sending']}}
+
+        for rss_id in db.wstore_cdr_outbox.distinct('rss_id', query):
+            claim = ObjectId()
+            if not self._lock_rss(rss_id, claim, now):
+                continue
+
+            rss_query = {'rss_id': rss_id, 'state': {'$in': ['pending', 'sending']}}
+            first = db.wstore_cdr_outbox.find_one(rss_query, sort=[('created', ASCENDING)])
+
+            # The CDRs found in sending state were being sent by a
+            # process that did not release the lock
+            if first is None or (first['state'] == 'pending' and first['next_attempt'] > now):
+                self._release_rss(rss_id, claim)
+                continue
+
+            limit = first.get('batch_limit') or self._batch_size
+            ids = [doc['_id'] for doc in db.wstore_cdr_outbox.find(rss_query, ['_id']).sort('created', ASCENDING).limit(limit)]
+
+            db.wstore_cdr_outbox.update({'_id': {'$in': ids}}, {
+                '$set': {
+                    'state': 'sending',
+                    'claimed': now,
+                    'claim': claim
+                }
+            }, multi=True)
+
+            return list(db.wstore_cdr_outbox.find({'claim': claim}).sort('created', ASCENDING))
+
+        return []
+
+    def _retry(self, docs, error):
+        db = get_database_connection()
+        now = datetime.now()
+
+        if len(docs) > 1:
+            # The batch is split so a single invalid CDR does not make
+            # the valid ones fail, the CDRs are sent again in smaller
+            # batches without counting an attempt
+            db.wstore_cdr_outbox.update({'_id': {'$in': [doc['_id'] for doc in docs]}, 'claim': docs[0]['claim']}, {
+                '$set': {
+                    'state': 'pending',
+                    'error': error,
+                    'claim': None,
+                    'batch_limit': len(docs) // 2,
+                    'next_attempt': now + timedelta(seconds=self._retry_delay)
+                }
+            }, multi=True)
+            return
+
+        doc = docs[0]
+        attempts = doc['attempts'] + 1
+        update = {
+            'attempts': attempts,
+            'error': error,
+            'claim': None
+        }
+
+        if attempts > self._max_retries:
+            # The CDR is kept in the outbox to be retried manually
+            update['state'] = 'failed'
+        else:
+            update['state'] = 'pending'
+            update['next_attempt'] = now + timedelta(seconds=self._retry_delay * (2 ** (attempts - 1)))
+
+        db.wstore_cdr_outbox.update({'_id': doc['_id'], 'claim': doc['claim']}, {'$set': update})
+
+    def dispatch_batch(self):
+        """
+        Sends a batch of CDRs in a single request to the RSS, returning
+        the number of CDRs processed
+        """
+        docs = self._claim_batch()
+        if not len(docs):
+            return 0
+
+        try:
+            rss = RSS.objects.get(pk=unicode(docs[0]['rss_id']))
+            rss_factory = RSSManagerFactory(rss)
+            rss_factory.get_rss_adaptor().send_cdr([doc['cdr'] for doc in docs])
+        except Exception, e:
+            self._retry(docs, unicode(e))
+        else:
+            db = get_database_connection()
+            db.wstore_cdr_outbox.remove({'_id': {'$in': [doc['_id'] for doc in docs]}})
+        finally:
+            self._release_rss(docs[0]['rss_id'], docs[0]['claim'])
+
+        return len(docs)
+
+    def drain(self):
+        """
+        Sends the CDRs of the outbox that are ready to be sent in the
+        calling thread, returning the number of CDRs processed
+        """
+        total = 0
+        dispatched = self.dispatch_batch()
+
+        while dispatched:
+            total += dispatched
+            dispatched = self.dispatch_batch()
+
+        return total
+
+    def retry_failed(self):
+        """
+        Includes again in the outbox the CDRs that reached the
+        maximum number of retries
+        """
+        db = get_database_connection()
+        db.wstore_cdr_outbox.update({'state': 'failed'}, {
+            '$set': {
+                'state': 'pending',
+                'attempts': 0,
+                'next_attempt': datetime.now()
+            }
+        }, multi=True)
+
+    def get_stats(self):
+        """
+        Returns the number of CDRs in the outbox in each state
+        """
+        db = get_database_connection()
+        return dict([(state, db.wstore_cdr_outbox.find({'state': state}).count()) for state in ['pending', 'sending', 'failed']])
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_cdr_dispatcher():
+    """
+    Returns the CDR dispatcher of the process
+    """
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = CDRDispatcher(
+                getattr(settings, 'CDR_WORKERS', 2),
+                batch_size=getattr(settings, 'CDR_BATCH_SIZE', 100),
+                max_retries=getattr(settings, 'CDR_MAX_RETRIES', 10),
+                retry_delay=getattr(settings, 'CDR_RETRY_DELAY', 30),
+                claim_timeout=getattr(settings, 'CDR_CLAIM_TIMEOUT', 300)
+            )
+
+    return _dispatcher
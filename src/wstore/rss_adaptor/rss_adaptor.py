@@ -20,29 +20,27 @@
 
 import json
 import urllib2
-import threading
-from bson import ObjectId
+import requests
 from lxml import etree
 from urllib2 import HTTPError
 from urlparse import urljoin
 
+from django.conf import settings
+
 from wstore.store_commons.utils.method_request import MethodRequest
-from wstore.store_commons.database import get_database_connection
-from wstore.models import Organization
 
 
-class RSSAdaptorThread(threading.Thread):
+# Session shared between the CDR batches in order to reuse the
+# keep-alive connections with the RSS
+_session = requests.Session()
 
-    def __init__(self, rss, cdr_info):
-        threading.Thread.__init__(self)
-        self.rss = rss
-        self.cdr = cdr_info
 
-    def run(self):
-        from wstore.rss_adaptor.rss_manager_factory import RSSManagerFactory
-        rss_factory = RSSManagerFactory(self.rss)
-        r = rss_factory.get_rss_adaptor()
-        r.send_cdr(self.cdr)
+def _get_timeout():
+    """
+    Seconds to wait for the RSS, must be lower than the time after which
+    the CDRs being sent can be claimed again by other workers
+    """
+    return getattr(settings, 'CDR_REQUEST_TIMEOUT', 60)
 
 
 class RSSAdaptor():
@@ -147,7 +145,7 @@ class RSSAdaptorV1(RSSAdaptor):
         }
         request = MethodRequest('POST', url, data, headers)
 
-        response = opener.open(request)
+        response = opener.open(request, timeout=_get_timeout())
 
         if not (response.code > 199 and response.code < 300):
             raise HTTPError(response.url, response.code, response.msg, None, None)
@@ -187,27 +185,14 @@ class RSSAdaptorV2(RSSAdaptor):
             'Authorization': 'Bearer ' + self._rss.access_token
         }
 
-        request = MethodRequest('POST', url, json.dumps(data), headers)
+        response = _session.post(url, data=json.dumps(data), headers=headers, timeout=_get_timeout())
 
-        opener = urllib2.build_opener()
-        try:
-            try:
-                opener.open(request)
-            except HTTPError as e:
-                if e.code == 401:
-                    self._rss.refresh_token()
-                    headers['Authorization'] = 'Bearer ' + self._rss.access_token
-                    request = MethodRequest('POST', url, json.dumps(data), headers)
-                    opener.open(request)
-                else:
-                    raise e
-        except:
-
-            db = get_database_connection()
-            # Restore correlation numbers
-            for cdr in cdr_info:
-                org = Organization.objects.get(actor_id=cdr['provider'])
-                db.wstore_organization.find_and_modify(
-                    query={'_id': ObjectId(org.pk)},
-                    update={'$inc': {'correlation_number': -1}}
-                )['correlation_number']
+        if response.status_code == 401:
+            self._rss.refresh_token()
+            headers['Authorization'] = 'Bearer ' + self._rss.access_token
+            response = _session.post(url, data=json.dumps(data), headers=headers, timeout=_get_timeout())
+
+        # The CDRs are kept in the outbox to be retried, so their
+        # correlation numbers are not restored
+        if not (response.status_code > 199 and response.status_code < 300):
+            raise HTTPError(url, response.status_code, response.reason, None, None)
@@ -19,6 +19,9 @@
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
 import json
+from bson import ObjectId
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
 from mock import MagicMock
 from urllib2 import HTTPError
 from nose_parameterized import parameterized
@@ -27,6 +30,7 @@ from django.test import TestCase
 from django.conf import settings
 
 from wstore.rss_adaptor import rss_adaptor, expenditure_manager, rss_manager, model_manager
+from wstore.rss_adaptor import cdr_outbox
 from wstore.store_commons.utils.testing import mock_request
 
 
@@ -466,3 +470,150 @@ class ModelManagerTestCase(TestCase):
 
         # Check returned value
         self.assertEquals(models, mock_models)
+
+
+class CDROutboxTestCase(TestCase):
+
+    tags = ('cdr-outbox',)
+
+    def setUp(self):
+        self._db = MagicMock()
+        cdr_outbox.get_database_connection = MagicMock()
+        cdr_outbox.get_database_connection.return_value = self._db
+
+        cdr_outbox.RSS = MagicMock()
+        self._rss = MagicMock()
+        cdr_outbox.RSS.objects.get.return_value = self._rss
+
+        self._adaptor = MagicMock()
+        cdr_outbox.RSSManagerFactory = MagicMock()
+        cdr_outbox.RSSManagerFactory.return_value.get_rss_adaptor.return_value = self._adaptor
+
+        self._dispatcher = cdr_outbox.CDRDispatcher(0, batch_size=2, max_retries=2, retry_delay=10)
+        self._docs = [{
+            '_id': 1,
+            'rss_id': ObjectId('51000aba8e05ac2115f022f0'),
+            'cdr': {'correlation': '1'},
+            'attempts': 0,
+            'claim': 'claim'
+        }, {
+            '_id': 2,
+            'rss_id': ObjectId('51000aba8e05ac2115f022f0'),
+            'cdr': {'correlation': '2'},
+            'attempts': 2,
+            'claim': 'claim'
+        }]
+
+    def tearDown(self):
+        reload(cdr_outbox)
+
+    def test_queue_cdrs(self):
+        cdr_outbox.get_cdr_dispatcher = MagicMock()
+        rss = MagicMock()
+        rss.pk = '51000aba8e05ac2115f022f0'
+
+        cdr_outbox.queue_cdrs(rss, [{'correlation': '1'}, {'correlation': '2'}])
+
+        docs = self._db.wstore_cdr_outbox.insert.call_args[0][0]
+        self.assertEquals(len(docs), 2)
+        self.assertEquals(docs[0]['cdr'], {'correlation': '1'})
+        self.assertEquals(docs[0]['rss_id'], ObjectId('51000aba8e05ac2115f022f0'))
+        self.assertEquals(docs[0]['state'], 'pending')
+        cdr_outbox.get_cdr_dispatcher.return_value.notify.assert_called_once_with()
+
+    def test_dispatch_batch(self):
+        self._dispatcher._claim_batch = MagicMock()
+        self._dispatcher._claim_batch.return_value = self._docs
+
+        self.assertEquals(self._dispatcher.dispatch_batch(), 2)
+
+        # The batch is sent in a single request
+        cdr_outbox.RSS.objects.get.assert_called_once_with(pk='51000aba8e05ac2115f022f0')
+        self._adaptor.send_cdr.assert_called_once_with([{'correlation': '1'}, {'correlation': '2'}])
+        self._db.wstore_cdr_outbox.remove.assert_called_once_with({'_id': {'$in': [1, 2]}})
+
+    def test_dispatch_batch_split(self):
+        self._dispatcher._claim_batch = MagicMock()
+        self._dispatcher._claim_batch.return_value = self._docs
+        self._adaptor.send_cdr.side_effect = Exception('RSS error')
+
+        self.assertEquals(self._dispatcher.dispatch_batch(), 2)
+
+        self.assertFalse(self._db.wstore_cdr_outbox.remove.called)
+
+        # The failed batch is sent again in halves without counting an attempt
+        self.assertEquals(self._db.wstore_cdr_outbox.update.call_count, 1)
+        query, update = self._db.wstore_cdr_outbox.update.call_args[0]
+        self.assertEquals(query, {'_id': {'$in': [1, 2]}, 'claim': 'claim'})
+        self.assertEquals(update['$set']['state'], 'pending')
+        self.assertEquals(update['$set']['batch_limit'], 1)
+        self.assertFalse('attempts' in update['$set'])
+
+        # The RSS lock is released
+        self._db.wstore_cdr_lock.update.assert_called_once_with(
+            {'_id': ObjectId('51000aba8e05ac2115f022f0'), 'claim': 'claim'},
+            {'$set': {'claim': None}}
+        )
+
+    @parameterized.expand([
+        ('retried', 0, 'pending', 1),
+        ('failed', 1, 'failed', 3)
+    ])
+    def test_dispatch_cdr_error(self, name, doc, state, attempts):
+        self._dispatcher._claim_batch = MagicMock()
+        self._dispatcher._claim_batch.return_value = [self._docs[doc]]
+        self._adaptor.send_cdr.side_effect = Exception('RSS error')
+
+        self.assertEquals(self._dispatcher.dispatch_batch(), 1)
+
+        query, update = self._db.wstore_cdr_outbox.update.call_args[0]
+        self.assertEquals(query, {'_id': self._docs[doc]['_id'], 'claim': 'claim'})
+        self.assertEquals(update['$set']['state'], state)
+        self.assertEquals(update['$set']['attempts'], attempts)
+        self.assertEquals(update['$set']['error'], 'RSS error')
+
+    def _set_outbox(self, first):
+        rss_id = ObjectId('51000aba8e05ac2115f022f0')
+        self._db.wstore_cdr_outbox.distinct.return_value = [rss_id]
+        self._db.wstore_cdr_outbox.find_one.return_value = first
+        self._db.wstore_cdr_outbox.find.return_value.sort.return_value.limit.return_value = [{'_id': 1}]
+
+    def test_claim_batch(self):
+        self._set_outbox({'_id': 1, 'state': 'pending', 'next_attempt': datetime.now(), 'batch_limit': 5})
+
+        self._dispatcher._claim_batch()
+
+        self._db.wstore_cdr_outbox.find.return_value.sort.return_value.limit.assert_called_once_with(5)
+        update = self._db.wstore_cdr_outbox.update.call_args[0]
+        self.assertEquals(update[0], {'_id': {'$in': [1]}})
+        self.assertEquals(update[1]['$set']['state'], 'sending')
+
+    def test_claim_batch_waiting(self):
+        # The oldest CDR of the RSS is waiting to be retried
+        self._set_outbox({'_id': 1, 'state': 'pending', 'next_attempt': datetime.now() + timedelta(seconds=60)})
+
+        self.assertEquals(self._dispatcher._claim_batch(), [])
+        self.assertFalse(self._db.wstore_cdr_outbox.update.called)
+        self.assertTrue(self._db.wstore_cdr_lock.update.called)
+
+    def test_claim_batch_locked(self):
+        # Another worker is sending a batch of the RSS
+        self._set_outbox({'_id': 1, 'state': 'pending', 'next_attempt': datetime.now()})
+        self._db.wstore_cdr_lock.find_and_modify.side_effect = DuplicateKeyError('duplicated')
+
+        self.assertEquals(self._dispatcher._claim_batch(), [])
+        self.assertFalse(self._db.wstore_cdr_outbox.find_one.called)
+        self.assertFalse(self._db.wstore_cdr_outbox.update.called)
+
+    def test_drain(self):
+        self._dispatcher.dispatch_batch = MagicMock()
+        self._dispatcher.dispatch_batch.side_effect = [2, 2, 1, 0]
+
+        self.assertEquals(self._dispatcher.drain(), 5)
+        self.assertEquals(self._dispatcher.dispatch_batch.call_count, 4)
+
+    def test_empty_outbox(self):
+        self._db.wstore_cdr_outbox.distinct.return_value = []
+
+        self.assertEquals(self._dispatcher.dispatch_batch(), 0)
+        self.assertFalse(self._adaptor.send_cdr.called)
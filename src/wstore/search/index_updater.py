@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from __future__ import unicode_literals
+
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from wstore.models import Offering
+from wstore.search.search_engine import SearchEngine
+
+
+logger = logging.getLogger(__name__)
+
+# Number of failed updates kept in the updater
+MAX_ERRORS = 100
+
+
+class IndexUpdater():
+    """
+    Background queue of offering documents to be updated in the search
+    index. Repeated updates of the same offering are coalesced and the
+    pending updates are applied in batches using a single commit. Failed
+    updates are queued again until the maximum number of retries
+    """
+
+    def __init__(self, batch_size=None, delay=None, timeout=None, max_retries=None):
+        self._batch_size = batch_size or getattr(settings, 'INDEX_UPDATE_BATCH_SIZE', 100)
+        self._delay = delay
+        if self._delay is None:
+            self._delay = getattr(settings, 'INDEX_UPDATE_DELAY', 1)
+
+        self._timeout = timeout
+        if self._timeout is None:
+            self._timeout = getattr(settings, 'INDEX_WRITER_TIMEOUT', 30)
+
+        self._max_retries = max_retries
+        if self._max_retries is None:
+            self._max_retries = getattr(settings, 'INDEX_UPDATE_MAX_RETRIES', 3)
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._processing = False
+        self._thread = None
+        # Failed attempts of the queued updates
+        self._attempts = {}
+        self.errors = deque(maxlen=MAX_ERRORS)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def schedule(self, index_path, offering_pk):
+        """
+        Includes an offering update in the queue
+        """
+        with self._cond:
+            # Repeated updates are applied once
+            self._pending[(index_path, offering_pk)] = True
+            self._start()
+            self._cond.notify_all()
+
+    def _get_batch(self):
+        batch = []
+        for key in self._pending.keys()[:self._batch_size]:
+            del self._pending[key]
+            batch.append(key)
+
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not len(self._pending):
+                    self._cond.wait()
+
+            # Wait for more updates of the same offerings
+            time.sleep(self._delay)
+
+            with self._cond:
+                self._processing = True
+                batch = self._get_batch()
+
+            try:
+                self.apply_batch(batch)
+            finally:
+                with self._cond:
+                    self._processing = False
+                    self._cond.notify_all()
+
+    def apply_batch(self, batch):
+        """
+        Updates the documents of a batch of offerings, using a commit
+        per index
+        """
+        indexes = OrderedDict()
+        for index_path, offering_pk in batch:
+            indexes.setdefault(index_path, []).append(offering_pk)
+
+        for index_path, pks in indexes.iteritems():
+            try:
+                offerings = Offering.objects.filter(pk__in=pks)
+                SearchEngine(index_path).update_indexes(offerings, timeout=self._timeout)
+            except Exception, e:
+                self._retry(index_path, pks, unicode(e))
+            else:
+                with self._cond:
+                    for pk in pks:
+                        self._attempts.pop((index_path, pk), None)
+
+    def _retry(self, index_path, pks, error):
+        """
+        Queues again the failed updates, the updates that reach the
+        maximum number of retries are discarded
+        """
+        failed = []
+
+        with self._cond:
+            for pk in pks:
+                key = (index_path, pk)
+                attempts = self._attempts.get(key, 0) + 1
+
+                if attempts <= self._max_retries:
+                    self._attempts[key] = attempts
+                    self._pending[key] = True
+                else:
+                    self._attempts.pop(key, None)
+                    failed.append(pk)
+
+            if len(failed):
+                self.errors.append((index_path, failed, error))
+
+        if len(failed):
+            logger.error('Search index update of offerings %s failed: %s', ', '.join([unicode(pk) for pk in failed]), error)
+
+    def flush(self):
+        """
+        Waits until all the pending updates have been applied
+        """
+        with self._cond:
+            while len(self._pending) or self._processing:
+                if self._thread is None or not self._thread.is_alive():
+                    break
+                self._cond.wait(1)
+
+            # Apply the remaining updates in the calling thread if
+            # the background thread is not running
+            batch = self._get_batch()
+            while len(batch):
+                self.apply_batch(batch)
+                batch = self._get_batch()
+
+
+index_updater = IndexUpdater()
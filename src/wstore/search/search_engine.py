@@ -21,53 +21,99 @@
 from __future__ import unicode_literals
 
 import os
-import rdflib
+import re
+import threading
 from decimal import Decimal
 from whoosh.fields import Schema, TEXT, NUMERIC, DATETIME, KEYWORD
 from whoosh.index import create_in, open_dir
 from whoosh.qparser import QueryParser
 from whoosh import query
 
-from wstore.models import Offering, Purchase
-from wstore.offerings.usdl.usdl_generator import USDLGenerator
+from wstore.models import Offering
+from wstore.search.searchable_text import get_searchable_text
+from wstore.store_commons.response_cache import bump_version
 
 
-class SearchEngine():
+TOC_FILE = re.compile(r'^_MAIN_(\d+)\.toc$')
+TOC_SCAN_ATTEMPTS = 5
 
-    _index_path = None
 
-    def __init__(self, index_path):
-        self._index_path = index_path
+class SearcherCache():
+    """
+    Keeps a long-lived searcher per thread and index, which is only
+    refreshed when a new generation of the index is committed
+    """
 
-    def _aggregate_text(self, offering):
+    def __init__(self):
+        self._local = threading.local()
+
+    def _get_toc_info(self, index_path):
         """
-        Create a single string for creating the index by extracting text fields
-        from the USDL document of the offering
+        Returns the generation and the modification info of the latest
+        table of contents of the index
         """
-        graph = rdflib.ConjunctiveGraph()
+        attempt = 0
+        while True:
+            generation = -1
+            for file_ in os.listdir(index_path):
+                match = TOC_FILE.match(file_)
+                if match and int(match.group(1)) > generation:
+                    generation = int(match.group(1))
+
+            try:
+                toc_stat = os.stat(os.path.join(index_path, '_MAIN_' + unicode(generation) + '.toc'))
+            except OSError:
+                # A concurrent commit may have removed the table of contents
+                # between the listing and the stat, so the index is scanned again
+                attempt += 1
+                if attempt >= TOC_SCAN_ATTEMPTS:
+                    raise
+                continue
+
+            return (generation, toc_stat.st_mtime, toc_stat.st_ino)
+
+    def get_searcher(self, index_path):
+        if not hasattr(self._local, 'searchers'):
+            self._local.searchers = {}
+
+        toc_info = self._get_toc_info(index_path)
+        cached = self._local.searchers.get(index_path)
+
+        if cached is None:
+            searcher = open_dir(index_path).searcher()
+
+        elif cached[0] == toc_info:
+            searcher = cached[1]
+
+        elif toc_info[0] > cached[0][0]:
+            # New commits, only the changed segments are read
+            searcher = cached[1].refresh()
 
-        generator = USDLGenerator()
-        graph.parse(
-            data=generator.generate_offering_usdl(offering)[0],
-            format='application/rdf+xml'
-        )
+        else:
+            # The index has been created again
+            cached[1].close()
+            searcher = open_dir(index_path).searcher()
 
-        text = offering.name
+        self._local.searchers[index_path] = (toc_info, searcher)
+        return searcher
 
-        for s, p, o in graph:
-            if isinstance(o, rdflib.Literal):
-                text += ' ' + unicode(o)
 
-        return text
+searchers = SearcherCache()
 
-    def _aggregate_purchasers(self, offering):
-        purchases = Purchase.objects.filter(offering=offering)
 
-        result = ''
-        for p in purchases:
-            result += p.owner_organization.pk + ','
+class SearchEngine():
 
-        return result[:-1]
+    _index_path = None
+
+    def __init__(self, index_path):
+        self._index_path = index_path
+
+    def _aggregate_text(self, offering):
+        """
+        Create a single string for creating the index by extracting text fields
+        from the description of the offering
+        """
+        return get_searchable_text(offering)
 
     def create_index(self, offering):
         """
@@ -89,8 +135,7 @@ class SearchEngine():
                 name=KEYWORD(sortable=True),
                 popularity=NUMERIC(int, decimal_places=2, sortable=True, signed=False),
                 date=DATETIME(sortable=True),
-                state=KEYWORD,
-                purchaser=KEYWORD(stored=True, commas=True)
+                state=KEYWORD
             )
             # Create index
             index = create_in(self._index_path, schema)
@@ -103,7 +148,6 @@ class SearchEngine():
         # Aggregate all the information included in the USDL document in
         # a single string in order to add a new document to the index
         text = self._aggregate_text(offering)
-        purchasers_text = self._aggregate_purchasers(offering)
 
         # Add the new document
         index_writer.add_document(
@@ -113,44 +157,71 @@ class SearchEngine():
             name=unicode(offering.name),
             popularity=Decimal(offering.rating),
             date=offering.creation_date,
-            state=unicode(offering.state),
-            purchaser=purchasers_text
+            state=unicode(offering.state)
         )
         index_writer.commit()
+        bump_version('search')
+
+    def _get_document(self, offering):
+        """
+        Builds the fields of the document of an offering
+        """
+        text = self._aggregate_text(offering)
+
+        in_date = None
+        if offering.state == 'uploaded':
+            in_date = offering.creation_date
+        else:
+            in_date = offering.publication_date
+
+        return {
+            'id': unicode(offering.pk),
+            'owner': unicode(offering.owner_organization.pk),
+            'content': unicode(text),
+            'name': unicode(offering.name),
+            'popularity': Decimal(offering.rating),
+            'date': in_date,
+            'state': unicode(offering.state)
+        }
 
     def update_index(self, offering):
         """
         Update the document of a concrete offering in the search index
         """
+        self.update_indexes([offering])
+
+    def update_indexes(self, offerings, timeout=0.0):
+        """
+        Update the documents of a list of offerings in the search index
+        using a single commit. The timeout is the time waiting for the
+        index lock if other writer is open
+        """
 
         if not os.path.exists(self._index_path) or os.listdir(self._index_path) == []:
             raise Exception('The index does not exist')
 
         index = open_dir(self._index_path)
 
-        index_writer = index.writer()
-        text = self._aggregate_text(offering)
-        purchasers_text = self._aggregate_purchasers(offering)
+        index_writer = index.writer(timeout=timeout)
+        try:
+            for offering in offerings:
+                index_writer.update_document(**self._get_document(offering))
+        except:
+            index_writer.cancel()
+            raise
 
-        in_date = None
-        if offering.state == 'uploaded':
-            in_date = offering.creation_date
-        else:
-            in_date = offering.publication_date
+        index_writer.commit()
 
-        # Get the document
-        index_writer.update_document(
-            id=unicode(offering.pk),
-            owner=unicode(offering.owner_organization.pk),
-            content=unicode(text),
-            name=unicode(offering.name),
-            popularity=Decimal(offering.rating),
-            date=in_date,
-            state=unicode(offering.state),
-            purchaser=purchasers_text
-        )
+        # The cached search results are no longer valid
+        bump_version('search')
 
-        index_writer.commit()
+    def schedule_update(self, offering):
+        """
+        Includes the offering in the queue of documents to be updated in
+        background, keeping the index I/O out of the request
+        """
+        from wstore.search.index_updater import index_updater
+        index_updater.schedule(self._index_path, offering.pk)
 
     def remove_index(self, offering):
         """
@@ -164,6 +235,25 @@ class SearchEngine():
 
         index_writer.delete_by_term('id', unicode(offering.pk))
         index_writer.commit()
+        bump_version('search')
+
+    def _get_purchased_filter(self, user):
+        """
+        Builds a filter with the offerings purchased by the current
+        organization of the user, which are kept in the organization
+        and user profile models as purchases are made
+        """
+        purchased = set(user.userprofile.current_organization.offerings_purchased)
+
+        # If the current organization is the user organization, the
+        # offerings purchased by the user are included
+        if user.userprofile.is_user_org():
+            purchased.update(user.userprofile.offerings_purchased)
+
+        if not len(purchased):
+            return None
+
+        return query.Or([query.Term('id', unicode(pk)) for pk in purchased])
 
     def full_text_search(self, user, text, state=None, count=False, pagination=None, sort=None):
         """
@@ -174,103 +264,100 @@ class SearchEngine():
         if not os.path.exists(self._index_path) or os.listdir(self._index_path) == []:
             raise Exception('The index does not exist')
 
-        # Get the index reader
-        index = open_dir(self._index_path)
+        # Get the searcher of the index
+        searcher = searchers.get_searcher(self._index_path)
 
-        with index.searcher() as searcher:
+        # Create the query
+        query_ = QueryParser('content', searcher.schema).parse(unicode(text))
 
-            # Create the query
-            query_ = QueryParser('content', index.schema).parse(unicode(text))
+        # If an state has been defined filter the result
+        if state:
+            # Validate state
+            for st in state:
+                if not st in ['purchased', 'uploaded', 'deleted', 'published']:
+                    raise ValueError('Invalid state')
 
-            # If an state has been defined filter the result
-            if state:
-                # Validate state
-                for st in state:
-                    if not st in ['purchased', 'uploaded', 'deleted', 'published']:
-                        raise ValueError('Invalid state')
-
-                if 'purchased' in state:
-                    filter_ = query.Term('purchaser', user.userprofile.current_organization.pk)
-                else:
-                    filter_ = query.Term('owner', unicode(user.userprofile.current_organization.pk))
-
-                    state_filter = None
-                    for st in state:
-                        if not state_filter:
-                            state_filter = query.Term('state', st)
-                        else:
-                            state_filter = state_filter | query.Term('state', st)
-
-                    filter_ = filter_ & state_filter
+            if 'purchased' in state:
+                filter_ = self._get_purchased_filter(user)
+
+                # No offerings purchased, so there is nothing to search
+                if filter_ is None:
+                    return {'number': 0} if count else []
             else:
-                # If state is not included the default behaviour is returning
-                # published offerings
-                filter_ = query.Term('state', 'published')
+                filter_ = query.Term('owner', unicode(user.userprofile.current_organization.pk))
 
-            # Create sorting params if needed
-            if sort:
-                if sort == 'popularity' or sort == 'date':
-                    reverse = True
-                elif sort == 'name':
-                    reverse = False
-                else:
-                    raise ValueError('Undefined sorting')
-
-            # If pagination has been defined, limit the results
-            if pagination:
-                # Validate pagination fields
-                if not isinstance(pagination, dict):
-                    raise TypeError('Invalid pagination type')
-
-                if not 'start' in pagination or not 'limit' in pagination:
-                    raise ValueError('Missing required field in pagination')
-
-                if not isinstance(pagination['start'], int) or not isinstance(pagination['limit'], int):
-                    raise TypeError('Invalid pagination params type')
-
-                if pagination['start'] < 1:
-                    raise ValueError('Start param must be higher than 0')
-
-                if pagination['limit'] < 0:
-                    raise ValueError('Limit param must be positive')
-
-                search_params = (query_, )
-                search_kwparams = {
-                    'filter': filter_,
-                }
-
-                if sort:
-                    search_kwparams['sortedby'] = sort
-                    search_kwparams['reverse'] = reverse
-
-                # Check limits
-                search_len = len(searcher.search(*search_params, **search_kwparams))
-
-                if pagination['start'] > search_len:
-                    search_result = []
-                else:
-                    search_params = (query_, pagination['start'])
-                    search_kwparams['pagelen'] = pagination['limit']
-                    search_result = searcher.search_page(*search_params, **search_kwparams)
+                state_filter = None
+                for st in state:
+                    if not state_filter:
+                        state_filter = query.Term('state', st)
+                    else:
+                        state_filter = state_filter | query.Term('state', st)
+
+                filter_ = filter_ & state_filter
+        else:
+            # If state is not included the default behaviour is returning
+            # published offerings
+            filter_ = query.Term('state', 'published')
+
+        # Create sorting params if needed
+        if sort:
+            if sort == 'popularity' or sort == 'date':
+                reverse = True
+            elif sort == 'name':
+                reverse = False
             else:
-                if sort:
-                    search_result = searcher.search(query_, filter=filter_, limit=None, sortedby=sort, reverse=reverse)
-                else:
-                    search_result = searcher.search(query_, filter=filter_, limit=None)
-                
+                raise ValueError('Undefined sorting')
+
+        # If pagination has been defined, limit the results
+        if pagination:
+            # Validate pagination fields
+            if not isinstance(pagination, dict):
+                raise TypeError('Invalid pagination type')
+
+            if not 'start' in pagination or not 'limit' in pagination:
+                raise ValueError('Missing required field in pagination')
+
+            if not isinstance(pagination['start'], int) or not isinstance(pagination['limit'], int):
+                raise TypeError('Invalid pagination params type')
 
-            result = []
-            # The get_offering_info method is imported inside this method in order to avoid a cross-reference import error
-            from wstore.offerings.offerings_management import get_offering_info
+            if pagination['start'] < 1:
+                raise ValueError('Start param must be higher than 0')
 
+            if pagination['limit'] < 0:
+                raise ValueError('Limit param must be positive')
 
-            if not count:
-                for hit in search_result:
+            search_kwparams = {
+                'filter': filter_,
+                'pagelen': pagination['limit']
+            }
 
-                    # Get the offerings
-                    offering = Offering.objects.get(pk=hit['id'])
-                    result.append(get_offering_info(offering, user))
+            if sort:
+                search_kwparams['sortedby'] = sort
+                search_kwparams['reverse'] = reverse
+
+            # The page includes the total number of hits, so the
+            # limits are checked without searching again
+            search_result = searcher.search_page(query_, pagination['start'], **search_kwparams)
+
+            if pagination['start'] > search_result.total:
+                search_result = []
+        else:
+            if sort:
+                search_result = searcher.search(query_, filter=filter_, limit=None, sortedby=sort, reverse=reverse)
             else:
-                result = {'number': len(search_result)}
+                search_result = searcher.search(query_, filter=filter_, limit=None)
+
+        result = []
+        # The get_offerings_info method is imported inside this method in order to avoid a cross-reference import error
+        from wstore.offerings.offerings_management import get_offerings_info
+
+        if not count:
+            ids = [hit['id'] for hit in search_result]
+
+            # Get the offerings with a single query keeping the hits order
+            offerings = Offering.objects.in_bulk(ids)
+            result = get_offerings_info([offerings[id_] for id_ in ids], user)
+        else:
+            result = {'number': len(search_result)}
 
         return result
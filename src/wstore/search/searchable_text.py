@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from __future__ import unicode_literals
+
+import json
+import hashlib
+
+from wstore.models import Offering
+from wstore.store_commons.response_cache import bump_version
+
+
+def _get_source_hash(offering):
+    source = json.dumps([
+        offering.name,
+        offering.version,
+        unicode(offering.creation_date),
+        offering.offering_description
+    ], sort_keys=True, default=unicode)
+
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def _get_component_text(component):
+    text = [component.get('label'), component.get('description')]
+
+    if 'text_function' in component:
+        text.append(component['text_function'])
+
+        function = component.get('price_function', {})
+        text.append(function.get('label'))
+
+        for variable in function.get('variables', {}).itervalues():
+            text.append(variable.get('label'))
+            text.append(variable.get('value'))
+    else:
+        text.extend([component.get('value'), component.get('unit')])
+
+    return text
+
+
+def extract_text(offering):
+    """
+    Builds the searchable text of an offering from its parsed description,
+    including the same literals that are serialized in its USDL document
+    """
+    description = offering.offering_description
+
+    text = [
+        offering.name,
+        offering.version,
+        description.get('description'),
+        description.get('abstract'),
+        unicode(offering.creation_date),
+        description.get('modified')
+    ]
+
+    if 'legal' in description:
+        text.extend([description['legal'].get('title'), description['legal'].get('text')])
+
+    for plan in description.get('pricing', {}).get('price_plans', []):
+        text.extend([plan.get('title'), plan.get('description'), plan.get('label')])
+
+        components = plan.get('price_components', []) + plan.get('deductions', [])
+        if len(components):
+            text.append(plan.get('currency'))
+
+        for component in components:
+            text.extend(_get_component_text(component))
+
+    return ' '.join([unicode(t) for t in text if t is not None and t != ''])
+
+
+def get_searchable_text(offering):
+    """
+    Returns the searchable text of an offering, which is only extracted
+    again when the offering description has changed
+    """
+    source_hash = _get_source_hash(offering)
+
+    if offering.searchable_text is not None and offering.searchable_hash == source_hash:
+        return offering.searchable_text
+
+    offering.searchable_text = extract_text(offering)
+    offering.searchable_hash = source_hash
+
+    # Only the cached fields are saved in order not to overwrite
+    # other fields of the offering
+    if offering.pk:
+        Offering.objects.filter(pk=offering.pk).update(
+            searchable_text=offering.searchable_text,
+            searchable_hash=offering.searchable_hash
+        )
+
+        # The raw update does not send the save signals
+        bump_version('offering')
+
+    return offering.searchable_text
@@ -36,6 +36,8 @@ from django.contrib.auth.models import User
 from django.conf import settings
 
 from wstore.search import search_engine
+from wstore.search import index_updater
+from wstore.search import searchable_text
 from wstore.models import Offering
 from wstore.contracting.models import Purchase
 
@@ -71,7 +73,6 @@ QUERY_PUB = (query.Term('id', '61000aba8e05ac2115155555') & query.Term('state',
 QUERY_DEL = (query.Term('id', '61000aba8e05ac2115144444') & query.Term('state', 'deleted'))
 QUERY_RATED = (query.Term('id', '61000aba8e05ac2115122222') & query.Term('popularity', Decimal(3)))
 QUERY_CONTENT = (query.Term('id', '61000aba8e05ac2115166666') & query.Term('content', 'updated'))
-QUERY_PURCH = (query.Term('id', '61000aba8e05ac2115122222'))
 
 
 def _create_index(user):
@@ -86,8 +87,7 @@ def _create_index(user):
         name=KEYWORD(sortable=True),
         popularity=NUMERIC(int, decimal_places=2, sortable=True, signed=False),
         date=DATETIME(sortable=True),
-        state=KEYWORD,
-        purchaser=KEYWORD
+        state=KEYWORD
     )
 
     index = create_in(index_path, schema)
@@ -100,13 +100,6 @@ def _create_index(user):
         else:
             date = o.creation_date
 
-        # Check if purchased
-        p = Purchase.objects.filter(offering=o)
-
-        purchasers_text = ''
-        if len(p) > 0:
-            purchasers_text = unicode(user.userprofile.current_organization.pk)
-
         if o.owner_admin_user == user:
             owner_pk = unicode(user.userprofile.current_organization.pk)
         else:
@@ -119,8 +112,7 @@ def _create_index(user):
             name=unicode(o.name),
             popularity=Decimal(o.rating),
             date=date,
-            state=unicode(o.state),
-            purchaser=purchasers_text
+            state=unicode(o.state)
         )
 
     index_writer.commit()
@@ -131,22 +123,11 @@ def _remove_index(ins, off=None, sa=None):
     rmtree(path)
 
 
-def _mock_generator(self):
-    search_engine.USDLGenerator = MagicMock()
-    self._gen_inst = MagicMock()
-    f = open(os.path.join(settings.BASEDIR, 'wstore/test/test_usdl.rdf'), 'rb')
-    self._gen_inst.generate_offering_usdl.return_value = (f.read(), 'http://usdluri.com/')
-    search_engine.USDLGenerator.return_value = self._gen_inst
-
-
 class IndexCreationTestCase(TestCase):
 
     tags = ('fiware-ut-6',)
     fixtures = ['create_index.json']
 
-    def setUp(self):
-        _mock_generator(self)
-
     def tearDown(self):
         reload(search_engine)
 
@@ -158,6 +139,13 @@ class IndexCreationTestCase(TestCase):
     def test_basic_index_creaton(self):
 
         offering = Offering.objects.get(name='test_offering')
+        offering.offering_description = {
+            'description': 'A map viewer widget',
+            'abstract': 'Map viewer',
+            'pricing': {
+                'price_plans': []
+            }
+        }
         se = search_engine.SearchEngine(settings.BASEDIR + '/wstore/test/test_index')
         se.create_index(offering)
 
@@ -263,6 +251,31 @@ class FullTextSearchTestCase(TestCase):
             self.assertTrue(isinstance(error, err_type))
             self.assertEquals(unicode(e), err_msg)
 
+    def test_search_purchased_not_indexed(self):
+        # New purchases are found without updating the index
+        user = User.objects.get(username='test_user')
+        offering = Offering.objects.get(name='test_offering3')
+
+        user.userprofile.current_organization.offerings_purchased.append(offering.pk)
+        user.userprofile.current_organization.save()
+
+        se = search_engine.SearchEngine(settings.BASEDIR + '/wstore/test/test_index')
+        result = se.full_text_search(user, 'offering', state=['purchased'])
+
+        self.assertEquals(len(result), len(RESULT_PURCHASED) + 1)
+        for res in result:
+            self.assertTrue(res['name'] in RESULT_PURCHASED + ['test_offering3'])
+
+    def test_search_no_purchases(self):
+        user = User.objects.get(username='test_user')
+        user.userprofile.offerings_purchased = []
+        user.userprofile.save()
+
+        se = search_engine.SearchEngine(settings.BASEDIR + '/wstore/test/test_index')
+
+        self.assertEquals(se.full_text_search(user, 'offering', state=['purchased']), [])
+        self.assertEquals(se.full_text_search(user, 'offering', state=['purchased'], count=True), {'number': 0})
+
 
 class UpdateIndexTestCase(TestCase):
 
@@ -286,7 +299,6 @@ class UpdateIndexTestCase(TestCase):
 
     def setUp(self):
         # Fill user info
-        _mock_generator(self)
         user = User.objects.get(username='test_user')
         for p in Purchase.objects.all():
             user.userprofile.offerings_purchased.append(p.offering.pk)
@@ -320,28 +332,14 @@ class UpdateIndexTestCase(TestCase):
         sa._aggregate_text = MagicMock()
         sa._aggregate_text.return_value = "updated"
 
-    def _update_purchased(self, offering, sa=None):
-        user = User.objects.get(pk="51000aba8e05ac2115f022f9")
-
-        Purchase.objects.create(
-            customer=user,
-            date=self.date,
-            offering=offering,
-            organization_owned=False,
-            state='pending',
-            tax_address={},
-            owner_organization=user.userprofile.current_organization
-        )
-
     @parameterized.expand([
         (_update_published, '61000aba8e05ac2115155555', QUERY_PUB),
         (_update_deleted, '61000aba8e05ac2115144444', QUERY_DEL),
         (_update_rated, '61000aba8e05ac2115111111', QUERY_RATED),
         (_update_content, '61000aba8e05ac2115166666', QUERY_CONTENT),
-        (_update_purchased, '61000aba8e05ac2115122222', QUERY_PURCH, True),
-        (_remove_index, '', None, False, Exception, 'The index does not exist')
+        (_remove_index, '', None, Exception, 'The index does not exist')
     ])
-    def test_update_index(self, update_method, offering, query_, owned=False, err_type=None, err_msg=None):
+    def test_update_index(self, update_method, offering, query_, err_type=None, err_msg=None):
 
         # Get the offering
         off = None
@@ -366,14 +364,259 @@ class UpdateIndexTestCase(TestCase):
             index = open_dir(settings.BASEDIR + '/wstore/test/test_index')
 
             with index.searcher() as searcher:
-                if owned:
-                    user = User.objects.get(pk="51000aba8e05ac2115f022f9")
-                    pk = user.userprofile.current_organization.pk
-                    query_ = query_ & query.Term('purchaser', pk)
-
                 search_result = searcher.search(query_)
 
                 self.assertEquals(len(search_result), 1)
         else:
             self.assertTrue(isinstance(error, err_type))
             self.assertEquals(unicode(error), err_msg)
+
+
+class SearcherCacheTestCase(TestCase):
+
+    tags = ('search-cache',)
+
+    def setUp(self):
+        self._index_path = settings.BASEDIR + '/wstore/test/test_searcher_index'
+        self._create_index()
+
+    def tearDown(self):
+        rmtree(self._index_path)
+
+    def _create_index(self):
+        os.makedirs(self._index_path)
+        create_in(self._index_path, Schema(id=TEXT(stored=True), content=TEXT))
+        self._add_document('1')
+
+    def _add_document(self, id_):
+        index_writer = open_dir(self._index_path).writer()
+        index_writer.add_document(id=id_, content='an offering')
+        index_writer.commit()
+
+    def _get_hits(self, searcher):
+        query_ = QueryParser('content', searcher.schema).parse('offering')
+        return [hit['id'] for hit in searcher.search(query_)]
+
+    def test_searcher_reused(self):
+        cache = search_engine.SearcherCache()
+
+        searcher = cache.get_searcher(self._index_path)
+        self.assertTrue(cache.get_searcher(self._index_path) is searcher)
+
+        # A new commit refreshes the searcher
+        self._add_document('2')
+        searcher = cache.get_searcher(self._index_path)
+
+        self.assertEquals(sorted(self._get_hits(searcher)), ['1', '2'])
+        self.assertTrue(cache.get_searcher(self._index_path) is searcher)
+
+    def test_searcher_index_created_again(self):
+        cache = search_engine.SearcherCache()
+        cache.get_searcher(self._index_path)
+
+        rmtree(self._index_path)
+        self._create_index()
+        self._add_document('3')
+
+        self.assertEquals(sorted(self._get_hits(cache.get_searcher(self._index_path))), ['1', '3'])
+
+    def test_toc_removed_while_scanning(self):
+        cache = search_engine.SearcherCache()
+        stat = os.stat
+        calls = []
+
+        def _stat(path):
+            calls.append(path)
+            if len(calls) == 1:
+                # A concurrent commit replaces the table of contents
+                self._add_document('2')
+                raise OSError(2, 'No such file or directory')
+            return stat(path)
+
+        search_engine.os.stat = _stat
+        try:
+            toc_info = cache._get_toc_info(self._index_path)
+        finally:
+            search_engine.os.stat = stat
+
+        # The newer table of contents is read after scanning the index again
+        generations = [int(search_engine.TOC_FILE.match(os.path.basename(path)).group(1)) for path in calls]
+        self.assertEquals(len(generations), 2)
+        self.assertTrue(generations[1] > generations[0])
+        self.assertEquals(toc_info[0], generations[1])
+
+    def test_toc_missing(self):
+        cache = search_engine.SearcherCache()
+        rmtree(self._index_path)
+        os.makedirs(self._index_path)
+
+        self.assertRaises(OSError, cache._get_toc_info, self._index_path)
+
+
+class IndexUpdaterTestCase(TestCase):
+
+    tags = ('index-updater',)
+
+    def setUp(self):
+        index_updater.SearchEngine = MagicMock()
+        index_updater.Offering = MagicMock()
+        index_updater.Offering.objects.filter.side_effect = lambda pk__in: pk__in
+
+    def tearDown(self):
+        reload(index_updater)
+
+    def test_updates_coalesced(self):
+        updater = index_updater.IndexUpdater(batch_size=2, delay=0, timeout=5)
+        # Updates are applied by the flush hook in the calling thread
+        updater._start = MagicMock()
+
+        updater.schedule('/index', '1')
+        updater.schedule('/index', '2')
+        updater.schedule('/index', '1')
+        updater.schedule('/index', '3')
+
+        updater.flush()
+
+        se = index_updater.SearchEngine.return_value
+        self.assertEquals(se.update_indexes.call_count, 2)
+        self.assertEquals(se.update_indexes.call_args_list[0][0][0], ['1', '2'])
+        self.assertEquals(se.update_indexes.call_args_list[1][0][0], ['3'])
+        self.assertEquals(se.update_indexes.call_args_list[0][1], {'timeout': 5})
+
+    def test_background_updates(self):
+        updater = index_updater.IndexUpdater(delay=0)
+
+        updater.schedule('/index', '1')
+        updater.flush()
+
+        se = index_updater.SearchEngine.return_value
+        se.update_indexes.assert_called_once_with(['1'], timeout=30)
+
+    def test_update_error(self):
+        updater = index_updater.IndexUpdater(delay=0, max_retries=2)
+        updater._start = MagicMock()
+        index_updater.SearchEngine.return_value.update_indexes.side_effect = Exception('The index does not exist')
+
+        updater.schedule('/index', '1')
+        updater.flush()
+
+        # The update is discarded after the retries
+        se = index_updater.SearchEngine.return_value
+        self.assertEquals(se.update_indexes.call_count, 3)
+        self.assertEquals(list(updater.errors), [('/index', ['1'], 'The index does not exist')])
+        self.assertEquals(updater._attempts, {})
+
+    def test_update_retried(self):
+        updater = index_updater.IndexUpdater(delay=0, max_retries=2)
+        updater._start = MagicMock()
+        index_updater.SearchEngine.return_value.update_indexes.side_effect = [Exception('The index is locked'), None]
+
+        updater.schedule('/index', '1')
+        updater.flush()
+
+        se = index_updater.SearchEngine.return_value
+        self.assertEquals(se.update_indexes.call_count, 2)
+        self.assertEquals(list(updater.errors), [])
+        self.assertEquals(updater._attempts, {})
+
+    def test_errors_bounded(self):
+        updater = index_updater.IndexUpdater(delay=0, max_retries=0)
+        updater._start = MagicMock()
+        index_updater.SearchEngine.return_value.update_indexes.side_effect = Exception('The index does not exist')
+
+        for pk in range(index_updater.MAX_ERRORS + 10):
+            updater.schedule('/index' + unicode(pk), unicode(pk))
+        updater.flush()
+
+        self.assertEquals(len(updater.errors), index_updater.MAX_ERRORS)
+        self.assertEquals(updater.errors[-1][1], [unicode(index_updater.MAX_ERRORS + 9)])
+
+    def test_schedule_update(self):
+        search_engine_updater = MagicMock()
+        index_updater.index_updater = search_engine_updater
+
+        offering = MagicMock()
+        offering.pk = '1'
+        search_engine.SearchEngine('/index').schedule_update(offering)
+
+        search_engine_updater.schedule.assert_called_once_with('/index', '1')
+
+
+
+class FakeOffering():
+
+    def __init__(self):
+        self.pk = '1'
+        self.name = 'test_offering'
+        self.version = '1.0'
+        self.creation_date = datetime(2013, 2, 5, 17, 6, 46)
+        self.searchable_text = None
+        self.searchable_hash = None
+        self.offering_description = {
+            'description': 'A map viewer widget',
+            'abstract': 'Map viewer',
+            'modified': '2013-02-06',
+            'legal': {
+                'title': 'Terms and conditions',
+                'text': 'Conditions applied to this widget'
+            },
+            'pricing': {
+                'price_plans': [{
+                    'title': 'Basic plan',
+                    'description': 'Single payment plan',
+                    'currency': 'EUR',
+                    'price_components': [{
+                        'label': 'Initial payment',
+                        'description': 'Payment made when acquiring',
+                        'value': '10',
+                        'unit': 'single payment'
+                    }]
+                }]
+            }
+        }
+
+
+class SearchableTextTestCase(TestCase):
+
+    tags = ('searchable-text',)
+
+    def setUp(self):
+        searchable_text.Offering = MagicMock()
+        searchable_text.bump_version = MagicMock()
+        self._offering = FakeOffering()
+
+    def tearDown(self):
+        reload(searchable_text)
+
+    def test_text_extraction(self):
+        text = searchable_text.get_searchable_text(self._offering)
+
+        for literal in ['test_offering', 'A map viewer widget', 'Terms and conditions', 'Conditions applied to this widget',
+                        'Basic plan', 'EUR', 'Initial payment', 'single payment', '2013-02-05 17:06:46']:
+            self.assertTrue(literal in text)
+
+        searchable_text.Offering.objects.filter.assert_called_once_with(pk='1')
+        searchable_text.Offering.objects.filter.return_value.update.assert_called_once_with(
+            searchable_text=text,
+            searchable_hash=self._offering.searchable_hash
+        )
+        searchable_text.bump_version.assert_called_once_with('offering')
+
+    def test_text_cached(self):
+        text = searchable_text.get_searchable_text(self._offering)
+
+        searchable_text.extract_text = MagicMock()
+        self.assertEquals(searchable_text.get_searchable_text(self._offering), text)
+        self.assertFalse(searchable_text.extract_text.called)
+
+    def test_text_invalidated(self):
+        searchable_text.get_searchable_text(self._offering)
+        old_hash = self._offering.searchable_hash
+
+        self._offering.offering_description['description'] = 'An updated description'
+        text = searchable_text.get_searchable_text(self._offering)
+
+        self.assertTrue('An updated description' in text)
+        self.assertFalse('A map viewer widget' in text)
+        self.assertNotEquals(self._offering.searchable_hash, old_hash)
+        self.assertEquals(searchable_text.Offering.objects.filter.return_value.update.call_count, 2)
@@ -28,15 +28,17 @@ from django.conf import settings
 
 from wstore.store_commons.utils.http import build_response, authentication_required
 from wstore.store_commons.resource import Resource
+from wstore.store_commons.response_cache import cached_response
 from wstore.search.search_engine import SearchEngine
 from wstore.models import Resource as WStore_resource
 from wstore.models import Organization, Offering
-from wstore.offerings.offerings_management import get_offering_info
+from wstore.offerings.offerings_management import get_offerings_info
 
 
 class SearchEntry(Resource):
 
     @authentication_required
+    @cached_response('offering', 'resource', 'purchase', 'search')
     def read(self, request, text):
 
         index_path = os.path.join(settings.BASEDIR, 'wstore')
@@ -119,14 +121,10 @@ class SearchByResourceEntry(Resource):
             return build_response(request, 404, 'Resource not found')
 
         # Get offering where the resource is included
-        response = []
-
         try:
-            for off in resource.offerings:
-                offering = Offering.objects.get(pk=off)
-
-                if offering.state == 'published':
-                    response.append(get_offering_info(offering, request.user))
+            offerings = Offering.objects.in_bulk(resource.offerings)
+            published = [offerings[off] for off in resource.offerings if offerings[off].state == 'published']
+            response = get_offerings_info(published, request.user)
         except Exception as e:
             return build_response(request, 400, unicode(e))
 
@@ -20,9 +20,11 @@
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from djangotoolbox.fields import EmbeddedModelField
 
 from wstore.models import Organization, Offering
+from wstore.store_commons.response_cache import invalidate_reviews
 
 # Review responses (Embedded)
 class Response(models.Model):
@@ -48,4 +50,7 @@ class Review(models.Model):
         app_label = 'wstore'
         unique_together = ('user', 'organization', 'offering')
 
-    
\ No newline at end of file
+
+# Invalidate the cached responses that include reviews
+post_save.connect(invalidate_reviews, sender=Review)
+post_delete.connect(invalidate_reviews, sender=Review)
@@ -26,7 +26,8 @@ from datetime import datetime
 from django.core.exceptions import PermissionDenied
 from django.conf import settings
 
-from wstore.models import Offering, Context, Purchase
+from wstore.models import Purchase
+from wstore.offerings import rankings
 from wstore.social.reviews.models import Review, Response
 from wstore.search.search_engine import SearchEngine
 
@@ -67,16 +68,6 @@ class ReviewManager():
 
         return exception
 
-    def _update_top_rated(self):
-        """
-        Updates top rated list to new rating
-        """
-        # Check the top rated structure
-        context = Context.objects.all()[0]
-
-        context.top_rated = [off.pk for off in Offering.objects.filter(state="published").order_by('-rating')[:8]]
-        context.save()
-
     def _get_and_validate_review(self, user, review_id, owner=False):
         """
         Returns and validates review object
@@ -143,13 +134,7 @@ class ReviewManager():
         offering.comments.insert(0, rev.pk)
 
         # Calculate new offering rate
-        old_rate = offering.rating
-
-        if old_rate == 0:
-            offering.rating = review['rating']
-        else:
-            offering.rating = ((old_rate * (len(offering.comments) - 1)) + review['rating']) / len(offering.comments)
-
+        offering.rating = rankings.update_rating(offering, review['rating'], 1)
         offering.save()
 
         # Update offering indexes
@@ -158,7 +143,7 @@ class ReviewManager():
         index_path = os.path.join(index_path, 'indexes')
 
         se = SearchEngine(index_path)
-        se.update_index(offering)
+        se.schedule_update(offering)
 
         # Save the offering as rated
         if user.userprofile.is_user_org():
@@ -171,8 +156,8 @@ class ReviewManager():
             })
             user.userprofile.current_organization.save()
 
-        # Update top rated list
-        self._update_top_rated()
+        # Update top rated rankings
+        rankings.update_offering(offering)
 
     def get_reviews(self, offering, start=None, limit=None):
         """
@@ -234,7 +219,7 @@ class ReviewManager():
         rev = self._get_and_validate_review(user, review)
 
         # Calculate new rating
-        rate = ((rev.offering.rating * len(rev.offering.comments)) - rev.rating + review_data['rating']) / len(rev.offering.comments)
+        rate = rankings.update_rating(rev.offering, review_data['rating'] - rev.rating, 0)
 
         # update review
         rev.title = review_data['title']
@@ -254,10 +239,10 @@ class ReviewManager():
         index_path = os.path.join(index_path, 'indexes')
 
         se = SearchEngine(index_path)
-        se.update_index(rev.offering)
+        se.schedule_update(rev.offering)
 
-        # Update top rated offerings
-        self._update_top_rated()
+        # Update top rated rankings
+        rankings.update_offering(rev.offering)
 
     def _remove_review_from_org(self, user, offering, org):
         old_rate = None
@@ -278,11 +263,7 @@ class ReviewManager():
         rev.offering.comments.remove(review)
 
         # Update offering rating
-        if len(rev.offering.comments):
-            rev.offering.rating = ((rev.offering.rating * (len(rev.offering.comments) + 1)) - rev.rating) / len(rev.offering.comments)
-        else:
-            rev.offering.rating = 0
-
+        rev.offering.rating = rankings.update_rating(rev.offering, -rev.rating, -1)
         rev.offering.save()
 
         # Update offering indexes
@@ -291,10 +272,10 @@ class ReviewManager():
         index_path = os.path.join(index_path, 'indexes')
 
         se = SearchEngine(index_path)
-        se.update_index(rev.offering)
+        se.schedule_update(rev.offering)
 
-        # Update top rated offerings
-        self._update_top_rated()
+        # Update top rated rankings
+        rankings.update_offering(rev.offering)
 
         # Update user info to allow her to create a new review
         if rev.user == user:
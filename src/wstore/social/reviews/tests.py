@@ -175,7 +175,6 @@ class ReviewTestCase(TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls._old_context = review_manager.Context
         se_obj = MagicMock()
         review_manager.SearchEngine = MagicMock();
         review_manager.SearchEngine.return_value = se_obj
@@ -184,16 +183,16 @@ class ReviewTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        review_manager.Context = cls._old_context
         reload(review_manager)
         super(ReviewTestCase, cls).tearDownClass()
 
     def setUp(self):
-        # Mock context
-        context_object = MagicMock()
-        cont = MagicMock()
-        context_object.objects.all.return_value = [cont]
-        review_manager.Context = context_object
+        # Mock rankings, the rating counter starts with the
+        # ratings of the existing reviews
+        self._rating_sum = 15
+        self._rating_count = 3
+        review_manager.rankings = MagicMock()
+        review_manager.rankings.update_rating.side_effect = self._update_rating
 
         # Mock datetime
         self.datetime = datetime.now()
@@ -221,9 +220,20 @@ class ReviewTestCase(TestCase):
         self.user.userprofile.current_organization = self.org
         self.user.userprofile.rated_offerings = []
 
+    def _update_rating(self, offering, rating_delta, count_delta):
+        self._rating_sum += rating_delta
+        self._rating_count += count_delta
+
+        if not self._rating_count:
+            return 0
+
+        return float(self._rating_sum) / self._rating_count
+
     def _no_rated(self):
         self.offering.rating = 0.0
         self.offering.comments = []
+        self._rating_sum = 0
+        self._rating_count = 0
 
     def _org_rated(self):
         self.org.name = 'test_org'
@@ -327,6 +337,8 @@ class ReviewTestCase(TestCase):
             )
             self.assertEquals(self.offering.rating, exp_rating)
             self.assertEquals(self.offering.comments[0], rev.pk)
+            review_manager.rankings.update_rating.assert_called_once_with(self.offering, review['rating'], 1)
+            review_manager.rankings.update_offering.assert_called_once_with(self.offering)
 
             if not org_comment:
                 self.assertTrue(self.offering.pk in self.user.userprofile.rated_offerings)
@@ -439,6 +451,7 @@ class ReviewTestCase(TestCase):
         rev_object.organization = self.org
         self.offering.rating = 3.75
         self.offering.comments = ['333333', '444444', '555555', '666666']
+        self._rating_count = 4
         rev_object.offering = self.offering
         rev_object.rating = 4
         review_manager.Review = MagicMock()
@@ -468,6 +481,7 @@ class ReviewTestCase(TestCase):
 
             # Check new offering rating
             self.assertEquals(self.offering.rating, exp_rate)
+            review_manager.rankings.update_offering.assert_called_once_with(self.offering)
 
             self.offering.save.assert_called_once_with()
         else:
@@ -493,6 +507,8 @@ class ReviewTestCase(TestCase):
 
     def _last_review(self, rev):
         self.offering.comments = ['333333']
+        self._rating_sum = 3
+        self._rating_count = 1
         self.user.userprofile.is_user_org.return_value = False
         self.org.name = 'test_organization'
         self.org.rated_offerings = [{
@@ -530,6 +546,7 @@ class ReviewTestCase(TestCase):
         self.user.userprofile.rated_offerings = [self.offering.pk]
         self.offering.rating = 3.75
         self.offering.comments = ['333333', '444444', '555555', '666666']
+        self._rating_count = 4
         rev_object.offering = self.offering
         rev_object.rating = 3
         review_manager.Review = MagicMock()
@@ -551,6 +568,8 @@ class ReviewTestCase(TestCase):
 
         self.offering.save.assert_called_once_with()
         rev_object.delete.assert_called_once_with()
+        review_manager.rankings.update_rating.assert_called_once_with(self.offering, -3, -1)
+        review_manager.rankings.update_offering.assert_called_once_with(self.offering)
         # Check user or organization models
         user_check(self)
 
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+from __future__ import unicode_literals
+
+import time
+import threading
+from stemming.porter2 import stem
+
+from django.conf import settings
+
+from wstore.store_commons.database import get_database_connection
+
+
+def _encode_key(tag):
+    # Tags are used as field names of MongoDB documents
+    return tag.replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+
+def _decode_key(key):
+    return key.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+
+def get_stemmed_tags(tags):
+    """
+    Returns the stemmed version of a list of tags mapped to the
+    first named tag found for each of them
+    """
+    stemmed = {}
+    for tag in tags:
+        st_tag = stem(tag)
+        if st_tag and st_tag not in stemmed:
+            stemmed[st_tag] = tag
+
+    return stemmed
+
+
+class CooccurrenceModel():
+    """
+    Sparse matrix with the number of offerings where each pair of stemmed
+    tags appears together. The count of a tag with itself is the number
+    of offerings including the tag. The matrix is persisted with a document
+    per tag, updated incrementally when the tags of an offering change,
+    and loaded in memory for the recommendations
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = None
+        self._loaded = 0
+
+    def _get_ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+
+        return getattr(settings, 'TAG_MODEL_TTL', 60)
+
+    def _load(self):
+        db = get_database_connection()
+
+        rows = {}
+        for doc in db.wstore_tag_cooccurrence.find():
+            rows[_decode_key(doc['_id'])] = {
+                'name': doc['name'],
+                'neighbours': dict([(_decode_key(key), count) for key, count in doc['neighbours'].iteritems() if count > 0])
+            }
+
+        return rows
+
+    def _get_rows(self):
+        now = time.time()
+
+        with self._lock:
+            if self._rows is None or self._loaded + self._get_ttl() <= now:
+                self._rows = self._load()
+                self._loaded = now
+
+            return self._rows
+
+    def _update_rows(self, stemmed, inc):
+        # Apply the changes to the loaded matrix, so they are available
+        # in this process without loading it again
+        with self._lock:
+            if self._rows is None:
+                return
+
+            for st_tag, named_tag in stemmed.iteritems():
+                row = self._rows.setdefault(st_tag, {'name': named_tag, 'neighbours': {}})
+                if inc > 0:
+                    row['name'] = named_tag
+
+                for other in stemmed:
+                    count = row['neighbours'].get(other, 0) + inc
+                    if count > 0:
+                        row['neighbours'][other] = count
+                    else:
+                        row['neighbours'].pop(other, None)
+
+                if not len(row['neighbours']):
+                    del self._rows[st_tag]
+
+    def _update(self, tags, inc):
+        stemmed = get_stemmed_tags(tags)
+        db = get_database_connection()
+
+        for st_tag, named_tag in stemmed.iteritems():
+            update = {
+                '$inc': dict([('neighbours.' + _encode_key(other), inc) for other in stemmed])
+            }
+
+            if inc > 0:
+                update['$set'] = {'name': named_tag}
+
+            db.wstore_tag_cooccurrence.update({'_id': _encode_key(st_tag)}, update, upsert=inc > 0)
+
+            if inc < 0:
+                # Remove the tags no longer included in any offering
+                db.wstore_tag_cooccurrence.remove({
+                    '_id': _encode_key(st_tag),
+                    'neighbours.' + _encode_key(st_tag): {'$lte': 0}
+                })
+
+        self._update_rows(stemmed, inc)
+
+    def add_tags(self, tags):
+        """
+        Includes the tags of an offering in the matrix
+        """
+        self._update(tags, 1)
+
+    def remove_tags(self, tags):
+        """
+        Removes the tags of an offering from the matrix
+        """
+        self._update(tags, -1)
+
+    def clear(self):
+        """
+        Removes all the co-occurrence counts
+        """
+        db = get_database_connection()
+        db.wstore_tag_cooccurrence.remove()
+
+        with self._lock:
+            self._rows = {}
+            self._loaded = time.time()
+
+    def invalidate(self):
+        """
+        Discards the loaded matrix, which is loaded again when needed
+        """
+        with self._lock:
+            self._rows = None
+
+    def rebuild(self, offerings):
+        """
+        Creates the matrix again from the tags of the given offerings
+        """
+        rows = {}
+        for offering in offerings:
+            stemmed = get_stemmed_tags(offering.tags)
+
+            for st_tag, named_tag in stemmed.iteritems():
+                row = rows.setdefault(st_tag, {'name': named_tag, 'neighbours': {}})
+                for other in stemmed:
+                    row['neighbours'][other] = row['neighbours'].get(other, 0) + 1
+
+        self.clear()
+
+        db = get_database_connection()
+        if len(rows):
+            db.wstore_tag_cooccurrence.insert([{
+                '_id': _encode_key(st_tag),
+                'name': tag_row['name'],
+                'neighbours': dict([(_encode_key(other), count) for other, count in tag_row['neighbours'].iteritems()])
+            } for st_tag, tag_row in rows.iteritems()])
+
+        with self._lock:
+            self._rows = rows
+            self._loaded = time.time()
+
+    def recommend(self, user_tags, include_user_tags=False):
+        """
+        Returns the tags co-occurring with the user tags ranked using
+        pi = sum(|ti intersection tj| / |tj|) / n
+        """
+        rows = self._get_rows()
+
+        # Only the user tags included in any offering are used
+        user_rows = []
+        for st_tag in set([stem(tag) for tag in user_tags]):
+            row = rows.get(st_tag)
+            if row is not None and row['neighbours'].get(st_tag, 0) > 0:
+                user_rows.append((st_tag, row['neighbours']))
+
+        ranks = {}
+        for st_tag, neighbours in user_rows:
+            tag_count = float(neighbours[st_tag])
+
+            for co_tag, co_count in neighbours.iteritems():
+                if co_tag != st_tag or include_user_tags:
+                    ranks[co_tag] = ranks.get(co_tag, 0) + (co_count / tag_count)
+
+        return [(co_tag, rows.get(co_tag, {'name': co_tag})['name'], rank / len(user_rows)) for co_tag, rank in ranks.iteritems()]
+
+
+cooccurrence_model = CooccurrenceModel()
+
+
+def invalidate_cooccurrence(sender, **kwargs):
+    # The database has been flushed
+    cooccurrence_model.invalidate()
@@ -18,4 +18,10 @@
 # along with WStore.
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
+from django.db.models.signals import post_syncdb
 
+from wstore.social.tagging.cooccurrence import invalidate_cooccurrence
+
+
+# Discard the loaded co-occurrence counts when the database is flushed
+post_syncdb.connect(invalidate_cooccurrence)
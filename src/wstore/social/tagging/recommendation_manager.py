@@ -26,6 +26,7 @@ from stemming.porter2 import stem
 from whoosh.analysis import StemmingAnalyzer
 
 from wstore.social.tagging.tag_manager import TagManager
+from wstore.social.tagging.cooccurrence import cooccurrence_model
 from wstore.search.search_engine import SearchEngine
 
 
@@ -45,26 +46,17 @@ class RecommendationManager():
 
     def get_recommended_tags(self):
 
-        # Create usdl tags thread
+        # Get USDL named entities
         usdl_ent = USDLEntitiesRetrieving(self._offering)
         entities = usdl_ent.get_named_entities()
 
-        # Create co-occurrence thread
-        co_thd = CooccurrenceThead(self._coocurrence_tags, self._user_tags)
+        # Get co-occurrence tags from the precomputed counts
+        self._coocurrence_tags = cooccurrence_model.recommend(self._user_tags)
         # Get USDL co-occurrence tags
-        co_u_thd = CooccurrenceThead(self._usdl_coocurrence_tags, entities, include_user_tags=True)
-
-        # Run co-occurrence thread
-        co_thd.start()
-        co_u_thd.start()
-
-        # Wait for co-occurrence thread
-        co_thd.join()
-        co_u_thd.join()
+        self._usdl_coocurrence_tags = cooccurrence_model.recommend(entities, include_user_tags=True)
 
         # Aggregate tags
         return self._aggregate_tags()
-        
 
     def _aggregate_tags(self):
         """
@@ -112,6 +104,8 @@ class RecommendationManager():
 class CooccurrenceThead(Thread):
     """
       Creates a thread that generates and rank co-occurrence tags
+      scanning the tag index. The recommendations use the precomputed
+      co-occurrence model instead
     """
 
     _tag_container = None
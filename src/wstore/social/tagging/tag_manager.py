@@ -26,6 +26,8 @@ from whoosh.qparser import QueryParser
 from stemming.porter2 import stem
 
 from wstore.models import Offering
+from wstore.offerings import rankings
+from wstore.social.tagging.cooccurrence import cooccurrence_model
 
 
 class TagManager():
@@ -46,6 +48,7 @@ class TagManager():
 
     def update_tags(self, offering, tags):
         # Save offering tags
+        old_tags = list(offering.tags)
         offering.tags = tags
         offering.save()
 
@@ -82,6 +85,13 @@ class TagManager():
 
             index_writer.commit()
 
+        # Update the co-occurrence counts with the new tags
+        cooccurrence_model.remove_tags(old_tags)
+        cooccurrence_model.add_tags(tags)
+
+        # Move the offering to the rankings of its new categories
+        rankings.update_categories(offering, old_tags)
+
     def delete_tag(self, offering):
         # Check if the index exists
         if not os.path.exists(self._index_path) or os.listdir(self._index_path) == []:
@@ -100,6 +110,8 @@ class TagManager():
             index_writer.delete_by_term('id', unicode(offering.pk))
             index_writer.commit()
 
+        cooccurrence_model.remove_tags(offering.tags)
+
     def count_offerings(self, tag):
         # Count offerings
         return len(self.get_index_doc_by_tag(tag))
@@ -108,8 +120,9 @@ class TagManager():
         # Get documents
         docs = self.get_index_doc_by_tag(tag, start=start, p_limit=limit)
 
-        # Get offerings
-        return [Offering.objects.get(pk=doc['id']) for doc in docs]
+        # Get offerings with a single query keeping the index order
+        offerings = Offering.objects.in_bulk([doc['id'] for doc in docs])
+        return [offerings[doc['id']] for doc in docs]
 
     def get_index_doc_by_tag(self, tag, start=None, p_limit=None):
         # Open the index
@@ -22,7 +22,6 @@ from __future__ import unicode_literals
 
 import os
 import json
-import types
 import shutil
 from decimal import Decimal
 from mock import MagicMock
@@ -33,10 +32,11 @@ from whoosh.qparser import QueryParser
 from stemming.porter2 import stem
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.test.client import RequestFactory
 from django.contrib.auth.models import User
 
-from wstore.social.tagging import recommendation_manager, tag_manager, views
+from wstore.social.tagging import recommendation_manager, tag_manager, views, cooccurrence
 from wstore.models import Organization, Offering
 
 
@@ -107,6 +107,97 @@ class TagCooccurrenceTestCase(TestCase):
             self.assertEquals(str(t[2]), scores[ix])
 
 
+TAGGED_OFFERINGS = [
+    ['test', 'thing', 'mock', 'user'],
+    ['test', 'mock', 'reference', 'use'],
+    ['widget', 'wirecloud', 'mashup', 'platform'],
+    ['widget', 'wirecloud']
+]
+
+
+class CooccurrenceModelTestCase(TestCase):
+
+    tags = ('tagging', 'fiware-ut-30')
+
+    def setUp(self):
+        self._model = cooccurrence.CooccurrenceModel(ttl=0)
+        self._model.clear()
+
+    def _get_offerings(self, tag_lists):
+        offerings = []
+        for tags in tag_lists:
+            offering = MagicMock()
+            offering.tags = tags
+            offerings.append(offering)
+
+        return offerings
+
+    @parameterized.expand([
+        (['test'], ('thing', 'mock', 'user', 'reference', 'use'), (0.5, 1, 0.5, 0.5, 0.5)),
+        (['widget', 'notag'], ('wirecloud', 'mashup', 'platform'), (1, 0.5, 0.5)),
+        (['notag'], (), ()),
+        (['test', 'widget'], ('thing', 'mock', 'user', 'reference', 'use', 'wirecloud', 'mashup', 'platform'),
+         (0.25, 0.5, 0.25, 0.25, 0.25, 0.5, 0.25, 0.25)),
+        (['widgets'], ('widget', 'wirecloud', 'mashup', 'platform'), (1, 1, 0.5, 0.5), True)
+    ])
+    def test_recommendation(self, user_tags, tags, scores, use_tags=False):
+        for offering_tags in TAGGED_OFFERINGS:
+            self._model.add_tags(offering_tags)
+
+        result = self._model.recommend(user_tags, include_user_tags=use_tags)
+
+        self.assertEquals(len(result), len(tags))
+        for st_tag, named_tag, rank in result:
+            self.assertEquals(st_tag, stem(named_tag))
+            self.assertEquals(rank, scores[tags.index(named_tag)])
+
+    def test_incremental_update(self):
+        for offering_tags in TAGGED_OFFERINGS:
+            self._model.add_tags(offering_tags)
+
+        # Change the tags of an offering and include tags with
+        # characters not allowed in MongoDB field names
+        self._model.remove_tags(TAGGED_OFFERINGS[3])
+        self._model.add_tags(['widget', 'node.js', 'a$b'])
+
+        offerings = self._get_offerings(TAGGED_OFFERINGS[:3] + [['widget', 'node.js', 'a$b']])
+        expected = cooccurrence.CooccurrenceModel(ttl=0)
+        expected.rebuild(offerings)
+        rows = self._model._load()
+
+        self.assertEquals(rows, expected._load())
+        self.assertEquals(rows[stem('widget')]['neighbours'], {
+            stem('widget'): 2,
+            stem('wirecloud'): 1,
+            stem('mashup'): 1,
+            stem('platform'): 1,
+            stem('node.js'): 1,
+            stem('a$b'): 1
+        })
+
+        # Tags not included in any offering are removed
+        self._model.remove_tags(['widget', 'node.js', 'a$b'])
+        rows = self._model._load()
+
+        self.assertFalse(stem('node.js') in rows)
+        self.assertFalse(stem('a$b') in rows)
+        self.assertEquals(rows[stem('widget')]['neighbours'][stem('widget')], 1)
+
+    @override_settings(TAG_MODEL_TTL=60)
+    def test_rows_cached(self):
+        model = cooccurrence.CooccurrenceModel()
+        model.add_tags(['widget', 'mashup'])
+        self.assertEquals(len(model.recommend(['widget'])), 1)
+
+        # Changes made by other processes are not loaded until the
+        # cached matrix expires or it is invalidated
+        self._model.add_tags(['widget', 'wirecloud'])
+        self.assertEquals(len(model.recommend(['widget'])), 1)
+
+        model.invalidate()
+        self.assertEquals(len(model.recommend(['widget'])), 2)
+
+
 class USDLTagsTestCase(TestCase):
 
     tags = ('tagging', 'fiware-ut-30')
@@ -208,16 +299,16 @@ class TagManagementTestCase(TestCase):
         # Create mock offerings
         tag_manager.Offering = MagicMock()
 
-        def get_mock(pk=None):
+        def in_bulk_mock(pks):
             id_field = {
                 '11111': 'offering1',
                 '22222': 'offering2',
                 '33333': 'offering3'
             }
-            return id_field[pk]
+            return dict([(pk, id_field[pk]) for pk in pks])
 
         self._create_index_dir()
-        tag_manager.Offering.objects.get = get_mock
+        tag_manager.Offering.objects.in_bulk = in_bulk_mock
 
         tm = tag_manager.TagManager(self._path)
         offerings = tm.search_by_tag('test1')
@@ -450,38 +541,8 @@ class RecommendationProcessTestCase(TestCase):
     def test_complete_recommendation_process(self):
         # Test the complete recommendation process
 
-        # Create indexes
-        os.makedirs(self._path)
-        # Create schema
-        schema = Schema(id=ID(stored=True, unique=True), tags=KEYWORD(stored=True), named_tags=KEYWORD(stored=True))
-        # Create index
-        index = create_in(self._path, schema)
-        index_writer = index.writer()
-        for off in Offering.objects.all():
-            # Create stemmed tags text
-            # Create tags text
-            text = ''
-            named_text = ''
-            # Create tags text
-            for tag in off.tags:
-                text += stem(tag) + ' '
-                named_text += tag + ' '
-
-            if text:
-                index_writer.add_document(id=unicode(off.pk), tags=text, named_tags=named_text)
-
-        index_writer.commit()
-
-        # Override TagManager init method in order to avoid default index path
-        def new_init(tag_self, path=None):
-            tag_self._index_path = self._path
-
-        old_init = recommendation_manager.TagManager.__init__
-        self._init_copy = types.FunctionType(old_init.func_code, old_init.func_globals, name = old_init.func_name,
-                       argdefs = old_init.func_defaults,
-                       closure = old_init.func_closure)
-
-        recommendation_manager.TagManager.__init__ = new_init
+        # Create the co-occurrence counts of the offerings
+        cooccurrence.cooccurrence_model.rebuild(Offering.objects.all())
 
         # Create recommendation offering
         main_offering = Offering.objects.get(pk="51100aba8e05ac2115f022f0")
@@ -26,15 +26,17 @@ from django.http import HttpResponse
 
 from wstore.store_commons.utils.http import build_response, authentication_required, supported_request_mime_types
 from wstore.store_commons.resource import Resource
+from wstore.store_commons.response_cache import cached_response
 from wstore.social.tagging.recommendation_manager import RecommendationManager
 from wstore.social.tagging.tag_manager import TagManager
 from wstore.models import Offering, Organization
-from wstore.offerings.offerings_management import get_offering_info
+from wstore.offerings.offerings_management import get_offerings_info
 
 
 class TagCollection(Resource):
 
     @authentication_required
+    @cached_response('offering')
     def read(self, request, organization, name, version):
         # Get offering
         try:
@@ -98,6 +100,7 @@ class TagCollection(Resource):
 class SearchTagEntry(Resource):
 
     @authentication_required
+    @cached_response('offering', 'resource', 'purchase')
     def read(self, request, tag):
         # Get query params
         action = request.GET.get('action', None)
@@ -156,8 +159,7 @@ class SearchTagEntry(Resource):
 
                 response = []
                 # Get offering info
-                for off in offerings:
-                    offering_info = get_offering_info(off, request.user)
+                for offering_info in get_offerings_info(offerings, request.user):
 
                     if not state and offering_info['state'] != 'published'\
                     and offering_info['state'] != 'purchased' and offering_info['state'] != 'rated':
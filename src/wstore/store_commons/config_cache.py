@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import time
+import threading
+from copy import deepcopy
+
+from django.conf import settings
+
+
+class ConfigCache():
+    """
+    Process local cache of the near-static configuration used when
+    charging and building URLs: the registered RSS, the site domain and
+    the unit definitions. Entries expire after CONFIG_CACHE_TTL seconds
+    and are invalidated when the models are saved or deleted, or when
+    the database is flushed
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _get_ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+
+        return getattr(settings, 'CONFIG_CACHE_TTL', 60)
+
+    def _get(self, key, loader):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        value = loader()
+
+        with self._lock:
+            self._entries[key] = (now + self._get_ttl(), value)
+
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Removes the given entries from the cache, or all the entries
+        if no key is provided
+        """
+        with self._lock:
+            if not len(keys):
+                self._entries = {}
+
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def _load_rss(self):
+        from wstore.models import RSS
+
+        rss_collection = RSS.objects.all()
+        if len(rss_collection) > 0:
+            return rss_collection[0]
+
+        return None
+
+    def get_rss(self):
+        """
+        Returns the first RSS registered or None if no RSS has been registered.
+        A copy is returned, since the RSS tokens are refreshed in place
+        """
+        return deepcopy(self._get('rss', self._load_rss))
+
+    def _load_context(self):
+        from wstore.models import Context
+
+        return Context.objects.all()[0].site.domain
+
+    def get_site_domain(self):
+        return self._get('context', self._load_context)
+
+    def _load_units(self):
+        from wstore.charging_engine.models import Unit
+
+        return dict([(unit.name, unit) for unit in Unit.objects.all()])
+
+    def get_unit(self, name):
+        """
+        Returns the unit with the given name, raising Unit.DoesNotExist
+        if it is not defined
+        """
+        units = self._get('units', self._load_units)
+
+        if name not in units:
+            # The unit may have been created after loading the cache
+            self.invalidate('units')
+            units = self._get('units', self._load_units)
+
+        if name not in units:
+            from wstore.charging_engine.models import Unit
+            raise Unit.DoesNotExist('Unit ' + name + ' does not exist')
+
+        return units[name]
+
+
+config_cache = ConfigCache()
+
+
+def invalidate_rss(sender, **kwargs):
+    config_cache.invalidate('rss')
+
+
+def invalidate_context(sender, **kwargs):
+    config_cache.invalidate('context')
+
+
+def invalidate_units(sender, **kwargs):
+    config_cache.invalidate('units')
+
+
+def invalidate_config(sender, **kwargs):
+    # The database has been flushed
+    config_cache.invalidate()
@@ -18,35 +18,124 @@
 # along with WStore.
 # If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
 
-from pymongo import MongoClient
+import os
+import threading
+
+from pymongo import MongoClient, ReadPreference
 
 from django.conf import settings
 
 
-def get_database_connection():
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Statistics of the client of the current process
+_stats = {
+    'clients_created': 0,
+    'connections_requested': 0
+}
+
+
+def _create_client():
     """
-    Gets a raw database connection to MongoDB
+    Creates a MongoDB client configured with the pool settings
     """
     # Get database info from settings
     database_info = settings.DATABASES['default']
 
-    client = None
+    options = {
+        'max_pool_size': getattr(settings, 'MONGODB_MAX_POOL_SIZE', 100),
+        'read_preference': getattr(ReadPreference, getattr(settings, 'MONGODB_READ_PREFERENCE', 'PRIMARY'))
+    }
+
+    timeout = getattr(settings, 'MONGODB_TIMEOUT', None)
+    if timeout is not None:
+        options['connectTimeoutMS'] = timeout
+        options['socketTimeoutMS'] = timeout
+        options['waitQueueTimeoutMS'] = timeout
+
     # Create database connection
     if database_info['HOST'] and database_info['PORT']:
-        client = MongoClient(database_info['HOST'], database_info['PORT'])
+        client = MongoClient(database_info['HOST'], database_info['PORT'], **options)
     elif database_info['HOST'] and not database_info['PORT']:
-        client = MongoClient(database_info['HOST'])
+        client = MongoClient(database_info['HOST'], **options)
     elif not database_info['HOST'] and database_info['PORT']:
-        client = MongoClient('localhost', database_info['PORT'])
+        client = MongoClient('localhost', database_info['PORT'], **options)
     else:
-        client = MongoClient()
+        client = MongoClient(**options)
 
+    #Authenticate if needed, the credentials are kept by the client
+    if database_info['USER'] and database_info['PASSWORD']:
+        client[database_info['NAME']].authenticate(database_info['USER'], database_info['PASSWORD'], mechanism='MONGODB-CR')
 
-    db_name = database_info['NAME']
-    db = client[db_name]
+    return client
 
-    #Authenticate if needed
-    if database_info['USER'] and database_info['PASSWORD']:
-        db.authenticate(database_info['USER'], database_info['PASSWORD'], mechanism='MONGODB-CR')
 
-    return db
+def get_database_client():
+    """
+    Returns the MongoDB client of the process. The client is created
+    lazily and created again in forked processes, so each worker process
+    uses its own connection pool
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            if _client_pid != pid:
+                # The statistics of the parent process are not valid
+                _stats['clients_created'] = 0
+                _stats['connections_requested'] = 0
+
+            _client = _create_client()
+            _client_pid = pid
+            _stats['clients_created'] += 1
+
+        _stats['connections_requested'] += 1
+        return _client
+
+
+def get_database_connection():
+    """
+    Gets a raw database connection to MongoDB
+    """
+    client = get_database_client()
+    return client[settings.DATABASES['default']['NAME']]
+
+
+def _get_pool(client):
+    """
+    Returns the connection pool of the member the client is connected to,
+    pymongo does not provide a public API for reading it
+    """
+    member = getattr(client, '_MongoClient__member', None)
+    return getattr(member, 'pool', None)
+
+
+def get_connection_stats():
+    """
+    Returns the statistics of the MongoDB client of the process
+    and of its connection pool
+    """
+    with _client_lock:
+        client = _client
+        stats = dict(_stats)
+        stats['pid'] = _client_pid
+
+    stats['max_pool_size'] = getattr(settings, 'MONGODB_MAX_POOL_SIZE', 100)
+    stats['timeout'] = getattr(settings, 'MONGODB_TIMEOUT', None)
+    stats['read_preference'] = getattr(settings, 'MONGODB_READ_PREFERENCE', 'PRIMARY')
+    stats['alive'] = False
+    stats['idle_sockets'] = 0
+
+    if client is not None:
+        stats['max_pool_size'] = client.max_pool_size
+        stats['alive'] = client.alive()
+
+        pool = _get_pool(client)
+        if pool is not None:
+            stats['idle_sockets'] = len(pool.sockets)
+
+    return stats
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import json
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from wstore.store_commons.database import get_database_connection
+
+
+def bump_version(name):
+    """
+    Increments the version counter of a kind of objects, so the cached
+    responses built from them are no longer used
+    """
+    db = get_database_connection()
+    db.wstore_cache_version.update({'_id': name}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def get_versions(names):
+    """
+    Returns the current version counters of the given kinds of objects
+    """
+    db = get_database_connection()
+    versions = dict([(name, 0) for name in names])
+
+    for counter in db.wstore_cache_version.find({'_id': {'$in': list(names)}}):
+        versions[counter['_id']] = counter['version']
+
+    return versions
+
+
+def _get_visibility(request):
+    """
+    Returns the info that makes the responses different for each caller,
+    the offering states depend on the purchases and ratings of the user
+    and its current organization
+    """
+    user = request.user
+    profile = user.userprofile
+    organization = profile.current_organization
+
+    return {
+        'user': user.pk,
+        'organization': organization.pk,
+        'organizations': profile.organizations,
+        'user_purchased': profile.offerings_purchased,
+        'user_rated': profile.rated_offerings,
+        'org_purchased': organization.offerings_purchased,
+        'org_rated': [rate['offering'] for rate in organization.rated_offerings if rate['user'] == user.pk]
+    }
+
+
+def get_cache_key(request, dependencies):
+    key_info = {
+        'path': request.path,
+        'params': sorted(request.GET.lists()),
+        'visibility': _get_visibility(request),
+        'versions': get_versions(dependencies)
+    }
+
+    return hashlib.sha1(json.dumps(key_info, sort_keys=True, default=unicode)).hexdigest()
+
+
+def _get_cache():
+    alias = getattr(settings, 'RESPONSE_CACHE', None)
+    if alias is None:
+        return None
+
+    from django.core.cache import get_cache
+    return get_cache(alias)
+
+
+def cached_response(*dependencies):
+    """
+    Caches the responses of a read method, the cache key includes the
+    requested URL, the caller and the version of the objects the response
+    depends on. The key is used as ETag, so the requests of an unchanged
+    response are answered with a 304 without building it
+    """
+    def wrap(func):
+        def wrapper(self, request, *args, **kwargs):
+            cache = _get_cache()
+            if cache is None:
+                return func(self, request, *args, **kwargs)
+
+            key = get_cache_key(request, dependencies)
+            etag = '"' + key + '"'
+
+            if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+                response = HttpResponse(status=304)
+                response['ETag'] = etag
+                return response
+
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(cached[0], status=200, content_type=cached[1])
+            else:
+                response = func(self, request, *args, **kwargs)
+
+                # Only successful responses are cached
+                if response.status_code != 200:
+                    return response
+
+                cache.set(key, (response.content, response['Content-Type']), getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+
+            response['ETag'] = etag
+            return response
+
+        return wrapper
+
+    return wrap
+
+
+def invalidate_responses(sender, **kwargs):
+    # The database has been flushed, so the version counters start again
+    cache = _get_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def invalidate_offerings(sender, **kwargs):
+    bump_version('offering')
+
+
+def invalidate_resources(sender, **kwargs):
+    bump_version('resource')
+
+
+def invalidate_reviews(sender, **kwargs):
+    bump_version('review')
+
+
+def invalidate_purchases(sender, **kwargs):
+    bump_version('purchase')
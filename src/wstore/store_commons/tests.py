@@ -20,16 +20,33 @@
 
 from __future__ import unicode_literals
 
+import os
+import base64
+import shutil
+import hashlib
+import tempfile
 import rdflib
 from mock import MagicMock
 from nose_parameterized import parameterized
 
+from django.conf import settings
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.http import HttpResponse
+from django.core.cache import get_cache
 from django.contrib.sites.models import Site
+from django.contrib.auth.models import User
+from django.test.client import RequestFactory
 
 from wstore.store_commons.utils.usdlParser import USDLParser, validate_usdl
 from wstore.store_commons.utils import usdlParser
-from wstore.models import Organization, Context
+from wstore.store_commons.utils import files
+from wstore.store_commons import database
+from wstore.store_commons import config_cache
+from wstore.store_commons import response_cache
+from wstore.admin import views as admin_views
+from wstore.models import Organization, Context, RSS
+from wstore.charging_engine.models import Unit
 
 __test__ = False
 
@@ -626,3 +643,398 @@ class PriceFunctionParsingTestCase(TestCase):
 
             self.assertTrue(error)
             self.assertEquals(msg, 'Invalid price function: ' + error_messages[i])
+
+
+class DatabaseConnectionTestCase(TestCase):
+
+    tags = ('database',)
+
+    def setUp(self):
+        reload(database)
+        database.MongoClient = MagicMock()
+        database.os = MagicMock()
+        database.os.getpid.return_value = 100
+
+    def tearDown(self):
+        reload(database)
+
+    def test_client_reused(self):
+
+        db = database.get_database_connection()
+        database.get_database_connection()
+
+        self.assertEquals(database.MongoClient.call_count, 1)
+        self.assertEquals(db, database.MongoClient.return_value.__getitem__.return_value)
+
+        stats = database.get_connection_stats()
+        self.assertEquals(stats['clients_created'], 1)
+        self.assertEquals(stats['connections_requested'], 2)
+        self.assertEquals(stats['pid'], 100)
+
+    def test_client_created_after_fork(self):
+        database.MongoClient.side_effect = lambda *args, **kwargs: MagicMock()
+
+        parent_client = database.get_database_client()
+
+        # A forked process must not use the pool of its parent
+        database.os.getpid.return_value = 101
+        child_client = database.get_database_client()
+
+        self.assertEquals(database.MongoClient.call_count, 2)
+        self.assertFalse(child_client is parent_client)
+        self.assertTrue(database.get_database_client() is child_client)
+
+        stats = database.get_connection_stats()
+        self.assertEquals(stats['clients_created'], 1)
+        self.assertEquals(stats['connections_requested'], 2)
+        self.assertEquals(stats['pid'], 101)
+
+    def test_pool_stats(self):
+        client = database.MongoClient.return_value
+        client.max_pool_size = 10
+        client.alive.return_value = True
+        client._MongoClient__member.pool.sockets = set(['socket1', 'socket2'])
+
+        database.get_database_connection()
+        stats = database.get_connection_stats()
+
+        self.assertEquals(stats['max_pool_size'], 10)
+        self.assertTrue(stats['alive'])
+        self.assertEquals(stats['idle_sockets'], 2)
+
+    def test_stats_without_client(self):
+        stats = database.get_connection_stats()
+
+        self.assertEquals(stats['clients_created'], 0)
+        self.assertEquals(stats['pid'], None)
+        self.assertFalse(stats['alive'])
+        self.assertEquals(stats['idle_sockets'], 0)
+
+    @parameterized.expand([
+        ('admin', True, 200),
+        ('forbidden', False, 403)
+    ])
+    def test_database_stats_view(self, name, staff, status):
+
+        user = User.objects.create_user(username='test_user', email='', password='passwd')
+        user.is_staff = staff
+
+        admin_views.get_connection_stats = MagicMock()
+        admin_views.get_connection_stats.return_value = {}
+
+        request = RequestFactory().get('/api/administration/database/stats', HTTP_ACCEPT='application/json')
+        request.user = user
+
+        try:
+            collection = admin_views.DatabaseStatsCollection(permitted_methods=('GET',))
+            response = collection.read(request)
+        finally:
+            reload(admin_views)
+
+        self.assertEquals(response.status_code, status)
+
+
+class ConfigCacheTestCase(TestCase):
+
+    tags = ('config-cache',)
+
+    def setUp(self):
+        self._old_cache = config_cache.config_cache
+        self.cache = config_cache.ConfigCache(ttl=60)
+        config_cache.config_cache = self.cache
+
+    def tearDown(self):
+        config_cache.config_cache = self._old_cache
+
+    def test_entries_cached(self):
+        rss = RSS(name='test_rss', host='http://testrss.com/')
+        self.cache._load_rss = MagicMock()
+        self.cache._load_rss.return_value = rss
+
+        self.assertEquals(self.cache.get_rss().name, 'test_rss')
+        self.assertEquals(self.cache.get_rss().name, 'test_rss')
+        self.assertEquals(self.cache._load_rss.call_count, 1)
+
+        self.cache.invalidate('rss')
+        self.cache.get_rss()
+        self.assertEquals(self.cache._load_rss.call_count, 2)
+
+    def test_rss_copied(self):
+        RSS.objects.create(name='test_rss', host='http://testrss.com/', access_token='aaaaa')
+
+        # The tokens refreshed in a thread do not modify the cached RSS
+        rss = self.cache.get_rss()
+        rss.access_token = 'bbbbb'
+
+        self.assertEquals(self.cache.get_rss().access_token, 'aaaaa')
+        self.assertFalse(self.cache.get_rss() is self.cache.get_rss())
+
+    @override_settings(CONFIG_CACHE_TTL=60)
+    def test_default_ttl(self):
+        cache = config_cache.ConfigCache()
+        cache._load_context = MagicMock()
+        cache._load_context.return_value = 'http://localhost:8000/'
+
+        self.assertEquals(cache.get_site_domain(), 'http://localhost:8000/')
+        self.assertEquals(cache.get_site_domain(), 'http://localhost:8000/')
+        self.assertEquals(cache._load_context.call_count, 1)
+
+    def test_invalidated_on_flush(self):
+        self.cache._load_rss = MagicMock()
+        self.cache.get_rss()
+
+        # The database is flushed between tests
+        config_cache.invalidate_config(None)
+
+        self.cache.get_rss()
+        self.assertEquals(self.cache._load_rss.call_count, 2)
+
+    def test_entries_expired(self):
+        self.cache._ttl = 0
+        self.cache._load_context = MagicMock()
+        self.cache._load_context.return_value = 'http://localhost:8000/'
+
+        self.assertEquals(self.cache.get_site_domain(), 'http://localhost:8000/')
+        self.assertEquals(self.cache.get_site_domain(), 'http://localhost:8000/')
+        self.assertEquals(self.cache._load_context.call_count, 2)
+
+    def test_unit_lookup(self):
+        Unit.objects.create(name='per month', defined_model='subscription', renovation_period=30)
+
+        unit = self.cache.get_unit('per month')
+        self.assertEquals(unit.defined_model, 'subscription')
+        self.assertEquals(unit.renovation_period, 30)
+
+        # New units are found without waiting for the entry to expire
+        Unit.objects.create(name='per week', defined_model='subscription', renovation_period=7)
+        self.assertEquals(self.cache.get_unit('per week').renovation_period, 7)
+
+        error = None
+        try:
+            self.cache.get_unit('invalid')
+        except Exception, e:
+            error = e
+
+        self.assertTrue(isinstance(error, Unit.DoesNotExist))
+
+    def test_invalidated_on_save(self):
+        self.assertEquals(self.cache.get_rss(), None)
+
+        rss = RSS.objects.create(name='test_rss', host='http://testrss.com/')
+        self.assertEquals(self.cache.get_rss().pk, rss.pk)
+
+        site = Site.objects.create(name='test_site', domain='http://testsite.com/')
+        Context.objects.all().delete()
+        Context.objects.create(site=site)
+        self.assertEquals(self.cache.get_site_domain(), 'http://testsite.com/')
+
+        site.domain = 'http://updatedsite.com/'
+        site.save()
+        self.assertEquals(self.cache.get_site_domain(), 'http://updatedsite.com/')
+
+
+class ResponseCacheTestCase(TestCase):
+
+    tags = ('response-cache',)
+
+    def setUp(self):
+        reload(response_cache)
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        response_cache._get_cache = MagicMock()
+        response_cache._get_cache.return_value = self.cache
+
+        self.versions = {'offering': 0}
+        response_cache.get_versions = MagicMock()
+        response_cache.get_versions.side_effect = lambda names: self.versions
+
+        response_cache._get_visibility = MagicMock()
+        response_cache._get_visibility.return_value = {'user': '1'}
+
+        self.request = MagicMock()
+        self.request.path = '/api/offering/offerings'
+        self.request.GET.lists.return_value = [('start', ['1'])]
+        self.request.META = {}
+
+        self.view = MagicMock()
+        self.view.return_value = HttpResponse('{"offerings": []}', status=200, content_type='application/json')
+
+    def tearDown(self):
+        reload(response_cache)
+
+    def _call(self):
+        decorated = response_cache.cached_response('offering')(self.view)
+        return decorated(MagicMock(), self.request)
+
+    def test_response_cached(self):
+        response = self._call()
+        etag = response['ETag']
+
+        cached = self._call()
+
+        self.assertEquals(self.view.call_count, 1)
+        self.assertEquals(cached.status_code, 200)
+        self.assertEquals(cached.content, '{"offerings": []}')
+        self.assertEquals(cached['Content-Type'], 'application/json')
+        self.assertEquals(cached['ETag'], etag)
+
+    def test_not_modified(self):
+        etag = self._call()['ETag']
+
+        self.request.META['HTTP_IF_NONE_MATCH'] = etag
+        response = self._call()
+
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag)
+        self.assertEquals(self.view.call_count, 1)
+
+    def test_version_changed(self):
+        etag = self._call()['ETag']
+
+        self.versions = {'offering': 1}
+        self.request.META['HTTP_IF_NONE_MATCH'] = etag
+        response = self._call()
+
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+        self.assertEquals(self.view.call_count, 2)
+
+    def test_error_not_cached(self):
+        self.view.return_value = HttpResponse('Not found', status=404)
+
+        response = self._call()
+        self._call()
+
+        self.assertEquals(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEquals(self.view.call_count, 2)
+
+    def test_invalidated_on_flush(self):
+        self._call()
+
+        # The database is flushed between tests
+        response_cache.invalidate_responses(None)
+        self._call()
+
+        self.assertEquals(self.view.call_count, 2)
+
+    def test_default_cache(self):
+        reload(response_cache)
+
+        self.assertEquals(settings.RESPONSE_CACHE, 'responses')
+        self.assertNotEquals(response_cache._get_cache(), None)
+
+    def test_cache_disabled(self):
+        response_cache._get_cache.return_value = None
+
+        self._call()
+        self._call()
+
+        self.assertEquals(self.view.call_count, 2)
+        self.assertFalse(response_cache.get_versions.called)
+
+
+@override_settings(FILE_CHUNK_SIZE=6)
+class FileStreamingTestCase(TestCase):
+
+    tags = ('file-streaming',)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.content = b'0123456789abcdefghijklmnopqrstuvwxyz'
+        self.path = os.path.join(self.dir, 'test_file.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_base64_chunks(self):
+        # Base64 data split in lines not aligned with the chunks
+        encoded = base64.b64encode(self.content)
+        encoded = '\n'.join([encoded[i:i + 10] for i in range(0, len(encoded), 10)])
+        chunks = list(files.iter_base64_chunks(encoded))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(max([len(chunk) for chunk in chunks]) <= 6)
+        self.assertEquals(b''.join(chunks), self.content)
+
+    def test_invalid_base64(self):
+        error = None
+        try:
+            list(files.iter_base64_chunks('YWJjZA='))
+        except Exception, e:
+            error = e
+
+        self.assertTrue(isinstance(error, ValueError))
+        self.assertEquals(unicode(error), 'Invalid file content: The provided data is not base64 encoded')
+
+    def test_save_file_chunks(self):
+        f = tempfile.TemporaryFile()
+        f.write(self.content)
+
+        content_hash = files.save_file_chunks(files.iter_file_chunks(f), self.path)
+        f.close()
+
+        saved = open(self.path, 'rb')
+        self.assertEquals(saved.read(), self.content)
+        saved.close()
+
+        self.assertEquals(content_hash, hashlib.sha256(self.content).hexdigest())
+        # No temporal files are kept
+        self.assertEquals(os.listdir(self.dir), ['test_file.txt'])
+
+    def _serve(self, range_header=None):
+        f = open(self.path, 'wb')
+        f.write(self.content)
+        f.close()
+
+        request = MagicMock()
+        request.META = {}
+        if range_header:
+            request.META['HTTP_RANGE'] = range_header
+
+        return files.serve_file(request, self.path, etag='hash')
+
+    @parameterized.expand([
+        ('complete', None, 200, 0, 35),
+        ('range', 'bytes=2-9', 206, 2, 9),
+        ('open_range', 'bytes=30-', 206, 30, 35),
+        ('suffix_range', 'bytes=-4', 206, 32, 35),
+        ('exceeded_range', 'bytes=30-100', 206, 30, 35),
+        ('unsupported_range', 'items=1-2', 200, 0, 35)
+    ])
+    def test_serve_file(self, name, range_header, status, first, last):
+        response = self._serve(range_header)
+
+        self.assertEquals(response.status_code, status)
+        self.assertEquals(response['Content-Length'], str(last - first + 1))
+        self.assertEquals(response['Content-Type'], 'text/plain')
+        self.assertEquals(response['ETag'], '"hash"')
+        self.assertEquals(response['Accept-Ranges'], 'bytes')
+        self.assertEquals(response.content, self.content[first:last + 1])
+
+        if status == 206:
+            self.assertEquals(response['Content-Range'], 'bytes %d-%d/36' % (first, last))
+
+    def test_unsatisfiable_range(self):
+        response = self._serve('bytes=40-50')
+
+        self.assertEquals(response.status_code, 416)
+        self.assertEquals(response['Content-Range'], 'bytes */36')
+
+    @parameterized.expand([
+        ('x-sendfile', 'X-Sendfile', None),
+        ('x-accel-redirect', 'X-Accel-Redirect', '/protected/resources/test_file.txt')
+    ])
+    def test_offload(self, offload, header, value):
+        os.mkdir(os.path.join(self.dir, 'resources'))
+        self.path = os.path.join(self.dir, 'resources', 'test_file.txt')
+
+        with self.settings(MEDIA_OFFLOAD=offload, MEDIA_ROOT=self.dir):
+            response = files.serve_file(MagicMock(), self.path)
+
+        if value is None:
+            value = self.path
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response[header], value)
+        self.assertEquals(response.content, b'')
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of WStore.
+
+# WStore is free software: you can redistribute it and/or modify
+# it under the terms of the European Union Public Licence (EUPL)
+# as published by the European Commission, either version 1.1
+# of the License, or (at your option) any later version.
+
+# WStore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# European Union Public Licence for more details.
+
+# You should have received a copy of the European Union Public Licence
+# along with WStore.
+# If not, see <https://joinup.ec.europa.eu/software/page/eupl/licence-eupl>.
+
+import os
+import re
+import base64
+import hashlib
+import binascii
+import tempfile
+import mimetypes
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import http_date
+from django.utils.encoding import smart_str
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _get_chunk_size():
+    return getattr(settings, 'FILE_CHUNK_SIZE', 64 * 1024)
+
+
+def iter_file_chunks(file_):
+    """
+    Reads a file object in fixed size chunks, using the chunks of the
+    Django uploaded files when available
+    """
+    chunk_size = _get_chunk_size()
+    file_.seek(0)
+
+    if hasattr(file_, 'chunks'):
+        for chunk in file_.chunks(chunk_size):
+            yield chunk
+    else:
+        chunk = file_.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = file_.read(chunk_size)
+
+
+def iter_base64_chunks(data):
+    """
+    Decodes a base64 string in fixed size chunks. The characters not
+    completing a base64 quantum are kept for the next chunk
+    """
+    # Each 4 base64 characters are decoded to 3 bytes
+    chunk_size = (_get_chunk_size() // 3) * 4
+    pending = ''
+
+    for i in range(0, len(data), chunk_size):
+        encoded = pending + ''.join(data[i:i + chunk_size].split())
+        end = len(encoded) - (len(encoded) % 4)
+        pending = encoded[end:]
+
+        if end:
+            try:
+                yield base64.b64decode(encoded[:end])
+            except (TypeError, binascii.Error):
+                raise ValueError('Invalid file content: The provided data is not base64 encoded')
+
+    if pending:
+        raise ValueError('Invalid file content: The provided data is not base64 encoded')
+
+
+def save_file_chunks(chunks, file_path):
+    """
+    Writes a sequence of chunks to the given path, computing the SHA-256
+    hash of the contents. The file is written in a temporal file of the
+    same directory that is renamed when complete, so partial uploads are
+    never served
+    """
+    content_hash = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix='.upload_')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                content_hash.update(chunk)
+                f.write(chunk)
+
+        # Temporal files are only readable by the owner
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, file_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return content_hash.hexdigest()
+
+
+def _parse_range(range_header, size):
+    """
+    Returns the first and last bytes of a single bytes range, None if
+    the header is not a supported range and ValueError if the range
+    cannot be satisfied
+    """
+    match = RANGE_RE.match(range_header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        # Suffix range, the last bytes of the file
+        length = int(last)
+        if not length:
+            raise ValueError('Unsatisfiable range')
+
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+    last = int(last) if last else size - 1
+
+    if first > last or first >= size:
+        raise ValueError('Unsatisfiable range')
+
+    return first, min(last, size - 1)
+
+
+def _iter_file_range(file_path, first, length):
+    chunk_size = _get_chunk_size()
+
+    with open(file_path, 'rb') as f:
+        f.seek(first)
+
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+
+            length -= len(chunk)
+            yield chunk
+
+
+def _get_offload_response(file_path):
+    offload = getattr(settings, 'MEDIA_OFFLOAD', None)
+
+    # Compatibility with the previous X-Sendfile setting
+    if offload is None and getattr(settings, 'USE_XSENDFILE', False):
+        offload = 'x-sendfile'
+
+    if offload is None:
+        return None
+
+    response = HttpResponse()
+    if offload == 'x-sendfile':
+        response['X-Sendfile'] = smart_str(file_path)
+
+    elif offload == 'x-accel-redirect':
+        # The web server exposes the media root in an internal location
+        rel_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
+        prefix = getattr(settings, 'MEDIA_OFFLOAD_PREFIX', '/protected/')
+        response['X-Accel-Redirect'] = smart_str(prefix.rstrip('/') + '/' + rel_path)
+
+    else:
+        raise ValueError('Invalid media offload: ' + offload)
+
+    # The body is sent by the web server
+    response['Content-Length'] = '0'
+    return response
+
+
+def serve_file(request, file_path, etag=None):
+    """
+    Builds the response of a file download. The file is delivered by
+    the web server if MEDIA_OFFLOAD is configured, otherwise it is
+    streamed in fixed size chunks supporting single bytes ranges
+    """
+    response = _get_offload_response(file_path)
+    if response is not None:
+        return response
+
+    stat = os.stat(file_path)
+    size = stat.st_size
+    content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+    first, last = 0, size - 1
+    status = 200
+
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and size:
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */' + str(size)
+            response['Content-Length'] = '0'
+            return response
+
+        if byte_range is not None:
+            first, last = byte_range
+            status = 206
+
+    length = last - first + 1
+    response = HttpResponse(_iter_file_range(file_path, first, length), status=status, content_type=content_type)
+
+    # The content length must be set in order to avoid loading the
+    # whole content when processing the response
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+
+    if status == 206:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+
+    if etag:
+        response['ETag'] = '"' + etag + '"'
+
+    return response
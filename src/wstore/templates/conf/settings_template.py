@@ -42,6 +42,12 @@ DATABASES = {
     }
 }
 
+# Connection pool of the raw MongoDB client shared by each process. The
+# timeout is given in milliseconds, None means no timeout
+MONGODB_MAX_POOL_SIZE = 100
+MONGODB_TIMEOUT = None
+MONGODB_READ_PREFERENCE = 'PRIMARY'
+
 BASEDIR = path.dirname(path.abspath(__file__))
 
 STORE_NAME = '{{ store_name }}'
@@ -228,6 +234,103 @@ CLIENTS = {
 
 PAYMENT_CLIENT = CLIENTS[PAYMENT_METHOD]
 
+# Seconds to wait for the payment gateway in each request
+PAYMENT_TIMEOUT = 30
+
+# Arithmetic used by the price resolver, 'float' or 'decimal'. Decimal
+# mode makes exact calculations rounded to the currency minor unit
+PRICE_RESOLVER_MODE = 'float'
+
+# Pool of workers used to resolve the pending pay-per-use charges
+BATCH_CHARGING_WORKERS = 4
+BATCH_CHARGING_MODE = 'thread'
+BATCH_CHARGING_CHUNK_SIZE = 10
+
+# Subscription renovation scheduler, the look ahead is given in hours
+RENOVATION_LOOK_AHEAD = 0
+RENOVATION_BATCH_SIZE = 100
+
+# Invoice generation pipeline, invoices are compiled synchronously
+# if no workers are configured. The retry delay is given in seconds
+INVOICE_WORKERS = 2
+INVOICE_MAX_RETRIES = 3
+INVOICE_RETRY_DELAY = 30
+
+# Seconds after which the invoices being rendered by a dead process
+# are rendered again
+INVOICE_CLAIM_TIMEOUT = 300
+
+# Invoice PDF renderer, 'script' (wkhtmltopdf) or 'xhtml2pdf' (in process)
+INVOICE_RENDERER = 'script'
+
+# Background updates of the offerings search index. Updates are applied
+# in batches after the delay, the timeouts are given in seconds. Failed
+# updates are discarded after the maximum number of retries
+INDEX_UPDATE_BATCH_SIZE = 100
+INDEX_UPDATE_DELAY = 1
+INDEX_WRITER_TIMEOUT = 30
+INDEX_UPDATE_MAX_RETRIES = 3
+
+# CDR outbox dispatcher, CDRs are only sent by the dispatchcdrs command
+# if no workers are configured. The retry delay is given in seconds
+CDR_WORKERS = 2
+CDR_BATCH_SIZE = 100
+CDR_MAX_RETRIES = 10
+CDR_RETRY_DELAY = 30
+
+# Seconds to wait for the RSS when sending CDRs and seconds after which
+# the CDRs being sent by a dead process are sent again. The request
+# timeout must be lower than half of the claim timeout
+CDR_REQUEST_TIMEOUT = 60
+CDR_CLAIM_TIMEOUT = 300
+
+# Seconds the RSS, site domain and units are cached in each process
+CONFIG_CACHE_TTL = 60
+
+# Seconds the tag co-occurrence counts are kept in memory. Changes made
+# in other processes are loaded when they expire
+TAG_MODEL_TTL = 60
+
+# Maximum number of offerings that can be requested from the newest
+# and top rated rankings
+RANKING_SIZE = 24
+
+# Cache used to keep the responses of the catalogue read APIs, None
+# disables the response cache
+RESPONSE_CACHE = 'responses'
+
+# Seconds a cached response is kept
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Use the memcached backend in order to share the cached responses
+# between the server processes:
+# 'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+# 'LOCATION': '127.0.0.1:11211',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'wstore-responses',
+    }
+}
+
+# Size in bytes of the chunks used to write the uploaded resources and
+# to stream the downloaded files
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Delegates the delivery of the media files to the web server, supported
+# values are None, 'x-sendfile' (Apache mod_xsendfile) and
+# 'x-accel-redirect' (nginx). For nginx MEDIA_OFFLOAD_PREFIX is the
+# internal location that maps to MEDIA_ROOT
+MEDIA_OFFLOAD = None
+MEDIA_OFFLOAD_PREFIX = '/protected/'
+
+# Seconds the resource plugins are cached in each process. Plugins
+# installed or removed from other processes are checked with the same period
+PLUGIN_CACHE_TTL = 60
+
 RESOURCE_INDEX_DIR = path.join(BASEDIR, path.join('wstore', path.join('admin', 'indexes')))
 
 NOTIF_CERT_FILE = None
@@ -60,6 +60,8 @@ urlpatterns = patterns('',
     url(r'^api/administration/organizations/?$', org_views.OrganizationCollection(permitted_methods=('GET', 'POST'))),
     url(r'^api/administration/units/?$', admin_views.UnitCollection(permitted_methods=('GET', 'POST'))),
     url(r'^api/administration/currency/?$', admin_views.CurrencyCollection(permitted_methods=('GET', 'POST'))),
+    url(r'^api/administration/payments/latency/?$', charging_views.PaymentLatencyCollection(permitted_methods=('GET',))),
+    url(r'^api/administration/database/stats/?$', admin_views.DatabaseStatsCollection(permitted_methods=('GET',))),
     url(r'^api/administration/currency/(?P<currency>[\w -]+)/?$', admin_views.CurrencyEntry(permitted_methods=('DELETE', 'PUT'))),
     url(r'^api/administration/marketplaces/(?P<market>[\w -]+)/?$', market_views.MarketplaceEntry(permitted_methods=('DELETE',))),
     url(r'^api/administration/repositories/(?P<repository>[\w -]+)/?$', rep_views.RepositoryEntry(permitted_methods=('DELETE',))),
@@ -81,6 +83,7 @@ urlpatterns = patterns('',
     url(r'^api/offering/resources/(?P<provider>[\w -]+)/(?P<name>[\w -]+)/(?P<version>[\d.]+)/?$', offering_views.ResourceEntry(permitted_methods=('DELETE', 'POST', 'PUT'))),
     url(r'^api/offering/resources/?$', offering_views.ResourceCollection(permitted_methods=('GET', 'POST'))),
     url(r'^api/offering/resources/plugins?$', plugins_views.PluginCollection(permitted_methods=('GET', ))),
+    url(r'^api/administration/plugins/latency/?$', plugins_views.PluginLatencyCollection(permitted_methods=('GET',))),
     url(r'^api/offering/applications/?$', offering_views.ApplicationCollection(permitted_methods=('GET',))),
     url(r'^api/contracting/?$', contracting_views.PurchaseCollection(permitted_methods=('POST',))),
     url(r'^api/contracting/form/?$', contracting_views.PurchaseFormCollection(permitted_methods=('POST', 'GET'))),
@@ -88,6 +91,7 @@ urlpatterns = patterns('',
     url(r'^api/contracting/(?P<reference>[\w]+)/accept/?$', charging_views.PayPalConfirmation(permitted_methods=('GET',))),
     url(r'^api/contracting/(?P<reference>[\w]+)/cancel/?$', charging_views.PayPalCancelation(permitted_methods=('GET',))),
     url(r'^api/contracting/(?P<reference>[\w]+)/accounting/?$', charging_views.ServiceRecordCollection(permitted_methods=('POST', 'GET'))),
+    url(r'^api/contracting/(?P<reference>[\w]+)/accounting/batch/?$', charging_views.ServiceRecordBatchCollection(permitted_methods=('POST',))),
     url(r'^api/search/keyword/(?P<text>[\w -]+)/?$', search_views.SearchEntry(permitted_methods=('GET',))),
     url(r'^api/search/tag/(?P<tag>[\w -]+)/?$', tagging_views.SearchTagEntry(permitted_methods=('GET',))),
     url(r'^api/search/resource/(?P<org>[\w -]+)/(?P<name>[\w -]+)/(?P<version>[\d.]+)/?$', search_views.SearchByResourceEntry(permitted_methods=('GET',))),
@@ -25,15 +25,13 @@ import smtplib
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
 from django.conf import settings
-from django.utils.encoding import smart_str
-from django.views.static import serve
 from django.contrib.auth.models import User
-from django.http import HttpResponse
 from django.utils.safestring import mark_safe
 
 from store_commons.utils.http import build_response, authentication_required, \
 supported_request_mime_types
 from wstore.store_commons.resource import Resource as API_Resource
+from wstore.store_commons.utils.files import serve_file
 from wstore.models import UserProfile, Organization
 from wstore.models import Purchase, Resource, Offering
 from wstore.offerings.offerings_management import get_offering_info
@@ -245,6 +243,7 @@ class ServeMedia(API_Resource):
             return build_response(request, 415, 'Method not supported')
 
         dir_path = os.path.join(settings.MEDIA_ROOT, path)
+        etag = None
 
         # Protect the resources from not authorized downloads
         if dir_path.endswith('resources') :
@@ -290,6 +289,8 @@ class ServeMedia(API_Resource):
                     if not found:
                         return build_response(request, 404, 'Not found')
 
+            etag = resource.content_hash or None
+
         if dir_path.endswith('bills'):
             if request.user.is_anonymous():
                 return build_response(request, 401, 'Unauthorized')
@@ -310,9 +311,4 @@ class ServeMedia(API_Resource):
         if not os.path.isfile(local_path):
             return build_response(request, 404, 'Not found')
 
-        if not getattr(settings, 'USE_XSENDFILE', False):
-            return serve(request, local_path, document_root='/')
-        else:
-            response = HttpResponse()
-            response['X-Sendfile'] = smart_str(local_path)
-            return response
+        return serve_file(request, local_path, etag=etag)